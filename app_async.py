@@ -0,0 +1,896 @@
+import os
+import asyncio
+import subprocess
+import time
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from quart import Quart, Response, request, jsonify, send_file, redirect
+from quart_cors import cors
+from werkzeug.datastructures import ContentRange
+from prometheus_client import Gauge, generate_latest, CONTENT_TYPE_LATEST
+from app_rapido import (
+    logger, registro_jobs, progresso_jobs, cache_fontes, zelador_disco, limitador_hosts,
+    disjuntor_upstream, jobs_em_andamento, lock_jobs_em_andamento,
+    MAX_WORKERS_DOWNLOAD, MAX_WORKERS_CORTE, MAX_STREAMS, MAX_DURACAO_STREAM, TAMANHO_BLOCO_STREAM,
+    INTERVALO_HEARTBEAT_SSE, MODO_ENVIO_ARQUIVOS, PREFIXO_X_ACCEL, CACHE_ARTEFATOS_SEGUNDOS,
+    AUDIO_FILES_DIR, TEMP_DIR, EstacionarJob, CircuitoAberto, DependenciaAusente,
+    chave_corte, extrair_video_id, sanitizar_nome_arquivo, espera_circuito, anunciar_retentativa,
+    ler_pedido_corte, ler_pedido_lote, corte_pronto, corte_em_andamento, finalizar_job_em_andamento,
+    etapa_download, obter_fonte_completa, liberar_fonte, arquivos_corte, resultado_corte,
+    preparar_corte_lote, aplicar_corte_lote, remover_parciais_lote, concluir_clipes, clipes_gerados,
+    comando_recodificacao,
+    comando_lote, comando_corte_stream, gancho_progresso_corte, observar_total, registrar_falha,
+    metrica_corte, metrica_bytes_entregues, metrica_workers_ativos, descrever_job, evento_sse,
+    evento_final_sse, codec_saida, mimetype_artefato, MIMETYPE_POR_EXTENSAO,
+    ler_pedido_picos, carregar_picos, obter_picos, janela_picos, MAX_PICOS_SIMULTANEOS,
+    PREVIAS_DIR, MAX_DURACAO_PREVIA, MAX_PREVIAS_SIMULTANEAS, chave_previa, comando_previa,
+    armazem, espelho_estado, caminho_local, publicar_artefato, publicar_clipes,
+    MODO_EXECUCAO, FilaCheia, fila_jobs, acompanhamento_registro, argumentos_corte, argumentos_lote,
+    AQUECIMENTO, aquecimento, relatorio_inicializacao, concluir_inicializacao, pool_youtubedl
+)
+from comum import (
+    BORDA_CORTE_SEGUNDOS, EXTENSAO_POR_CODEC, comando_analise, interpretar_analise, comando_pacotes, escolher_pacote,
+    planejar_corte_hibrido, escrever_lista_concat, remover_temporarios_corte, usar_corte_hibrido
+)
+
+# RUNTIME ASYNCIO (ASGI): um job é uma task, não uma thread.
+# ffmpeg/ffprobe rodam com asyncio.create_subprocess_exec e as esperas (retentativas, SSE, semáforos)
+# ficam no event loop; só as chamadas bloqueantes do yt-dlp usam o executor limitado.
+# Rodar com: hypercorn app_async:app (ou python app_async.py)
+app = Quart(__name__)
+app = cors(app, allow_origin='*')
+
+MAX_JOBS_ASYNC = int(os.environ.get('MAX_JOBS_ASYNC', 500))  # Jobs em andamento por processo (acima: 429)
+RETRY_AFTER_JOBS_LOTADOS = 30
+
+executor_downloads = ThreadPoolExecutor(max_workers=MAX_WORKERS_DOWNLOAD, thread_name_prefix='yt-dlp')
+
+class RuntimeAsync:
+    """Recursos presos ao event loop (criados em before_serving) e jobs em andamento"""
+
+    def __init__(self):
+        self.loop = None
+        self.semaforo_corte = None
+        self.semaforo_streams = None
+        self.semaforo_previas = None
+        self.semaforo_picos = None
+        self.tarefas = {}  # id_processo -> Task
+        self.esperas = {}  # id_processo -> {asyncio.Event}: conexões SSE aguardando progresso
+        self.cortes_ativos = 0
+        self.downloads_ativos = 0
+
+    def iniciar(self):
+        self.loop = asyncio.get_running_loop()
+        self.semaforo_corte = asyncio.Semaphore(MAX_WORKERS_CORTE)
+        self.semaforo_streams = asyncio.Semaphore(MAX_STREAMS)
+        self.semaforo_previas = asyncio.Semaphore(MAX_PREVIAS_SIMULTANEAS)
+        self.semaforo_picos = asyncio.Semaphore(MAX_PICOS_SIMULTANEOS)
+        progresso_jobs.ouvintes.append(self.notificar)
+
+    def notificar(self, id_processo):
+        """Ouvinte do ProgressoJobs: pode ser chamado de qualquer thread"""
+        if id_processo in self.esperas:
+            try:
+                self.loop.call_soon_threadsafe(self._acordar, id_processo)
+            except RuntimeError:
+                pass  # Loop já encerrado
+
+    def _acordar(self, id_processo):
+        for evento in self.esperas.get(id_processo, ()):
+            evento.set()
+
+    async def aguardar_progresso(self, id_processo, versao, timeout):
+        """Versão asyncio de ProgressoJobs.aguardar: nenhuma thread presa por conexão"""
+        evento = asyncio.Event()
+        self.esperas.setdefault(id_processo, set()).add(evento)  # Antes de ler: nenhuma publicação se perde
+        try:
+            estado = progresso_jobs.aguardar(id_processo, versao, 0)
+            if estado and estado['versao'] > versao:
+                return estado
+            await asyncio.wait_for(evento.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            esperas = self.esperas.get(id_processo)
+            esperas.discard(evento)
+            if not esperas:
+                del self.esperas[id_processo]
+        return progresso_jobs.aguardar(id_processo, versao, 0)
+
+    def disparar(self, id_processo, corotina):
+        tarefa = asyncio.ensure_future(corotina)
+        self.tarefas[id_processo] = tarefa
+        tarefa.add_done_callback(lambda _: self.tarefas.pop(id_processo, None))
+
+    async def baixar(self, funcao, *args):
+        """Chamada bloqueante do yt-dlp no executor limitado"""
+        self.downloads_ativos += 1
+        try:
+            return await self.loop.run_in_executor(executor_downloads, funcao, *args)
+        finally:
+            self.downloads_ativos -= 1
+
+    def estatisticas(self):
+        return {
+            'jobs': len(self.tarefas),
+            'max_jobs': MAX_JOBS_ASYNC,
+            'downloads_ativos': self.downloads_ativos,
+            'max_downloads': MAX_WORKERS_DOWNLOAD,
+            'cortes_ativos': self.cortes_ativos,
+            'max_cortes': MAX_WORKERS_CORTE,
+            'conexoes_progresso': sum(len(esperas) for esperas in self.esperas.values())
+        }
+
+runtime = RuntimeAsync()
+metrica_jobs_async = Gauge('ytcut_jobs_async', 'Jobs em andamento no runtime asyncio')
+metrica_jobs_async.set_function(lambda: len(runtime.tarefas))
+metrica_workers_ativos.labels('download_async').set_function(lambda: runtime.downloads_ativos)
+metrica_workers_ativos.labels('corte_async').set_function(lambda: runtime.cortes_ativos)
+
+@app.before_serving
+async def iniciar_runtime():
+    runtime.iniciar()
+    if AQUECIMENTO:
+        aquecimento.iniciar()  # Thread própria: o loop já atende enquanto yt-dlp e numpy carregam
+    if MODO_EXECUCAO == 'fila':
+        acompanhamento_registro.iniciar()  # Progresso dos jobs que rodam no worker.py
+    logger.info(f"⚙️  Runtime asyncio: {MAX_JOBS_ASYNC} jobs, {MAX_WORKERS_DOWNLOAD} downloads, {MAX_WORKERS_CORTE} cortes")
+
+@app.after_serving
+async def encerrar_runtime():
+    progresso_jobs.ouvintes.remove(runtime.notificar)
+    executor_downloads.shutdown(wait=False)
+
+# FFMPEG ASSÍNCRONO (mesmos comandos do app_rapido, sem thread esperando o processo)
+async def executar_ffmpeg_async(comando, timeout, ao_progredir=None, deslocamento=0.0):
+    """executar_ffmpeg no event loop; com ao_progredir, acompanha o -progress"""
+    if ao_progredir:
+        comando = [comando[0], '-progress', 'pipe:1', '-nostats'] + comando[1:]
+    processo = await asyncio.create_subprocess_exec(*comando, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+
+    async def ler_progresso():
+        async for linha in processo.stdout:
+            chave, _, valor = linha.decode(errors='replace').strip().partition('=')
+            if chave == 'out_time_us' and valor.isdigit():
+                ao_progredir(deslocamento + int(valor) / 1_000_000)
+
+    async def acompanhar():
+        _, erros = await asyncio.gather(ler_progresso(), processo.stderr.read())
+        await processo.wait()
+        return b'', erros
+
+    try:
+        saida, erros = await asyncio.wait_for(acompanhar() if ao_progredir else processo.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(comando, timeout)
+    finally:
+        # Timeout ou task cancelada: não deixar o ffmpeg órfão
+        if processo.returncode is None:
+            processo.kill()
+            await processo.wait()
+    return subprocess.CompletedProcess(comando, processo.returncode,
+                                       saida.decode(errors='replace'), erros.decode(errors='replace'))
+
+async def drenar_stderr(processo, limite=4000):
+    """Lê o stderr até o fim (o pipe nunca enche) e guarda só o final, que é onde o ffmpeg explica a falha"""
+    final = b''
+    async for linha in processo.stderr:
+        final = (final + linha)[-limite:]
+    return final.decode(errors='replace')
+
+async def iniciar_ffmpeg_stream(comando):
+    """Sobe o ffmpeg de stream/prévia e lê o primeiro bloco antes de responder: se ele morre sem produzir
+    nada, a falha vira 500 com o stderr em vez de um 200 vazio. Retorna (processo, tarefa_stderr, primeiro_bloco)."""
+    processo = await asyncio.create_subprocess_exec(*comando, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+    erros = asyncio.ensure_future(drenar_stderr(processo))
+    try:
+        primeiro = await processo.stdout.read(TAMANHO_BLOCO_STREAM)
+        if not primeiro and await processo.wait() != 0:
+            raise Exception(f"FFmpeg falhou (código {processo.returncode}): {(await erros)[-300:]}")
+    except BaseException:
+        if processo.returncode is None:
+            processo.kill()
+            await processo.wait()
+        erros.cancel()
+        raise
+    return processo, erros, primeiro
+
+async def analisar_audio_async(arquivo):
+    resultado = await executar_ffmpeg_async(comando_analise(arquivo), 30)
+    if resultado.returncode != 0:
+        return None
+    return interpretar_analise(resultado.stdout)
+
+async def localizar_pacote_async(arquivo, instante, inicio_arquivo, depois=True):
+    resultado = await executar_ffmpeg_async(comando_pacotes(arquivo, instante, inicio_arquivo), 30)
+    if resultado.returncode != 0:
+        return None
+    return escolher_pacote(resultado.stdout, instante, inicio_arquivo, depois)
+
+async def cortar_hibrido_async(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info, ao_progredir=None):
+    inicio_miolo = await localizar_pacote_async(arquivo_entrada, inicio_segundos + BORDA_CORTE_SEGUNDOS, info['inicio'])
+    fim_miolo = await localizar_pacote_async(arquivo_entrada, fim_segundos - BORDA_CORTE_SEGUNDOS, info['inicio'],
+                                             depois=False)
+    if inicio_miolo is None or fim_miolo is None or fim_miolo <= inicio_miolo:
+        return False
+
+    plano = planejar_corte_hibrido(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info,
+                                   inicio_miolo, fim_miolo, TEMP_DIR)
+    if plano is None:
+        return False
+    try:
+        for comando, deslocamento in plano['partes']:
+            resultado = await executar_ffmpeg_async(comando, 180, ao_progredir, deslocamento)
+            if resultado.returncode != 0:
+                logger.warning(f"⚠️  Parte do corte híbrido falhou: {resultado.stderr[:200]}")
+                return False
+
+        escrever_lista_concat(plano)
+        resultado = await executar_ffmpeg_async(plano['concat'], 180)
+        return resultado.returncode == 0 and os.path.exists(arquivo_saida)
+    finally:
+        remover_temporarios_corte(plano)
+
+async def cortar_audio_preciso_async(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, ao_progredir=None,
+                                     info=None):
+    """cortar_audio_preciso com subprocessos asyncio. Retorna 'hibrido' ou 'recodificacao'."""
+    try:
+        logger.info(f"✂️  Cortando áudio: {inicio_segundos}s → {fim_segundos}s ({fim_segundos - inicio_segundos}s)")
+
+        info = info or await analisar_audio_async(arquivo_entrada)
+        if usar_corte_hibrido(info, arquivo_saida, inicio_segundos, fim_segundos):
+            if await cortar_hibrido_async(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info,
+                                          ao_progredir):
+                logger.info(f"✅ Corte híbrido concluído: {os.path.getsize(arquivo_saida) / (1024 * 1024):.2f} MB")
+                return 'hibrido'
+            logger.info("🔄 Corte híbrido indisponível, recodificando o trecho inteiro...")
+
+        resultado = await executar_ffmpeg_async(
+            comando_recodificacao(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos), 180, ao_progredir
+        )
+        if resultado.returncode == 0 and os.path.exists(arquivo_saida):
+            logger.info(f"✅ Corte com recompressão concluído: {os.path.getsize(arquivo_saida) / (1024 * 1024):.2f} MB")
+            return 'recodificacao'
+
+        raise Exception("FFmpeg falhou na recodificação")
+
+    except subprocess.TimeoutExpired:
+        raise Exception("Timeout no corte de áudio")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise Exception(f"Erro no corte: {e}")
+
+async def cortar_lote_async(arquivo_entrada, cortes):
+    logger.info(f"✂️  Cortando lote de {len(cortes)} clipes numa única passada...")
+    inicio_etapa = time.time()
+    try:
+        resultado = await executar_ffmpeg_async(comando_lote(arquivo_entrada, cortes), 600)
+    except subprocess.TimeoutExpired:
+        raise Exception("Timeout no corte do lote")
+    metrica_corte.labels('lote').observe(time.time() - inicio_etapa)
+    if resultado.returncode != 0:
+        logger.warning(f"⚠️  FFmpeg do lote falhou: {resultado.stderr[:200]}")
+    return clipes_gerados(cortes)
+
+# JOBS
+async def obter_fonte_async(id_processo, funcao, *args):
+    """Download com retentativas: o job estacionado espera no event loop, sem ocupar o executor.
+    `funcao(*args, tentativa, estacionar)` é etapa_download ou obter_fonte_completa."""
+    tentativa = 0
+    while True:
+        try:
+            return await runtime.baixar(funcao, *args, tentativa, True)
+        except EstacionarJob as e:
+            liberar_fonte(None, id_processo)
+            anunciar_retentativa(id_processo, e)
+            await asyncio.sleep(e.espera)
+            tentativa = e.tentativa
+            registro_jobs.atualizar(id_processo, etapa='download')
+
+async def executar_processamento_async(url, inicio, fim, id_processo, nome_arquivo, modo_download, formato_saida,
+                                      chave):
+    fonte = None
+    try:
+        registro_jobs.atualizar(id_processo, etapa='iniciando')
+        fonte = await obter_fonte_async(id_processo, etapa_download, url, inicio, fim, id_processo, modo_download)
+        registro_jobs.atualizar(id_processo, etapa='aguardando_corte')
+        async with runtime.semaforo_corte:
+            resultado = await etapa_corte_async(fonte, inicio, fim, id_processo, nome_arquivo, chave, formato_saida)
+        await asyncio.to_thread(publicar_artefato, resultado['caminho'])
+        registro_jobs.concluir(id_processo, resultado['arquivo'], resultado['caminho'], resultado['caminho_corte'])
+        observar_total(id_processo, fonte, resultado['caminho_corte'])
+        logger.info(f"🎉 {id_processo} - SUCESSO COMPLETO!")
+    except Exception as e:
+        registro_jobs.falhar(id_processo, str(e))
+        registrar_falha('corte' if fonte else 'download', e)
+        logger.error(f"❌ {id_processo} - FALHA: {e}")
+    finally:
+        finalizar_job_em_andamento(chave)
+        liberar_fonte(fonte, id_processo)
+
+async def etapa_corte_async(fonte, inicio_segundos, fim_segundos, id_processo, nome_arquivo, chave, formato_saida):
+    info = await analisar_audio_async(fonte['arquivo'])
+    extensao = EXTENSAO_POR_CODEC[codec_saida(formato_saida, info)]
+    nome_final, arquivo_final, arquivo_parcial = arquivos_corte(fonte, id_processo, nome_arquivo, chave, extensao)
+
+    logger.info("🔧 APLICANDO CORTE TEMPORAL...")
+    registro_jobs.atualizar(id_processo, etapa='corte')
+    deslocamento = fonte['deslocamento']
+    inicio_etapa = time.time()
+    runtime.cortes_ativos += 1
+    try:
+        caminho_corte = await cortar_audio_preciso_async(
+            fonte['arquivo'], arquivo_parcial, inicio_segundos - deslocamento, fim_segundos - deslocamento,
+            gancho_progresso_corte(id_processo, fim_segundos - inicio_segundos), info
+        )
+        metrica_corte.labels(caminho_corte).observe(time.time() - inicio_etapa)
+        os.replace(arquivo_parcial, arquivo_final)
+    finally:
+        runtime.cortes_ativos -= 1
+        if os.path.exists(arquivo_parcial):
+            os.remove(arquivo_parcial)
+
+    return resultado_corte(id_processo, nome_final, arquivo_final, inicio_segundos, fim_segundos, caminho_corte)
+
+async def executar_lote_async(url, clipes, id_processo, formato_saida):
+    fonte = None
+    try:
+        registro_jobs.atualizar(id_processo, etapa='download')
+        video_id = extrair_video_id(url)
+        arquivo_fonte, titulo, em_cache, estrategia, formato = await obter_fonte_async(
+            id_processo, obter_fonte_completa, url, id_processo, video_id
+        )
+        fonte = {'arquivo': arquivo_fonte, 'titulo': titulo, 'deslocamento': 0,
+                 'video_id': video_id, 'em_cache': em_cache, 'estrategia': estrategia, 'formato': formato}
+        registro_jobs.atualizar(id_processo, etapa='aguardando_corte')
+        async with runtime.semaforo_corte:
+            pendentes, cortes = preparar_corte_lote(fonte, url, clipes, id_processo, formato_saida,
+                                                    await analisar_audio_async(fonte['arquivo']))
+            if pendentes:
+                runtime.cortes_ativos += 1
+                try:
+                    aplicar_corte_lote(pendentes, cortes, await cortar_lote_async(fonte['arquivo'], cortes))
+                finally:
+                    runtime.cortes_ativos -= 1
+                    remover_parciais_lote(cortes)
+        clipes = concluir_clipes(clipes)
+        if any(clipe['status'] == 'concluido' for clipe in clipes):
+            await asyncio.to_thread(publicar_clipes, clipes)
+            registro_jobs.concluir_lote(id_processo, clipes)
+            observar_total(id_processo, fonte, 'lote')
+            logger.info(f"🎉 {id_processo} - LOTE CONCLUÍDO!")
+        else:
+            registro_jobs.atualizar(id_processo, clipes=json.dumps(clipes))
+            registro_jobs.falhar(id_processo, 'Nenhum clipe do lote foi gerado')
+    except Exception as e:
+        registro_jobs.falhar(id_processo, str(e))
+        registrar_falha('corte' if fonte else 'download', e)
+        logger.error(f"❌ {id_processo} - FALHA NO LOTE: {e}")
+    finally:
+        liberar_fonte(fonte, id_processo)
+
+def recusar_se_circuito_aberto(url):
+    espera = espera_circuito(url)
+    if not espera:
+        return None
+    return recusa(503, 'O YouTube está recusando downloads no momento, tente novamente mais tarde', espera)
+
+def recusa(status, mensagem, retry_after):
+    return jsonify({'erro': mensagem, 'retry_after': retry_after}), status, {'Retry-After': str(retry_after)}
+
+def recusar_se_lotado():
+    if len(runtime.tarefas) < MAX_JOBS_ASYNC:
+        return None
+    logger.warning(f"🚦 {len(runtime.tarefas)} jobs em andamento, recusando processo")
+    return recusa(429, 'Servidor ocupado, tente novamente mais tarde', RETRY_AFTER_JOBS_LOTADOS)
+
+def enfileirar_job(tipo, argumentos, chave=None, clipes=None):
+    """MODO_EXECUCAO=fila: grava o job na fila durável; quem executa é o worker.py"""
+    id_processo = str(uuid.uuid4())[:8]
+    registro_jobs.criar(id_processo, etapa='na_fila', chave=chave)
+    if clipes:
+        registro_jobs.atualizar(id_processo, clipes=json.dumps(clipes))
+    try:
+        posicao = fila_jobs.enfileirar(id_processo, tipo, argumentos, chave)
+    except FilaCheia as e:
+        registro_jobs.remover(id_processo)
+        logger.warning(f"🚦 Fila durável cheia, recusando processo (retry em {e.retry_after}s)")
+        return recusa(429, 'Servidor ocupado, tente novamente mais tarde', e.retry_after)
+    logger.info(f"📋 NOVO JOB NA FILA: {id_processo} ({tipo}, posição {posicao})")
+    return jsonify({'sucesso': True, 'id_processo': id_processo, 'mensagem': 'Processamento enfileirado',
+                    'posicao_fila': posicao})
+
+# ROTAS DA API (mesmo contrato do app_rapido)
+@app.route('/')
+async def home():
+    return jsonify({
+        'mensagem': 'YouTube Audio API - Solução Definitiva',
+        'status': '🟢 Online',
+        'versao': '4.0',
+        'runtime': 'asyncio',
+        'recursos': [
+            '6 Estratégias Anti-Bloqueio',
+            'URLs Alternativas',
+            'Sistema Stealth',
+            'Corte Preciso'
+        ]
+    })
+
+@app.route('/api/processar', methods=['POST'])
+async def processar_audio():
+    try:
+        try:
+            pedido = ler_pedido_corte(await request.get_json())
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
+        url, inicio, fim = pedido['url'], pedido['inicio'], pedido['fim']
+        nome_arquivo, modo_download = pedido['nome_arquivo'], pedido['modo_download']
+        formato_saida = pedido['formato_saida']
+
+        chave = chave_corte(url, inicio, fim, formato_saida)
+        reaproveitado = await asyncio.to_thread(corte_pronto, chave, nome_arquivo)  # Armazém: fora do loop e do lock
+        if reaproveitado:
+            return jsonify(reaproveitado)
+        with lock_jobs_em_andamento:
+            reaproveitado = corte_em_andamento(chave, nome_arquivo)
+            if reaproveitado:
+                return jsonify(reaproveitado)
+
+            resposta = recusar_se_circuito_aberto(url)
+            if resposta:
+                return resposta
+            if MODO_EXECUCAO == 'fila':
+                return enfileirar_job('corte', argumentos_corte(pedido, chave), chave)
+
+            resposta = recusar_se_lotado()
+            if resposta:
+                return resposta
+
+            id_processo = str(uuid.uuid4())[:8]
+            registro_jobs.criar(id_processo, etapa='iniciando', chave=chave)
+            jobs_em_andamento[chave] = id_processo
+
+        runtime.disparar(id_processo, executar_processamento_async(
+            url, inicio, fim, id_processo, nome_arquivo, modo_download, formato_saida, chave
+        ))
+        logger.info(f"📋 NOVO PROCESSO ULTRA-RESISTENTE: {id_processo} ({len(runtime.tarefas)} jobs em andamento)")
+
+        return jsonify({
+            'sucesso': True,
+            'id_processo': id_processo,
+            'mensagem': 'Processamento iniciado com sistema anti-bloqueio',
+            'detalhes': {
+                'estrategias': 6,
+                'modo_download': modo_download,
+                'formato_saida': formato_saida,
+                'inicio_segundos': inicio,
+                'fim_segundos': fim,
+                'duracao_corte': fim - inicio
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"💥 Erro em /api/processar: {e}")
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/processar/lote', methods=['POST'])
+async def processar_lote():
+    try:
+        try:
+            url, clipes, formato_saida = ler_pedido_lote(await request.get_json())
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
+
+        resposta = recusar_se_circuito_aberto(url)
+        if resposta:
+            return resposta
+        if MODO_EXECUCAO == 'fila':
+            return enfileirar_job('lote', argumentos_lote(url, clipes, formato_saida), clipes=clipes)
+
+        resposta = recusar_se_lotado()
+        if resposta:
+            return resposta
+
+        id_processo = str(uuid.uuid4())[:8]
+        registro_jobs.criar(id_processo, etapa='download')
+        registro_jobs.atualizar(id_processo, clipes=json.dumps(clipes))
+        runtime.disparar(id_processo, executar_lote_async(url, clipes, id_processo, formato_saida))
+        logger.info(f"📋 NOVO LOTE: {id_processo} ({len(clipes)} clipes)")
+
+        return jsonify({
+            'sucesso': True,
+            'id_processo': id_processo,
+            'mensagem': 'Lote iniciado',
+            'clipes': len(clipes)
+        })
+
+    except Exception as e:
+        logger.error(f"💥 Erro em /api/processar/lote: {e}")
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/processar/stream', methods=['POST'])
+async def processar_stream():
+    try:
+        pedido = ler_pedido_corte(await request.get_json())
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    url, inicio, fim = pedido['url'], pedido['inicio'], pedido['fim']
+    nome_arquivo, modo_download = pedido['nome_arquivo'], pedido['modo_download']
+
+    if fim - inicio > MAX_DURACAO_STREAM:
+        return jsonify({'erro': f'Streaming limitado a cortes de {MAX_DURACAO_STREAM}s; use /api/processar'}), 400
+
+    resposta = recusar_se_circuito_aberto(url)
+    if resposta:
+        return resposta
+
+    if runtime.semaforo_streams.locked():
+        return recusa(429, 'Muitos streams simultâneos, tente novamente', 5)
+    await runtime.semaforo_streams.acquire()
+
+    id_processo = str(uuid.uuid4())[:8]
+    fonte = None
+    processo = None
+    try:
+        logger.info(f"📡 NOVO STREAM: {id_processo}")
+        # Entre tentativas espera no event loop (obter_fonte_async), sem prender uma thread do executor
+        fonte = await obter_fonte_async(id_processo, etapa_download, url, inicio, fim, id_processo, modo_download)
+        codec = codec_saida(pedido['formato_saida'],
+                            await analisar_audio_async(fonte['arquivo']) if pedido['formato_saida'] == 'original' else None)
+        processo, erros, primeiro = await iniciar_ffmpeg_stream(
+            comando_corte_stream(fonte['arquivo'], inicio - fonte['deslocamento'], fim - fonte['deslocamento'], codec)
+        )
+    except CircuitoAberto as e:
+        runtime.semaforo_streams.release()
+        return recusa(503, str(e), e.retry_after)
+    except Exception as e:
+        liberar_fonte(fonte, id_processo)
+        runtime.semaforo_streams.release()
+        registrar_falha('stream', e)
+        logger.error(f"❌ {id_processo} - FALHA NO STREAM: {e}")
+        return jsonify({'erro': str(e)}), 500
+    zelador_disco.marcar_uso(fonte['arquivo'])
+
+    async def gerar():
+        try:
+            bloco = primeiro
+            while bloco:
+                metrica_bytes_entregues.labels('stream').inc(len(bloco))
+                yield bloco
+                bloco = await processo.stdout.read(TAMANHO_BLOCO_STREAM)
+            if await processo.wait() == 0:
+                logger.info(f"🎉 {id_processo} - STREAM CONCLUÍDO")
+            else:
+                # Os cabeçalhos já saíram com 200: o cliente recebe um arquivo truncado, o log diz por quê
+                erro = await erros
+                registrar_falha('stream', Exception(erro))
+                logger.error(f"❌ {id_processo} - ffmpeg terminou com código {processo.returncode} "
+                             f"no meio do stream: {erro[-300:]}")
+        finally:
+            # Cliente desconectado (task cancelada) ou fim normal: encerrar o ffmpeg e liberar a fonte
+            if processo.returncode is None:
+                processo.kill()
+                await processo.wait()
+                logger.info(f"🔌 {id_processo} - Cliente desconectou, ffmpeg encerrado")
+            erros.cancel()
+            zelador_disco.liberar_uso(fonte['arquivo'])
+            liberar_fonte(fonte, id_processo)
+            runtime.semaforo_streams.release()
+
+    nome_base = sanitizar_nome_arquivo(nome_arquivo) or sanitizar_nome_arquivo(fonte['titulo']) or f"audio_{id_processo}"
+    extensao = EXTENSAO_POR_CODEC[codec]
+    resposta = Response(gerar(), mimetype=MIMETYPE_POR_EXTENSAO[extensao], headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(nome_base)}{extensao}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    resposta.timeout = None  # O corte pode levar mais que o timeout padrão de resposta
+    return resposta
+
+@app.route('/api/previa')
+async def previa_corte():
+    try:
+        pedido = ler_pedido_corte(request.args)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    url, inicio, fim = pedido['url'], pedido['inicio'], pedido['fim']
+
+    if fim - inicio > MAX_DURACAO_PREVIA:
+        return jsonify({'erro': f'Prévia limitada a {MAX_DURACAO_PREVIA}s'}), 400
+
+    chave = chave_previa(url, inicio, fim)
+    caminho = os.path.join(PREVIAS_DIR, f"{chave}.mp3")
+    nome = f"previa_{extrair_video_id(url) or chave}_{inicio}_{fim}.mp3"
+    if os.path.exists(caminho):
+        return await enviar_artefato(caminho, nome, anexo=False, rota='previa')
+
+    resposta = recusar_se_circuito_aberto(url)
+    if resposta:
+        return resposta
+
+    if runtime.semaforo_previas.locked():
+        return recusa(429, 'Muitas prévias simultâneas, tente novamente', 2)
+    await runtime.semaforo_previas.acquire()
+
+    id_processo = str(uuid.uuid4())[:8]
+    fonte = None
+    try:
+        fonte = await obter_fonte_async(id_processo, etapa_download, url, inicio, fim, id_processo, 'trecho')
+        processo, erros, primeiro = await iniciar_ffmpeg_stream(
+            comando_previa(fonte['arquivo'], inicio - fonte['deslocamento'], fim - fonte['deslocamento'])
+        )
+    except CircuitoAberto as e:
+        runtime.semaforo_previas.release()
+        return recusa(503, str(e), e.retry_after)
+    except Exception as e:
+        liberar_fonte(fonte, id_processo)
+        runtime.semaforo_previas.release()
+        registrar_falha('previa', e)
+        logger.error(f"❌ {id_processo} - FALHA NA PRÉVIA: {e}")
+        return jsonify({'erro': str(e)}), 500
+
+    async def gerar():
+        parcial = os.path.join(PREVIAS_DIR, f"{chave}.{id_processo}.parcial.mp3")
+        try:
+            with open(parcial, 'wb') as arquivo:
+                bloco = primeiro
+                while bloco:
+                    arquivo.write(bloco)
+                    metrica_bytes_entregues.labels('previa').inc(len(bloco))
+                    yield bloco
+                    bloco = await processo.stdout.read(TAMANHO_BLOCO_STREAM)
+            if await processo.wait() == 0:
+                os.replace(parcial, caminho)
+            else:
+                erro = await erros
+                registrar_falha('previa', Exception(erro))
+                logger.error(f"❌ {id_processo} - ffmpeg da prévia terminou com código {processo.returncode}: "
+                             f"{erro[-300:]}")
+        finally:
+            if processo.returncode is None:
+                processo.kill()
+                await processo.wait()
+            erros.cancel()
+            if os.path.exists(parcial):
+                os.remove(parcial)
+            liberar_fonte(fonte, id_processo)
+            runtime.semaforo_previas.release()
+
+    resposta = Response(gerar(), mimetype='audio/mpeg', headers={
+        'Content-Disposition': f"inline; filename*=UTF-8''{quote(nome)}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    resposta.timeout = None
+    return resposta
+
+@app.route('/api/picos')
+async def forma_de_onda():
+    try:
+        url, video_id, inicio, fim, pontos = ler_pedido_picos(request.args)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    try:
+        meta = carregar_picos(video_id)
+        if not meta:
+            resposta = recusar_se_circuito_aberto(url)
+            if resposta:
+                return resposta
+            if runtime.semaforo_picos.locked():
+                return recusa(429, 'Muitas formas de onda em cálculo, tente novamente', 5)
+            # Download e decodificação são bloqueantes: executor limitado, como os jobs
+            async with runtime.semaforo_picos:
+                meta = await runtime.baixar(obter_picos, url, video_id)
+        return jsonify(dict(janela_picos(video_id, meta, inicio, fim, pontos), sucesso=True, video_id=video_id))
+    except CircuitoAberto as e:
+        return recusa(503, str(e), e.retry_after)
+    except DependenciaAusente as e:
+        return jsonify({'erro': str(e)}), 501
+    except Exception as e:
+        registrar_falha('picos', e)
+        logger.error(f"❌ Falha na forma de onda de {video_id}: {e}")
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/fila')
+async def estatisticas_fila():
+    estatisticas = {
+        'sucesso': True,
+        'modo_execucao': MODO_EXECUCAO,
+        'runtime': runtime.estatisticas(),
+        'limitador': limitador_hosts.estatisticas(),
+        'disjuntor': disjuntor_upstream.estatisticas(),
+        'zelador': zelador_disco.estatisticas(),
+        'youtubedl': pool_youtubedl.estatisticas()
+    }
+    if MODO_EXECUCAO == 'fila':
+        estatisticas['fila_duravel'] = fila_jobs.estatisticas()
+    return jsonify(estatisticas)
+
+@app.route('/api/limpar', methods=['POST'])
+async def limpar_arquivos():
+    try:
+        relatorio = await asyncio.to_thread(zelador_disco.limpar)
+        return jsonify({
+            'sucesso': True,
+            'recuperado_bytes': sum(item['recuperado_bytes'] for item in relatorio.values()),
+            'diretorios': relatorio
+        })
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/metrics')
+async def metricas():
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/api/inicializacao')
+async def inicializacao():
+    return jsonify(dict(relatorio_inicializacao(), sucesso=True))
+
+@app.route('/api/cache')
+async def estatisticas_cache():
+    return jsonify({'sucesso': True, 'cache_fontes': cache_fontes.estatisticas(),
+                    'armazem': espelho_estado.estatisticas()})
+
+@app.route('/api/status/<id_processo>')
+async def verificar_status(id_processo):
+    try:
+        job = await asyncio.to_thread(registro_jobs.obter, id_processo)  # Sem o job local: consulta o armazém
+        if not job:
+            return jsonify({'erro': 'Processo não encontrado'}), 404
+        return jsonify(await asyncio.to_thread(descrever_job, job))  # Pode consultar o armazém
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/progresso/<id_processo>')
+async def progresso_sse(id_processo):
+    """SSE com o mesmo formato do app_rapido; cada conexão é só uma corrotina esperando um Event"""
+    job = await asyncio.to_thread(registro_jobs.obter, id_processo)
+    if not job:
+        return jsonify({'erro': 'Processo não encontrado'}), 404
+
+    async def gerar():
+        versao = 0
+        ultimo_envio = time.time()
+        while True:
+            estado = await runtime.aguardar_progresso(id_processo, versao, INTERVALO_HEARTBEAT_SSE)
+            if estado and estado['versao'] > versao:
+                versao = estado['versao']
+                yield evento_sse('progresso', {k: v for k, v in estado.items() if k != 'versao'}).encode()
+                ultimo_envio = time.time()
+
+            final = await asyncio.to_thread(evento_final_sse, id_processo, estado)  # Registro e armazém
+            if final:
+                yield final.encode()
+                return
+
+            if time.time() - ultimo_envio >= INTERVALO_HEARTBEAT_SSE:
+                yield b": heartbeat\n\n"
+                ultimo_envio = time.time()
+
+    resposta = Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    resposta.timeout = None
+    return resposta
+
+class CorpoProtegido:
+    """Corpo da resposta que avisa o zelador quando o envio termina (o Quart não tem call_on_close)"""
+
+    def __init__(self, corpo, ao_fechar):
+        self.corpo = corpo
+        self.ao_fechar = ao_fechar
+
+    async def __aenter__(self):
+        return await self.corpo.__aenter__()
+
+    async def __aexit__(self, *erro):
+        try:
+            return await self.corpo.__aexit__(*erro)
+        finally:
+            self.ao_fechar()
+
+async def enviar_artefato(caminho, nome_download, anexo=True, rota='download'):
+    """enviar_artefato do app_rapido: ETag da chave do conteúdo, Range/206, cache longo, x-accel/x-sendfile"""
+    etag = os.path.splitext(os.path.basename(caminho))[0]
+    zelador_disco.marcar_uso(caminho)
+    tamanho = os.path.getsize(caminho)
+
+    if MODO_ENVIO_ARQUIVOS in ('x-accel', 'x-sendfile'):
+        resposta = Response(b'', status=200, mimetype=mimetype_artefato(caminho))
+        if MODO_ENVIO_ARQUIVOS == 'x-accel':
+            relativo = os.path.relpath(caminho, AUDIO_FILES_DIR).replace(os.sep, '/')
+            resposta.headers['X-Accel-Redirect'] = PREFIXO_X_ACCEL + quote(relativo)
+        else:
+            resposta.headers['X-Sendfile'] = caminho
+        resposta.set_etag(etag)
+        resposta.last_modified = os.path.getmtime(caminho)
+        enviados = tamanho  # O corpo sai do servidor web; contamos o arquivo inteiro
+    else:
+        # O ETag padrão do Quart é por mtime/tamanho; o nosso é a chave do conteúdo
+        resposta = await send_file(caminho, mimetype=mimetype_artefato(caminho), add_etags=False)
+        resposta.set_etag(etag)
+        resposta.last_modified = os.path.getmtime(caminho)
+        await resposta.make_conditional(request, accept_ranges=True, complete_length=tamanho)
+        if resposta.status_code == 206:
+            # O Quart 0.19 desconta o fim do intervalo duas vezes no Content-Range
+            resposta.content_range = ContentRange('bytes', resposta.response.begin, resposta.response.end, tamanho)
+        enviados = resposta.content_length
+
+    if resposta.status_code in (200, 206):
+        metrica_bytes_entregues.labels(rota).inc(enviados or 0)
+
+    disposicao = 'attachment' if anexo else 'inline'
+    resposta.headers['Content-Disposition'] = f"{disposicao}; filename*=UTF-8''{quote(nome_download)}"
+
+    resposta.headers['Accept-Ranges'] = 'bytes'
+    resposta.cache_control.public = True
+    resposta.cache_control.max_age = CACHE_ARTEFATOS_SEGUNDOS
+    resposta.cache_control.immutable = True
+    resposta.response = CorpoProtegido(resposta.response, lambda: zelador_disco.liberar_uso(caminho))
+    return resposta
+
+async def resposta_artefato(caminho, nome_download):
+    """Do disco local ou redirecionando para o armazém (a consulta ao armazém roda fora do loop)"""
+    local = caminho_local(caminho)
+    if os.path.exists(local):
+        return await enviar_artefato(local, nome_download)
+    nome = os.path.basename(caminho)
+    if await asyncio.to_thread(armazem.existe, nome):
+        url = await asyncio.to_thread(armazem.url_download, nome, nome_download)
+        if url:
+            return redirect(url, code=302)
+    return None
+
+@app.route('/api/download/<id_processo>')
+async def download_audio(id_processo):
+    try:
+        job = await asyncio.to_thread(registro_jobs.obter, id_processo)
+        resposta = None
+        if job and job['estado'] == 'concluido' and job['caminho']:
+            resposta = await resposta_artefato(job['caminho'], job['arquivo'])
+        if resposta is None:
+            return jsonify({'erro': 'Arquivo não encontrado'}), 404
+        return resposta
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/download/<id_processo>/<int:indice>')
+async def download_clipe(id_processo, indice):
+    try:
+        job = await asyncio.to_thread(registro_jobs.obter, id_processo)
+        clipes = json.loads(job['clipes']) if job and job['clipes'] else []
+        clipe = next((c for c in clipes if c['indice'] == indice), None)
+        resposta = None
+        if clipe and clipe['status'] == 'concluido':
+            resposta = await resposta_artefato(clipe['caminho'], clipe['arquivo'])
+        if resposta is None:
+            return jsonify({'erro': 'Arquivo não encontrado'}), 404
+        return resposta
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+concluir_inicializacao('app_async')
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"0.0.0.0:{int(os.environ.get('PORT', 5000))}"]
+    config.keep_alive_timeout = 75  # Conexões de status/SSE ficam abertas
+
+    print("\n" + "="*70)
+    print("🚀 YOUTUBE AUDIO API - RUNTIME ASYNCIO (ASGI)")
+    print("="*70)
+    print(f"⚙️  {MAX_JOBS_ASYNC} jobs simultâneos, {MAX_WORKERS_DOWNLOAD} downloads, {MAX_WORKERS_CORTE} cortes")
+    print(f"🌐 Servidor iniciando em {config.bind[0]}...")
+    print("="*70)
+
+    asyncio.run(serve(app, config))
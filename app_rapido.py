@@ -1,29 +1,181 @@
+import time
+INICIO_IMPORTACAO = time.perf_counter()  # Referência do relatório de inicialização
 import os
+import sys
 import logging
-from flask import Flask, request, jsonify, send_file
+import importlib.util
+from flask import Flask, Response, request, jsonify, send_file, redirect
 from flask_cors import CORS
-import yt_dlp
 import uuid
 import threading
 import subprocess
 import re
-import time
 import random
-import requests
+import json
+import hashlib
+import sqlite3
+import copy
+import math
+import heapq
+import shutil
+import socket
+from collections import OrderedDict, deque
+from urllib.parse import quote, urlparse
+from email.utils import parsedate_to_datetime
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from comum import (
+    CacheFontes, CODEC_POR_EXTENSAO, EXTENSAO_POR_CODEC, ARGUMENTOS_POR_CODEC, executar_ffmpeg, analisar_audio,
+    cortar_hibrido, usar_corte_hibrido, ao_fechar
+)
 
 print("🚀 YOUTUBE AUDIO API - SOLUÇÃO DEFINITIVA (Contorno Total de Bloqueios)")
 
 app = Flask(__name__)
 CORS(app)
 
+# INICIALIZAÇÃO RÁPIDA: yt-dlp, requests e numpy (e o boto3 do armazém S3) só são importados no primeiro
+# uso, ou pelo aquecimento em segundo plano logo após a primeira requisição (o health check). Até lá o
+# processo já responde. Os tempos de cada etapa ficam em /api/inicializacao.
+MODULOS_SOB_DEMANDA = ('yt_dlp', 'requests', 'numpy')
+# Em requirements-opcional.txt: sem eles só o recurso que os usa fica indisponível
+DEPENDENCIAS_OPCIONAIS = {'numpy': 'a forma de onda (/api/picos)', 'boto3': 'o armazém S3 (ARMAZEM_ARTEFATOS=s3)'}
+AQUECIMENTO = os.environ.get('AQUECIMENTO', '1') == '1'
+tempos_inicializacao = OrderedDict()  # etapa -> ms
+lock_inicializacao = threading.Lock()
+ultima_marca_inicializacao = [INICIO_IMPORTACAO]
+
+def marcar_inicializacao(etapa):
+    """Registra quanto a etapa levou desde a marca anterior"""
+    agora = time.perf_counter()
+    with lock_inicializacao:
+        tempos_inicializacao[etapa] = round((agora - ultima_marca_inicializacao[0]) * 1000, 1)
+        ultima_marca_inicializacao[0] = agora
+
+class DependenciaAusente(Exception):
+    """Dependência opcional (requirements-opcional.txt) não instalada"""
+
+def modulo(nome):
+    """Import pesado adiado até o primeiro uso; o custo do primeiro import entra no relatório"""
+    ja_importado = nome in sys.modules  # import_module espera um import em andamento em outra thread
+    inicio = time.perf_counter()
+    try:
+        carregado = importlib.import_module(nome)
+    except ImportError as e:
+        if nome not in DEPENDENCIAS_OPCIONAIS:
+            raise
+        raise DependenciaAusente(f"{nome} não instalado, necessário para {DEPENDENCIAS_OPCIONAIS[nome]} "
+                                 f"(pip install -r requirements-opcional.txt)") from e
+    if not ja_importado:
+        with lock_inicializacao:
+            tempos_inicializacao.setdefault(f'import_{nome}', round((time.perf_counter() - inicio) * 1000, 1))
+    return carregado
+
+marcar_inicializacao('imports')
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-AUDIO_FILES_DIR = os.path.join(BASE_DIR, 'audio_files')
-TEMP_DIR = os.path.join(BASE_DIR, 'temp_downloads')
+DADOS_DIR = os.environ.get('DADOS_DIR', BASE_DIR)  # audio_files, temp_downloads, cache_fontes e jobs.db
+AUDIO_FILES_DIR = os.path.join(DADOS_DIR, 'audio_files')
+TEMP_DIR = os.path.join(DADOS_DIR, 'temp_downloads')
+CACHE_DIR = os.path.join(DADOS_DIR, 'cache_fontes')
+PREVIAS_DIR = os.path.join(AUDIO_FILES_DIR, 'previas')  # Dentro de audio_files: o mesmo location do x-accel serve
+ESTADO_DIR = os.path.join(AUDIO_FILES_DIR, 'estado')  # Estado dos jobs publicado pelo armazém local
+
+# EFEITOS DA IMPORTAÇÃO (decisão, vale também para o app_v1): não há fábrica de app, a importação é o início
+# do processo para o gunicorn/hypercorn, o worker.py e as ferramentas (benchmark, verificar_armazem), e todos
+# dependem do mesmo estado pronto. Ficam na importação só coisas baratas (medidas em /api/inicializacao):
+# - os diretórios abaixo (microssegundos; o resto do código assume que existem);
+# - o banner no stdout;
+# - o registro SQLite: esquema, varredura de órfãos e a thread de batimento, que precisa estar rodando
+#   antes do primeiro job, senão outro processo marca os jobs deste como órfãos;
+# - o índice do cache de fontes e a thread do zelador (a varredura de disco roda nela, não na importação).
+# Módulos pesados (yt-dlp, numpy, boto3) e o aquecimento ficam para depois (modulo() e AQUECIMENTO)
 os.makedirs(AUDIO_FILES_DIR, exist_ok=True)
+os.makedirs(PREVIAS_DIR, exist_ok=True)
+os.makedirs(ESTADO_DIR, exist_ok=True)
 os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# CACHE DE FONTES (áudio original reaproveitado entre cortes do mesmo vídeo)
+CACHE_FONTES_MAX_BYTES = int(os.environ.get('CACHE_FONTES_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GB
+FORMATO_FONTE = 'bestaudio'
+
+# REGISTRO DE JOBS (SQLite): estado consultado por chave primária, sobrevive a reinícios
+REGISTRO_DB = os.environ.get('REGISTRO_DB', os.path.join(DADOS_DIR, 'jobs.db'))
+# Vários processos (workers do gunicorn, instâncias no mesmo disco) dividem o REGISTRO_DB: cada um renova o
+# batimento dos jobs que criou, e só os jobs sem batimento há mais que isso (dono morto) são interrompidos
+VALIDADE_BATIMENTO_SEGUNDOS = int(os.environ.get('VALIDADE_BATIMENTO_SEGUNDOS', 60))
+
+# ARMAZÉM DE ARTEFATOS E ESTADO COMPARTILHADO (várias instâncias atrás de um balanceador)
+# 'local': audio_files num diretório (compartilhável entre instâncias via NFS); 's3': qualquer serviço
+# compatível com S3 (S3_ENDPOINT_URL aponta para MinIO, um servidor local de testes etc.)
+# Os artefatos prontos e o estado de cada job são publicados no armazém: qualquer instância responde
+# /api/status e /api/download de qualquer job
+ARMAZEM_ARTEFATOS = os.environ.get('ARMAZEM_ARTEFATOS', 'local')
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_PREFIXO = os.environ.get('S3_PREFIXO', 'ytcut/')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+S3_REGIAO = os.environ.get('S3_REGIAO')
+URL_ASSINADA_SEGUNDOS = int(os.environ.get('URL_ASSINADA_SEGUNDOS', 3600))
+
+# PIPELINE EM DOIS ESTÁGIOS: download (rede) e corte (CPU), cada um com seu pool
+# A fila de download é a de admissão (acima dela responde 429); a de corte faz a passagem entre estágios
+MAX_WORKERS_DOWNLOAD = int(os.environ.get('MAX_WORKERS_DOWNLOAD', 8))
+MAX_WORKERS_CORTE = int(os.environ.get('MAX_WORKERS_CORTE', os.cpu_count() or 2))
+MAX_FILA = int(os.environ.get('MAX_FILA', 20))
+MAX_FILA_CORTE = int(os.environ.get('MAX_FILA_CORTE', 2 * MAX_WORKERS_CORTE))
+
+# EXECUÇÃO DOS JOBS: 'threads' roda download e corte neste processo; 'fila' só enfileira numa fila durável
+# (tabela no REGISTRO_DB, que precisa estar num disco local do host) consumida por worker.py. Os workers
+# escalam à parte, e um deploy do web não mata jobs: o lease de um worker que morreu vence e o job volta à fila
+MODO_EXECUCAO = os.environ.get('MODO_EXECUCAO', 'threads')
+LEASE_FILA_SEGUNDOS = int(os.environ.get('LEASE_FILA_SEGUNDOS', 60))
+MAX_ENTREGAS_FILA = int(os.environ.get('MAX_ENTREGAS_FILA', 3))  # Leases vencidos seguidos antes de desistir do job
+MAX_FILA_DURAVEL = int(os.environ.get('MAX_FILA_DURAVEL', 1000))
+RETRY_AFTER_FILA_DURAVEL = 30
+INTERVALO_POLL_FILA = float(os.environ.get('INTERVALO_POLL_FILA', 1.0))
+
+# DOWNLOAD PARCIAL: 'trecho' baixa só o intervalo do corte, 'completo' baixa a faixa inteira
+MODO_DOWNLOAD_PADRAO = os.environ.get('MODO_DOWNLOAD', 'trecho')
+MARGEM_TRECHO_SEGUNDOS = float(os.environ.get('MARGEM_TRECHO_SEGUNDOS', 3))
+
+# DOWNLOAD EM PARTES: fonte progressiva (um arquivo só por HTTP) dividida em faixas de bytes baixadas por
+# várias conexões ao mesmo tempo, direto nas posições de um arquivo pré-alocado. 1 = uma conexão (yt-dlp).
+# Formatos fragmentados (DASH/HLS) usam o concurrent_fragment_downloads do próprio yt-dlp.
+CONEXOES_DOWNLOAD = int(os.environ.get('CONEXOES_DOWNLOAD', 4))
+TAMANHO_PARTE_DOWNLOAD = int(os.environ.get('TAMANHO_PARTE_DOWNLOAD', 10 * 1024 * 1024))  # = http_chunk_size
+TAMANHO_MIN_PARTE = 1024 * 1024  # Abaixo disso uma conexão a mais custa mais do que rende
+TENTATIVAS_PARTE = 3
+
+# REAPROVEITAMENTO ENTRE JOBS: instâncias do YoutubeDL já montadas, ociosas por perfil de opções (estratégia
+# ou trecho), e uma sessão HTTP keep-alive compartilhada (URLs alternativas e download em partes).
+# Uma instância é descartada depois de um erro ou de USOS_MAX_YOUTUBEDL jobs (a nova sorteia outro User-Agent)
+MAX_YOUTUBEDL_OCIOSOS = int(os.environ.get('MAX_YOUTUBEDL_OCIOSOS', MAX_WORKERS_DOWNLOAD))  # Por perfil
+USOS_MAX_YOUTUBEDL = int(os.environ.get('USOS_MAX_YOUTUBEDL', 50))
+MAX_CONEXOES_HTTP = int(os.environ.get('MAX_CONEXOES_HTTP', MAX_WORKERS_DOWNLOAD * max(1, CONEXOES_DOWNLOAD)))  # Por host
+
+# FORMATO DE SAÍDA: 'original' mantém o codec da fonte (AAC -> m4a, Opus -> opus), o que permite o corte
+# híbrido com o miolo copiado; 'mp3'/'m4a'/'opus'/'ogg' transcodificam quando o codec da fonte é outro
+FORMATO_SAIDA_PADRAO = os.environ.get('FORMATO_SAIDA', 'original')
+
+# Proteção do upstream: token bucket por host e disjuntor (falhas de bloqueio/429 seguidas abrem o circuito)
+TAXA_REQUISICOES_HOST = float(os.environ.get('TAXA_REQUISICOES_HOST', 1.0))  # tentativas/s por host
+RAJADA_REQUISICOES_HOST = int(os.environ.get('RAJADA_REQUISICOES_HOST', 5))
+# Orçamento de disco: o zelador expira por TTL (desde o último download) e remove os menos usados
+AUDIO_FILES_MAX_BYTES = int(os.environ.get('AUDIO_FILES_MAX_BYTES', 5 * 1024 * 1024 * 1024))  # 5 GB
+AUDIO_FILES_TTL_SEGUNDOS = int(os.environ.get('AUDIO_FILES_TTL_SEGUNDOS', 7 * 24 * 3600))
+TEMP_MAX_BYTES = int(os.environ.get('TEMP_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+TEMP_TTL_SEGUNDOS = int(os.environ.get('TEMP_TTL_SEGUNDOS', 6 * 3600))
+PREVIAS_MAX_BYTES = int(os.environ.get('PREVIAS_MAX_BYTES', 500 * 1024 * 1024))
+PREVIAS_TTL_SEGUNDOS = int(os.environ.get('PREVIAS_TTL_SEGUNDOS', 24 * 3600))
+INTERVALO_ZELADOR_SEGUNDOS = int(os.environ.get('INTERVALO_ZELADOR_SEGUNDOS', 300))
+PROTECAO_ACESSO_SEGUNDOS = 600  # Nada acessado há menos que isso é removido (x-accel: o nginx lê sem avisar)
+
+LIMITE_FALHAS_DISJUNTOR = int(os.environ.get('LIMITE_FALHAS_DISJUNTOR', 5))
+TEMPO_DISJUNTOR_ABERTO = int(os.environ.get('TEMPO_DISJUNTOR_ABERTO', 300))
+VALIDADE_URL_ALTERNATIVA = int(os.environ.get('VALIDADE_URL_ALTERNATIVA', 900))  # Resultado das sondas por vídeo
 
 # SISTEMA DE USER AGENTS E CONFIGURAÇÕES AVANÇADADAS
 USER_AGENTS = [
@@ -131,6 +283,7 @@ def obter_configuracao_extrema(tentativa_num):
         'throttled_rate': '512K',
         'buffersize': 1024 * 32,
         'http_chunk_size': 10485760,
+        'concurrent_fragment_downloads': max(1, CONEXOES_DOWNLOAD),
     }
     
     if tentativa_num < len(configs):
@@ -138,8 +291,25 @@ def obter_configuracao_extrema(tentativa_num):
     
     return base_config
 
+urls_alternativas = {}  # video_id -> (url ou None, expira_em)
+lock_urls_alternativas = threading.Lock()
+
 def verificar_url_alternativa(video_id):
-    """Tenta acessar o vídeo por URLs alternativas"""
+    """Tenta acessar o vídeo por URLs alternativas. O resultado (inclusive nenhuma) vale por
+    VALIDADE_URL_ALTERNATIVA segundos: a retomada de um job estacionado não repete as sondas."""
+    with lock_urls_alternativas:
+        url, expira_em = urls_alternativas.get(video_id, (None, 0))
+        if expira_em > time.time():
+            return url
+    url = sondar_urls_alternativas(video_id)
+    with lock_urls_alternativas:
+        agora = time.time()
+        for chave in [chave for chave, (_, expira) in urls_alternativas.items() if expira <= agora]:
+            del urls_alternativas[chave]
+        urls_alternativas[video_id] = (url, agora + VALIDADE_URL_ALTERNATIVA)
+    return url
+
+def sondar_urls_alternativas(video_id):
     alternativas = [
         f'https://yewtu.be/watch?v={video_id}',
         f'https://invidious.snopyta.org/watch?v={video_id}',
@@ -147,9 +317,10 @@ def verificar_url_alternativa(video_id):
         f'https://www.youtube-nocookie.com/embed/{video_id}',
     ]
     
+    sessao = sessao_http()
     for url in alternativas:
         try:
-            response = requests.get(url, timeout=10, headers={
+            response = sessao.get(url, timeout=10, headers={
                 'User-Agent': random.choice(USER_AGENTS)
             })
             if response.status_code == 200:
@@ -174,9 +345,1541 @@ def extrair_video_id(url):
             return match.group(1)
     return None
 
-def baixar_com_estrategia_extrema(url, id_processo, tentativas=6):
-    """Sistema extremo de download com múltiplas estratégias"""
+cache_fontes = CacheFontes(CACHE_DIR, CACHE_FONTES_MAX_BYTES)
+marcar_inicializacao('cache_fontes')
+
+class ProgressoJobs:
+    """Progresso em memória por job, com espera por mudanças (alimenta o SSE)"""
+
+    # Sem publicação há mais que isso o job some da memória, qualquer que seja o estado: stream, prévia e
+    # picos publicam progresso mas nunca chegam a concluido/erro. O registro continua com o estado final,
+    # e um job silencioso que volte a publicar reaparece (a versão é global, o SSE não perde a mudança)
+    RETENCAO_SEGUNDOS = 300
+    INTERVALO_EXPIRACAO = 60
+
+    def __init__(self):
+        self.estados = {}
+        self.versao = 0
+        self.condicao = threading.Condition()
+        self.ouvintes = []  # Chamados com o id_processo a cada publicação (ex.: event loop do app_async)
+        self.thread = None
+
+    def publicar(self, id_processo, **campos):
+        if self.thread is None:
+            self._iniciar_expiracao()
+        with self.condicao:
+            self.versao += 1
+            estado = self.estados.setdefault(id_processo, {})
+            estado.update(campos)
+            estado['versao'] = self.versao
+            estado['atualizado_em'] = time.time()
+            self.condicao.notify_all()
+        for ouvinte in self.ouvintes:
+            ouvinte(id_processo)
+
+    def _iniciar_expiracao(self):
+        with self.condicao:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, name='expiracao-progresso', daemon=True)
+                self.thread.start()
+
+    def _executar(self):
+        while True:
+            time.sleep(self.INTERVALO_EXPIRACAO)
+            self.expirar()
+
+    def expirar(self):
+        """Uma varredura por INTERVALO_EXPIRACAO, fora do caminho da publicação"""
+        limite = time.time() - self.RETENCAO_SEGUNDOS
+        with self.condicao:
+            for id_processo in [id_processo for id_processo, estado in self.estados.items()
+                                if estado['atualizado_em'] < limite]:
+                del self.estados[id_processo]
+
+    def aguardar(self, id_processo, versao, timeout):
+        """Espera até haver estado mais novo que `versao` (ou timeout) e devolve uma cópia"""
+        with self.condicao:
+            self.condicao.wait_for(
+                lambda: self.estados.get(id_processo, {}).get('versao', 0) > versao, timeout
+            )
+            estado = self.estados.get(id_processo)
+            return dict(estado) if estado else None
+
+progresso_jobs = ProgressoJobs()
+
+def gancho_progresso_download(id_processo):
+    """progress_hook do yt-dlp que publica bytes baixados, total e velocidade"""
+    ultimo = [0.0]
+    def gancho(d):
+        agora = time.time()
+        if d.get('status') == 'downloading' and agora - ultimo[0] < INTERVALO_PROGRESSO_SEGUNDOS:
+            return
+        ultimo[0] = agora
+        progresso_jobs.publicar(
+            id_processo,
+            baixado_bytes=d.get('downloaded_bytes'),
+            total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+            velocidade_bps=d.get('speed')
+        )
+    return gancho
+
+def gancho_progresso_corte(id_processo, duracao_corte):
+    """Callback do -progress do ffmpeg: segundos já codificados contra a duração do corte"""
+    ultimo = [0.0]
+    def gancho(segundos):
+        agora = time.time()
+        if agora - ultimo[0] < INTERVALO_PROGRESSO_SEGUNDOS:
+            return
+        ultimo[0] = agora
+        progresso_jobs.publicar(
+            id_processo,
+            corte_segundos=round(min(segundos, duracao_corte), 2),
+            corte_total_segundos=duracao_corte,
+            corte_percentual=round(100 * min(segundos / duracao_corte, 1), 1) if duracao_corte else None
+        )
+    return gancho
+
+class ArmazemLocal:
+    """Artefatos e estado num diretório (o próprio audio_files por padrão)"""
+
+    nome = 'local'
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+
+    def _caminho(self, nome):
+        return os.path.join(self.diretorio, nome)
+
+    def enviar(self, caminho, nome):
+        destino = self._caminho(nome)
+        if os.path.abspath(caminho) != os.path.abspath(destino):
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            shutil.copyfile(caminho, destino + '.tmp')
+            os.replace(destino + '.tmp', destino)
+
+    def existe(self, nome):
+        return os.path.exists(self._caminho(nome))
+
+    def url_download(self, nome, nome_download, anexo=True):
+        return None  # Servido do disco por enviar_artefato
+
+    def gravar_json(self, nome, dados):
+        destino = self._caminho(nome)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with open(destino + '.tmp', 'w') as f:
+            json.dump(dados, f)
+        os.replace(destino + '.tmp', destino)
+
+    def ler_json(self, nome):
+        try:
+            with open(self._caminho(nome)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def remover(self, nome):
+        try:
+            os.remove(self._caminho(nome))
+        except OSError:
+            pass
+
+class ArmazemS3:
+    """Artefatos e estado num bucket compatível com S3; downloads saem por URL assinada"""
+
+    nome = 's3'
+
+    def __init__(self, bucket, prefixo, endpoint_url=None, regiao=None):
+        self.bucket = bucket
+        self.prefixo = prefixo
+        self.endpoint_url = endpoint_url or None
+        self.regiao = regiao or None
+        self._cliente = None
+        self.lock = threading.Lock()
+
+    @property
+    def cliente(self):
+        """Criado no primeiro uso: o boto3 (só exigido com ARMAZEM_ARTEFATOS=s3) pesa na inicialização"""
+        with self.lock:
+            if self._cliente is None:
+                boto3 = modulo('boto3')
+                from botocore.config import Config
+                self._cliente = boto3.client(
+                    's3', endpoint_url=self.endpoint_url, region_name=self.regiao,
+                    config=Config(retries={'max_attempts': 3, 'mode': 'standard'},
+                                  max_pool_connections=MAX_WORKERS_DOWNLOAD + MAX_WORKERS_CORTE)
+                )
+            return self._cliente
+
+    def _chave(self, nome):
+        return self.prefixo + nome
+
+    @staticmethod
+    def _ausente(erro):
+        """ClientError do botocore para objeto inexistente"""
+        resposta = getattr(erro, 'response', None)
+        return isinstance(resposta, dict) and resposta.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def enviar(self, caminho, nome):
+        self.cliente.upload_file(caminho, self.bucket, self._chave(nome),
+                                 ExtraArgs={'ContentType': mimetype_artefato(caminho)})
+
+    def existe(self, nome):
+        try:
+            self.cliente.head_object(Bucket=self.bucket, Key=self._chave(nome))
+            return True
+        except Exception as e:
+            if self._ausente(e):
+                return False
+            raise
+
+    def url_download(self, nome, nome_download, anexo=True):
+        disposicao = 'attachment' if anexo else 'inline'
+        return self.cliente.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket,
+            'Key': self._chave(nome),
+            'ResponseContentDisposition': f"{disposicao}; filename*=UTF-8''{quote(nome_download)}"
+        }, ExpiresIn=URL_ASSINADA_SEGUNDOS)
+
+    def gravar_json(self, nome, dados):
+        self.cliente.put_object(Bucket=self.bucket, Key=self._chave(nome), Body=json.dumps(dados).encode(),
+                                ContentType='application/json')
+
+    def ler_json(self, nome):
+        try:
+            objeto = self.cliente.get_object(Bucket=self.bucket, Key=self._chave(nome))
+            return json.loads(objeto['Body'].read())
+        except Exception as e:
+            if self._ausente(e):
+                return None
+            raise
+
+    def remover(self, nome):
+        self.cliente.delete_object(Bucket=self.bucket, Key=self._chave(nome))
+
+if ARMAZEM_ARTEFATOS == 's3':
+    # O cliente é criado no primeiro uso, mas sem o boto3 o processo nem deve subir
+    if importlib.util.find_spec('boto3') is None:
+        raise DependenciaAusente(f"boto3 não instalado, necessário para {DEPENDENCIAS_OPCIONAIS['boto3']} "
+                                 f"(pip install -r requirements-opcional.txt)")
+    armazem = ArmazemS3(S3_BUCKET, S3_PREFIXO, S3_ENDPOINT_URL, S3_REGIAO)
+else:
+    armazem = ArmazemLocal(AUDIO_FILES_DIR)
+
+class EspelhoEstado:
+    """Publica o estado dos jobs no armazém numa thread própria (o worker e o event loop não esperam
+    a rede). Várias mudanças do mesmo job antes do envio viram uma só escrita. Uma escrita que falha
+    volta para a fila com espera exponencial (até ESPERA_MAX_ESPELHO), a não ser que uma versão mais
+    nova do mesmo nome chegue antes: sem isso o 'concluido' perdido deixaria o job 'processando' nas
+    outras instâncias."""
+
+    ESPERA_MAX_ESPELHO = 60
+
+    def __init__(self, armazem):
+        self.armazem = armazem
+        self.pendentes = OrderedDict()  # nome -> (dados, falhas seguidas); dados None = remover
+        self.reenvios = {}  # nome -> (reenviar_em, dados, falhas seguidas)
+        self.condicao = threading.Condition()
+        self.thread = None
+        self.falhas = 0
+
+    def publicar(self, nome, dados):
+        with self.condicao:
+            self.reenvios.pop(nome, None)  # Substituído pela versão nova
+            self.pendentes[nome] = (dados, 0)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, name='espelho-estado', daemon=True)
+                self.thread.start()
+            self.condicao.notify()
+
+    def _proximo(self):
+        """Próxima escrita (com self.condicao): os pendentes e os reenvios que já venceram"""
+        while True:
+            agora = time.time()
+            for nome, (reenviar_em, dados, falhas) in list(self.reenvios.items()):
+                if reenviar_em <= agora:
+                    del self.reenvios[nome]
+                    self.pendentes[nome] = (dados, falhas)
+            if self.pendentes:
+                nome, (dados, falhas) = self.pendentes.popitem(last=False)
+                return nome, dados, falhas
+            proximo = min((reenviar_em for reenviar_em, _, _ in self.reenvios.values()), default=None)
+            self.condicao.wait(None if proximo is None else max(0, proximo - agora))
+
+    def _executar(self):
+        while True:
+            with self.condicao:
+                nome, dados, falhas = self._proximo()
+            try:
+                if dados is None:
+                    self.armazem.remover(nome)
+                else:
+                    self.armazem.gravar_json(nome, dados)
+            except Exception as e:
+                espera = min(self.ESPERA_MAX_ESPELHO, 2 ** falhas)
+                with self.condicao:
+                    self.falhas += 1
+                    if nome not in self.pendentes:
+                        self.reenvios[nome] = (time.time() + espera, dados, falhas + 1)
+                logger.warning(f"⚠️  Estado {nome} não publicado no armazém ({e}), nova tentativa em {espera}s")
+
+    def estatisticas(self):
+        with self.condicao:
+            return {'armazem': self.armazem.nome, 'pendentes': len(self.pendentes),
+                    'reenvios': len(self.reenvios), 'falhas': self.falhas}
+
+espelho_estado = EspelhoEstado(armazem)
+
+def caminho_local(caminho):
+    """Onde o artefato fica nesta instância (o caminho gravado no registro pode ser de outra)"""
+    return os.path.join(AUDIO_FILES_DIR, os.path.basename(caminho))
+
+def artefato_disponivel(caminho):
+    return os.path.exists(caminho_local(caminho)) or armazem.existe(os.path.basename(caminho))
+
+def publicar_artefato(caminho):
+    """Envia o artefato pronto ao armazém antes de o job ser dado como concluído.
+    Endereçado pela chave do conteúdo: se já estiver lá, não reenvia."""
+    nome = os.path.basename(caminho)
+    if not armazem.existe(nome):
+        armazem.enviar(caminho, nome)
+
+class RegistroJobs:
+    """Tabela durável de jobs: estado, etapa, arquivo de saída, erro e horários.
+    Cada mudança também é espelhada no armazém (estado/job_{id}.json): jobs de outras instâncias
+    são lidos de lá."""
+
+    # Colunas adicionadas depois da criação da tabela (migradas com ALTER TABLE)
+    COLUNAS_EXTRAS = {'chave': 'TEXT', 'clipes': 'TEXT', 'caminho_corte': 'TEXT', 'anexado_a': 'TEXT',
+                      'nome_pedido': 'TEXT', 'dono': 'TEXT', 'batimento_em': 'REAL'}
+
+    def __init__(self, caminho_db, interromper_pendentes=True, validade_batimento=VALIDADE_BATIMENTO_SEGUNDOS):
+        self.caminho_db = caminho_db
+        self.local = threading.local()
+        # O pid sozinho se repete entre reinícios de um contêiner
+        self.dono = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.validade_batimento = validade_batimento
+        self.thread = None
+        with self._conexao() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id_processo TEXT PRIMARY KEY,
+                    estado TEXT NOT NULL,
+                    etapa TEXT,
+                    arquivo TEXT,
+                    caminho TEXT,
+                    tamanho_bytes INTEGER,
+                    erro TEXT,
+                    criado_em REAL NOT NULL,
+                    atualizado_em REAL NOT NULL,
+                    concluido_em REAL
+                )
+            """)
+            existentes = {linha['name'] for linha in conn.execute("PRAGMA table_info(jobs)")}
+            for coluna, tipo in self.COLUNAS_EXTRAS.items():
+                if coluna not in existentes:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {coluna} {tipo}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_chave ON jobs (chave, estado)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_atualizado ON jobs (atualizado_em)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_anexado ON jobs (anexado_a)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dono ON jobs (dono, estado)")
+        # Jobs em andamento cujo processo morreu não vão mais terminar
+        # (com a fila durável eles continuam na fila e outro worker os retoma)
+        if interromper_pendentes:
+            self.interromper_orfaos()
+            self.thread = threading.Thread(target=self._executar, name='batimento-registro', daemon=True)
+            self.thread.start()
+
+    def _conexao(self):
+        """Uma conexão por thread (sqlite3 não compartilha conexões entre threads)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho_db, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def _executar(self):
+        while True:
+            time.sleep(self.validade_batimento / 3)
+            try:
+                self.renovar_batimento()
+                self.interromper_orfaos()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️  Batimento do registro falhou: {e}")
+
+    def renovar_batimento(self):
+        with self._conexao() as conn:
+            conn.execute("UPDATE jobs SET batimento_em = ? WHERE dono = ? AND estado = 'processando'",
+                         (time.time(), self.dono))
+
+    def interromper_orfaos(self):
+        """Falha os jobs 'processando' cujo dono parou de renovar o batimento (inclusive os do processo que
+        este substituiu); os de outros processos vivos ficam como estão. Jobs anexados seguem o original."""
+        agora = time.time()
+        with self._conexao() as conn:
+            interrompidos = [linha['id_processo'] for linha in conn.execute(
+                "SELECT id_processo FROM jobs WHERE estado = 'processando' AND anexado_a IS NULL "
+                "AND (dono IS NULL OR dono != ?) AND COALESCE(batimento_em, atualizado_em) < ?",
+                (self.dono, agora - self.validade_batimento)
+            )]
+            conn.executemany(
+                "UPDATE jobs SET estado = 'erro', erro = ?, atualizado_em = ?, concluido_em = ? "
+                "WHERE id_processo = ? AND estado = 'processando'",
+                [('Processamento interrompido por reinício do servidor', agora, agora, id_processo)
+                 for id_processo in interrompidos]
+            )
+        if interrompidos:
+            logger.warning(f"💀 {len(interrompidos)} job(s) de processos que pararam marcados como erro")
+        # Outras instâncias leem o estado do armazém: sem o espelho eles ficariam "processando" para sempre
+        for id_processo in interrompidos:
+            self._espelhar(id_processo)
+            self._propagar(id_processo)
+
+    def criar(self, id_processo, etapa='iniciando', chave=None):
+        agora = time.time()
+        with self._conexao() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id_processo, estado, etapa, chave, dono, batimento_em, criado_em, atualizado_em) "
+                "VALUES (?, 'processando', ?, ?, ?, ?, ?, ?)",
+                (id_processo, etapa, chave, self.dono, agora, agora, agora)
+            )
+        self._espelhar(id_processo)
+
+    def anexar(self, id_processo, id_original, chave, nome_arquivo):
+        """Job de um pedido idêntico a um corte em andamento: termina junto com o original, com o próprio nome"""
+        agora = time.time()
+        with self._conexao() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id_processo, estado, etapa, chave, anexado_a, nome_pedido, dono, batimento_em, "
+                "criado_em, atualizado_em) VALUES (?, 'processando', 'anexado', ?, ?, ?, ?, ?, ?, ?)",
+                (id_processo, chave, id_original, nome_arquivo, self.dono, agora, agora, agora)
+            )
+        self._espelhar(id_processo)
+        # O original pode ter terminado entre a consulta e a inserção
+        self._propagar(id_original)
+
+    def _propagar(self, id_original):
+        """Conclui (ou falha) os jobs anexados a um original que terminou"""
+        original = self._obter_local(id_original)
+        if not original or original['estado'] == 'processando':
+            return
+        anexados = self._conexao().execute(
+            "SELECT id_processo, nome_pedido FROM jobs WHERE anexado_a = ? AND estado = 'processando'",
+            (id_original,)
+        ).fetchall()
+        for anexado in anexados:
+            if original['estado'] != 'concluido':
+                self.falhar(anexado['id_processo'], original['erro'])
+                continue
+            extensao = os.path.splitext(original['caminho'])[1]
+            nome_base = sanitizar_nome_arquivo(anexado['nome_pedido']) if anexado['nome_pedido'] else ''
+            self.concluir(anexado['id_processo'], f"{nome_base}{extensao}" if nome_base else original['arquivo'],
+                          original['caminho'], original['caminho_corte'], original['tamanho_bytes'])
+
+    def atualizar(self, id_processo, **campos):
+        campos['atualizado_em'] = time.time()
+        atribuicoes = ', '.join(f'{campo} = ?' for campo in campos)
+        with self._conexao() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {atribuicoes} WHERE id_processo = ?",
+                list(campos.values()) + [id_processo]
+            )
+        mudancas = {campo: campos[campo] for campo in ('estado', 'etapa', 'erro') if campo in campos}
+        if mudancas:
+            progresso_jobs.publicar(id_processo, **mudancas)
+        self._espelhar(id_processo)
+
+    def _espelhar(self, id_processo):
+        job = self._obter_local(id_processo)
+        if not job:
+            return
+        espelho_estado.publicar(f"estado/job_{id_processo}.json", job)
+        if job['estado'] == 'concluido' and job['chave']:
+            espelho_estado.publicar(f"estado/chave_{job['chave']}.json", job)
+
+    def concluir(self, id_processo, arquivo, caminho, caminho_corte=None, tamanho_bytes=None):
+        agora = time.time()
+        if tamanho_bytes is None:
+            tamanho_bytes = os.path.getsize(caminho)
+        self.atualizar(id_processo, estado='concluido', etapa='finalizado', arquivo=arquivo, caminho=caminho,
+                       tamanho_bytes=tamanho_bytes, caminho_corte=caminho_corte, concluido_em=agora)
+        self._propagar(id_processo)
+
+    def concluir_lote(self, id_processo, clipes):
+        tamanho = sum(clipe.get('tamanho_bytes', 0) for clipe in clipes)
+        self.atualizar(id_processo, estado='concluido', etapa='finalizado', clipes=json.dumps(clipes),
+                       tamanho_bytes=tamanho, concluido_em=time.time())
+
+    def falhar(self, id_processo, erro):
+        self.atualizar(id_processo, estado='erro', erro=erro, concluido_em=time.time())
+        self._propagar(id_processo)
+
+    def remover(self, id_processo):
+        with self._conexao() as conn:
+            conn.execute("DELETE FROM jobs WHERE id_processo = ?", (id_processo,))
+        espelho_estado.publicar(f"estado/job_{id_processo}.json", None)
+
+    def obter_por_chave(self, chave):
+        """Último job concluído com a mesma chave de conteúdo (nesta instância ou, senão, em outra)"""
+        linha = self._conexao().execute(
+            "SELECT * FROM jobs WHERE chave = ? AND estado = 'concluido' ORDER BY concluido_em DESC LIMIT 1",
+            (chave,)
+        ).fetchone()
+        return dict(linha) if linha else armazem.ler_json(f"estado/chave_{chave}.json")
+
+    def _obter_local(self, id_processo):
+        linha = self._conexao().execute(
+            "SELECT * FROM jobs WHERE id_processo = ?", (id_processo,)
+        ).fetchone()
+        return dict(linha) if linha else None
+
+    def obter(self, id_processo):
+        return self._obter_local(id_processo) or armazem.ler_json(f"estado/job_{id_processo}.json")
+
+    def ids_em_andamento(self):
+        linhas = self._conexao().execute("SELECT id_processo FROM jobs WHERE estado = 'processando'")
+        return {linha['id_processo'] for linha in linhas}
+
+registro_jobs = RegistroJobs(REGISTRO_DB, interromper_pendentes=MODO_EXECUCAO != 'fila')
+
+class AcompanhamentoRegistro:
+    """Com MODO_EXECUCAO=fila os jobs rodam em outro processo: lê as mudanças de estado/etapa do registro
+    e as publica no progresso em memória, de onde o SSE as entrega (o progresso em bytes fica no worker)"""
+
+    def __init__(self, registro, intervalo):
+        self.registro = registro
+        self.intervalo = intervalo
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def iniciar(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, name='acompanhamento-registro', daemon=True)
+                self.thread.start()
+
+    def _executar(self):
+        marca = time.time()
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                linhas = self.registro._conexao().execute(
+                    "SELECT id_processo, estado, etapa, erro, atualizado_em FROM jobs "
+                    "WHERE atualizado_em > ? ORDER BY atualizado_em", (marca,)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️  Acompanhamento do registro falhou: {e}")
+                continue
+            for linha in linhas:
+                marca = max(marca, linha['atualizado_em'])
+                mudancas = {campo: linha[campo] for campo in ('estado', 'etapa', 'erro') if linha[campo] is not None}
+                progresso_jobs.publicar(linha['id_processo'], **mudancas)
+
+acompanhamento_registro = AcompanhamentoRegistro(registro_jobs, INTERVALO_POLL_FILA)
+
+class FilaCheia(Exception):
+    """Fila de admissão lotada; retry_after é a espera estimada em segundos"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Fila cheia, tente novamente em {retry_after}s")
+        self.retry_after = retry_after
+
+class PoolTrabalho:
+    """Pool fixo de threads com fila limitada na frente (controle de admissão)"""
+
+    def __init__(self, nome, workers, max_fila):
+        self.nome = nome
+        self.workers = workers
+        self.max_fila = max_fila
+        self.fila = deque()  # (id_processo, funcao, args, enfileirado_em)
+        self.condicao = threading.Condition()
+        self.threads = []
+        self.ativos = 0
+        self.atendidos = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.duracao_media = None  # média móvel da duração dos jobs (s)
+
+    def _garantir_threads(self):
+        """Threads criadas sob demanda, no primeiro job"""
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._executar, name=f'{self.nome}-{len(self.threads) + 1}')
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submeter(self, id_processo, funcao, *args, bloquear=False):
+        """Enfileira o job e retorna sua posição (1 = próximo).
+        Com a fila lotada levanta FilaCheia, ou espera vaga se bloquear=True."""
+        with self.condicao:
+            while len(self.fila) >= self.max_fila:
+                if not bloquear:
+                    raise FilaCheia(self.estimar_espera())
+                self.condicao.wait()
+            self.fila.append((id_processo, funcao, args, time.time()))
+            self._garantir_threads()
+            self.condicao.notify_all()
+            return len(self.fila)
+
+    def posicao(self, id_processo):
+        with self.condicao:
+            for indice, item in enumerate(self.fila):
+                if item[0] == id_processo:
+                    return indice + 1
+        return None
+
+    def estimar_espera(self):
+        duracao = self.duracao_media or 60
+        return max(1, math.ceil(duracao * (len(self.fila) + 1) / self.workers))
+
+    def _executar(self):
+        while True:
+            with self.condicao:
+                while not self.fila:
+                    self.condicao.wait()
+                id_processo, funcao, args, enfileirado_em = self.fila.popleft()
+                self.condicao.notify_all()  # Acorda quem espera vaga na fila
+                espera = time.time() - enfileirado_em
+                self.espera_total += espera
+                self.espera_max = max(self.espera_max, espera)
+                self.atendidos += 1
+                self.ativos += 1
+
+            inicio = time.time()
+            try:
+                funcao(*args)
+            except Exception as e:
+                logger.error(f"💥 {id_processo} - ERRO NO WORKER {self.nome}: {e}")
+            finally:
+                duracao = time.time() - inicio
+                with self.condicao:
+                    self.ativos -= 1
+                    if self.duracao_media is None:
+                        self.duracao_media = duracao
+                    else:
+                        self.duracao_media = 0.8 * self.duracao_media + 0.2 * duracao
+
+    def estatisticas(self):
+        with self.condicao:
+            return {
+                'workers': self.workers,
+                'ativos': self.ativos,
+                'fila': len(self.fila),
+                'max_fila': self.max_fila,
+                'atendidos': self.atendidos,
+                'espera_media_s': round(self.espera_total / self.atendidos, 2) if self.atendidos else 0.0,
+                'espera_max_s': round(self.espera_max, 2),
+                'espera_estimada_s': self.estimar_espera(),
+                'duracao_media_s': round(self.duracao_media, 2) if self.duracao_media else None
+            }
+
+def chave_corte(url, inicio_segundos, fim_segundos, formato_saida=FORMATO_SAIDA_PADRAO):
+    """Chave determinística do conteúdo do corte (vídeo, intervalo, formato e opções)"""
+    descricao = json.dumps({
+        'video': extrair_video_id(url) or url,
+        'inicio': inicio_segundos,
+        'fim': fim_segundos,
+        'formato': formato_saida,
+        'fonte': FORMATO_FONTE,
+    }, sort_keys=True)
+    return hashlib.sha256(descricao.encode()).hexdigest()[:24]
+
+# Cortes idênticos em andamento: chave -> id_processo (duplicatas se anexam ao mesmo job)
+jobs_em_andamento = {}
+lock_jobs_em_andamento = threading.Lock()
+
+def finalizar_job_em_andamento(chave):
+    with lock_jobs_em_andamento:
+        jobs_em_andamento.pop(chave, None)
+
+pool_download = PoolTrabalho('download', MAX_WORKERS_DOWNLOAD, MAX_FILA)
+pool_corte = PoolTrabalho('corte', MAX_WORKERS_CORTE, MAX_FILA_CORTE)
+
+class FilaDuravel:
+    """Fila de jobs em SQLite (no banco do registro), consumida por worker.py com MODO_EXECUCAO=fila.
+    Reservar um job dá um lease que o worker renova enquanto trabalha; se o worker morre o lease vence
+    e o job é entregue a outro. Cada reserva tem um token: um worker atrasado não mexe na reserva de outro."""
+
+    def __init__(self, registro, lease_segundos, max_entregas, max_fila):
+        self.registro = registro
+        self.lease_segundos = lease_segundos
+        self.max_entregas = max_entregas
+        self.max_fila = max_fila
+        with self.registro._conexao() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS fila (
+                    id_processo TEXT PRIMARY KEY,
+                    tipo TEXT NOT NULL,
+                    argumentos TEXT NOT NULL,
+                    chave TEXT,
+                    tentativa INTEGER NOT NULL DEFAULT 0,
+                    entregas INTEGER NOT NULL DEFAULT 0,
+                    disponivel_em REAL NOT NULL,
+                    criado_em REAL NOT NULL,
+                    reserva TEXT,
+                    lease_ate REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_fila_disponivel ON fila (disponivel_em, criado_em)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_fila_reserva ON fila (reserva)")
+
+    def _conexao(self):
+        return self.registro._conexao()
+
+    def enfileirar(self, id_processo, tipo, argumentos, chave=None):
+        """Grava o job na fila e retorna sua posição; levanta FilaCheia acima de max_fila"""
+        agora = time.time()
+        with self._conexao() as conn:
+            pendentes = conn.execute("SELECT COUNT(*) FROM fila").fetchone()[0]
+            if pendentes >= self.max_fila:
+                raise FilaCheia(RETRY_AFTER_FILA_DURAVEL)
+            conn.execute(
+                "INSERT INTO fila (id_processo, tipo, argumentos, chave, disponivel_em, criado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (id_processo, tipo, json.dumps(argumentos), chave, agora, agora)
+            )
+        return self.posicao(id_processo)
+
+    def reservar(self, worker):
+        """Próximo job disponível (ou com lease vencido) para este worker, ou None"""
+        while True:
+            agora = time.time()
+            reserva = f"{worker}:{uuid.uuid4().hex[:8]}"
+            with self._conexao() as conn:
+                # Um UPDATE só: no SQLite é atômico, dois workers nunca pegam o mesmo job
+                conn.execute(
+                    "UPDATE fila SET reserva = ?, lease_ate = ?, entregas = entregas + 1 WHERE id_processo = ("
+                    "SELECT id_processo FROM fila WHERE disponivel_em <= ? AND (lease_ate IS NULL OR lease_ate < ?) "
+                    "ORDER BY disponivel_em, criado_em LIMIT 1)",
+                    (reserva, agora + self.lease_segundos, agora, agora)
+                )
+            linha = self._conexao().execute("SELECT * FROM fila WHERE reserva = ?", (reserva,)).fetchone()
+            if not linha:
+                return None
+            job = dict(linha)
+            if job['entregas'] > self.max_entregas:
+                logger.error(f"💀 {job['id_processo']} - {self.max_entregas} workers morreram com o job, desistindo")
+                self.registro.falhar(job['id_processo'], 'Processamento interrompido repetidamente')
+                self.concluir(reserva)
+                continue
+            job['argumentos'] = json.loads(job['argumentos'])
+            return job
+
+    def renovar(self, reservas):
+        if not reservas:
+            return
+        marcadores = ', '.join('?' for _ in reservas)
+        with self._conexao() as conn:
+            conn.execute(f"UPDATE fila SET lease_ate = ? WHERE reserva IN ({marcadores})",
+                         [time.time() + self.lease_segundos] + list(reservas))
+
+    def concluir(self, reserva):
+        with self._conexao() as conn:
+            conn.execute("DELETE FROM fila WHERE reserva = ?", (reserva,))
+
+    def adiar(self, reserva, espera, tentativa):
+        """Devolve o job à fila para a tentativa `tentativa` daqui a `espera` segundos (EstacionarJob)"""
+        with self._conexao() as conn:
+            conn.execute(
+                "UPDATE fila SET reserva = NULL, lease_ate = NULL, entregas = 0, tentativa = ?, disponivel_em = ? "
+                "WHERE reserva = ?",
+                (tentativa, time.time() + espera, reserva)
+            )
+
+    def posicao(self, id_processo):
+        """Posição entre os jobs esperando worker (1 = próximo); None se já está em execução ou não existe"""
+        conn = self._conexao()
+        agora = time.time()
+        linha = conn.execute("SELECT disponivel_em, criado_em, lease_ate FROM fila WHERE id_processo = ?",
+                             (id_processo,)).fetchone()
+        if not linha or (linha['lease_ate'] and linha['lease_ate'] >= agora):
+            return None
+        return conn.execute(
+            "SELECT COUNT(*) FROM fila WHERE (lease_ate IS NULL OR lease_ate < ?) "
+            "AND (disponivel_em < ? OR (disponivel_em = ? AND criado_em <= ?))",
+            (agora, linha['disponivel_em'], linha['disponivel_em'], linha['criado_em'])
+        ).fetchone()[0]
+
+    def id_por_chave(self, chave):
+        """Job com a mesma chave ainda na fila ou em execução (para anexar duplicatas)"""
+        linha = self._conexao().execute("SELECT id_processo FROM fila WHERE chave = ? LIMIT 1", (chave,)).fetchone()
+        return linha['id_processo'] if linha else None
+
+    def estatisticas(self):
+        agora = time.time()
+        linha = self._conexao().execute(
+            "SELECT COUNT(*) AS total, "
+            "SUM(CASE WHEN lease_ate >= ? THEN 1 ELSE 0 END) AS em_execucao, "
+            "SUM(CASE WHEN lease_ate < ? THEN 1 ELSE 0 END) AS leases_vencidos, "
+            "SUM(CASE WHEN lease_ate IS NULL AND disponivel_em > ? THEN 1 ELSE 0 END) AS adiados, "
+            "MIN(CASE WHEN lease_ate IS NULL THEN criado_em END) AS mais_antigo "
+            "FROM fila", (agora, agora, agora)
+        ).fetchone()
+        return {
+            'total': linha['total'],
+            'em_execucao': linha['em_execucao'] or 0,
+            'leases_vencidos': linha['leases_vencidos'] or 0,
+            'adiados': linha['adiados'] or 0,
+            'espera_mais_antiga_s': round(agora - linha['mais_antigo'], 1) if linha['mais_antigo'] else None,
+            'max_fila': self.max_fila,
+            'lease_s': self.lease_segundos
+        }
+
+fila_jobs = FilaDuravel(registro_jobs, LEASE_FILA_SEGUNDOS, MAX_ENTREGAS_FILA, MAX_FILA_DURAVEL)
+marcar_inicializacao('registro')
+
+def posicao_na_fila(id_processo):
+    if MODO_EXECUCAO == 'fila':
+        return fila_jobs.posicao(id_processo)
+    return pool_download.posicao(id_processo)
+
+class AgendadorRetentativas:
+    """Jobs estacionados até a próxima tentativa: o delay não prende nenhum worker.
+    Uma única thread devolve cada job ao seu pool quando chega a hora."""
+
+    def __init__(self):
+        self.agenda = []  # heap de (quando, sequencia, id_processo, pool, funcao, args)
+        self.sequencia = 0
+        self.condicao = threading.Condition()
+        self.thread = None
+
+    def agendar(self, espera, pool, id_processo, funcao, *args):
+        with self.condicao:
+            self.sequencia += 1
+            heapq.heappush(self.agenda, (time.time() + espera, self.sequencia, id_processo, pool, funcao, args))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, name='retentativas')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condicao.notify_all()
+
+    def _executar(self):
+        while True:
+            with self.condicao:
+                while not self.agenda or self.agenda[0][0] > time.time():
+                    self.condicao.wait(self.agenda[0][0] - time.time() if self.agenda else None)
+                _, _, id_processo, pool, funcao, args = heapq.heappop(self.agenda)
+            try:
+                pool.submeter(id_processo, funcao, *args)
+            except FilaCheia as e:
+                logger.info(f"🚦 {id_processo} - fila cheia, retentativa adiada {e.retry_after}s")
+                self.agendar(e.retry_after, pool, id_processo, funcao, *args)
+
+    def estatisticas(self):
+        with self.condicao:
+            return {
+                'estacionados': len(self.agenda),
+                'proxima_em_s': round(max(0, self.agenda[0][0] - time.time()), 1) if self.agenda else None
+            }
+
+class LimitadorHosts:
+    """Token bucket por host, compartilhado por todos os jobs. Um 429 esvazia o balde do host
+    até o fim do Retry-After."""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.baldes = {}  # host -> {'tokens', 'atualizado_em', 'bloqueado_ate'}
+        self.lock = threading.Lock()
+
+    def _balde(self, host, agora):
+        balde = self.baldes.setdefault(host, {'tokens': self.capacidade, 'atualizado_em': agora, 'bloqueado_ate': 0})
+        balde['tokens'] = min(self.capacidade, balde['tokens'] + (agora - balde['atualizado_em']) * self.taxa)
+        balde['atualizado_em'] = agora
+        return balde
+
+    def reservar(self, host):
+        """Consome um token e retorna 0, ou retorna quantos segundos esperar (sem consumir)"""
+        with self.lock:
+            agora = time.time()
+            balde = self._balde(host, agora)
+            if balde['bloqueado_ate'] > agora:
+                return balde['bloqueado_ate'] - agora
+            if balde['tokens'] >= 1:
+                balde['tokens'] -= 1
+                return 0
+            return (1 - balde['tokens']) / self.taxa
+
+    def penalizar(self, host, segundos):
+        with self.lock:
+            agora = time.time()
+            balde = self._balde(host, agora)
+            balde['tokens'] = 0
+            balde['bloqueado_ate'] = max(balde['bloqueado_ate'], agora + segundos)
+
+    def estatisticas(self):
+        with self.lock:
+            agora = time.time()
+            return {host: {'tokens': round(self._balde(host, agora)['tokens'], 2),
+                           'bloqueado_por_s': round(max(0, balde['bloqueado_ate'] - agora), 1)}
+                    for host, balde in self.baldes.items()}
+
+class DisjuntorUpstream:
+    """Circuit breaker por host: após N falhas seguidas de bloqueio/429 recusa jobs novos na hora.
+    Passado o tempo aberto, deixa uma tentativa de sonda passar; sucesso fecha, falha reabre."""
+
+    def __init__(self, limite_falhas, tempo_aberto):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self.estados = {}  # host -> {'falhas', 'aberto_ate', 'sondando'}
+        self.lock = threading.Lock()
+
+    def bloqueio_restante(self, host):
+        """Segundos até o circuito do host aceitar uma sonda (0 = fechado ou pronto para sondar)"""
+        with self.lock:
+            estado = self.estados.get(host)
+            if not estado or estado['falhas'] < self.limite_falhas:
+                return 0
+            return max(0, math.ceil(estado['aberto_ate'] - time.time()))
+
+    def permitir(self, host):
+        with self.lock:
+            estado = self.estados.get(host)
+            if not estado or estado['falhas'] < self.limite_falhas:
+                return True
+            if time.time() < estado['aberto_ate'] or estado['sondando']:
+                return False
+            estado['sondando'] = True  # Meio aberto: só esta tentativa passa
+            return True
+
+    def registrar_sucesso(self, host):
+        with self.lock:
+            self.estados.pop(host, None)
+
+    def registrar_falha(self, host):
+        with self.lock:
+            estado = self.estados.setdefault(host, {'falhas': 0, 'aberto_ate': 0, 'sondando': False})
+            estado['falhas'] += 1
+            estado['sondando'] = False
+            if estado['falhas'] >= self.limite_falhas:
+                if estado['falhas'] == self.limite_falhas:
+                    logger.warning(f"🔌 Circuito aberto para {host} por {self.tempo_aberto}s")
+                estado['aberto_ate'] = time.time() + self.tempo_aberto
+
+    def estatisticas(self):
+        with self.lock:
+            return {host: {'falhas_seguidas': estado['falhas'],
+                           'aberto': estado['falhas'] >= self.limite_falhas,
+                           'aberto_por_s': round(max(0, estado['aberto_ate'] - time.time()), 1)}
+                    for host, estado in self.estados.items()}
+
+agendador_retentativas = AgendadorRetentativas()
+limitador_hosts = LimitadorHosts(TAXA_REQUISICOES_HOST, RAJADA_REQUISICOES_HOST)
+disjuntor_upstream = DisjuntorUpstream(LIMITE_FALHAS_DISJUNTOR, TEMPO_DISJUNTOR_ABERTO)
+
+class EstacionarJob(Exception):
+    """A próxima tentativa deve esperar: o job sai do worker e volta pelo agendador"""
+
+    def __init__(self, tentativa, espera):
+        super().__init__(f"Tentativa {tentativa + 1} reagendada para daqui a {espera:.0f}s")
+        self.tentativa = tentativa
+        self.espera = espera
+
+class CircuitoAberto(Exception):
+    """Upstream recusando downloads; retry_after é quando o circuito aceita nova sonda"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"🚫 O YouTube está recusando downloads no momento. Tente novamente em {retry_after}s")
+        self.retry_after = retry_after
+
+def host_upstream(url):
+    """Host usado no limitador e no disjuntor (variantes do YouTube contam como um só). Sempre da URL
+    pedida pelo cliente: a admissão e o registro das falhas precisam olhar para o mesmo host."""
+    host = (urlparse(url).hostname or '').lower()
+    if (host in ('youtu.be', 'youtube.com', 'youtube-nocookie.com') or host.endswith('.youtube.com')
+            or host.endswith('.youtube-nocookie.com')):
+        return 'youtube.com'
+    return host
+
+def aguardar_vez_upstream(host, tentativa, estacionar):
+    """Token do limitador do host; sem token espera (ou levanta EstacionarJob com estacionar=True).
+    Depois exige o disjuntor fechado ou em sonda (CircuitoAberto)."""
+    while True:
+        espera = limitador_hosts.reservar(host)
+        if espera <= 0:
+            break
+        if estacionar:
+            raise EstacionarJob(tentativa, espera)
+        time.sleep(espera)
+    if not disjuntor_upstream.permitir(host):
+        raise CircuitoAberto(disjuntor_upstream.bloqueio_restante(host) or TEMPO_DISJUNTOR_ABERTO)
+
+def registrar_resultado_upstream(host, erro=None):
+    """Alimenta o disjuntor e o limitador com o resultado de uma tentativa. Retorna a classe do erro."""
+    if erro is None:
+        disjuntor_upstream.registrar_sucesso(host)
+        return None
+    classe_erro = classificar_erro(erro)
+    # Só bloqueio e rate limit contam para o disjuntor; outros erros mostram que o upstream responde
+    if classe_erro in ('bloqueio', 'rate_limit'):
+        disjuntor_upstream.registrar_falha(host)
+    else:
+        disjuntor_upstream.registrar_sucesso(host)
+    if classe_erro == 'rate_limit':
+        retry_after = extrair_retry_after(erro) or 30
+        logger.info(f"🔁 Rate limit detectado, segurando {host} por {retry_after}s...")
+        limitador_hosts.penalizar(host, retry_after)
+    return classe_erro
+
+def extrair_retry_after(erro):
+    """Retry-After (s) da resposta HTTP por trás de um erro do yt-dlp/requests, se houver"""
+    vistos = set()
+    while erro is not None and id(erro) not in vistos:
+        vistos.add(id(erro))
+        cabecalhos = getattr(getattr(erro, 'response', None), 'headers', None) or getattr(erro, 'headers', None)
+        valor = cabecalhos.get('Retry-After') if cabecalhos else None
+        if valor:
+            try:
+                return max(1, math.ceil(float(valor)))
+            except ValueError:
+                try:
+                    return max(1, math.ceil(parsedate_to_datetime(valor).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        exc_info = getattr(erro, 'exc_info', None)  # DownloadError do yt-dlp guarda o erro original aqui
+        erro = (exc_info[1] if exc_info else None) or getattr(erro, 'cause', None) or erro.__cause__ or erro.__context__
+    return None
+
+def anunciar_retentativa(id_processo, pendencia):
+    registro_jobs.atualizar(id_processo, etapa='aguardando_retentativa')
+    progresso_jobs.publicar(id_processo, proxima_tentativa=pendencia.tentativa + 1,
+                            retentativa_em=round(time.time() + pendencia.espera, 1))
+    logger.info(f"🅿️  {id_processo} - estacionado, tentativa {pendencia.tentativa + 1} em {pendencia.espera:.0f}s")
+
+def estacionar_job(id_processo, pendencia, funcao, *args):
+    """Devolve o worker e agenda a retomada do job (pendencia: EstacionarJob)"""
+    anunciar_retentativa(id_processo, pendencia)
+    agendador_retentativas.agendar(pendencia.espera, pool_download, id_processo, funcao, *args)
+
+def espera_circuito(url):
+    """Segundos de recusa para um job novo desta URL (0 se a fonte está em cache ou o circuito fechado)"""
+    video_id = extrair_video_id(url)
+    if video_id and cache_fontes.contem(video_id, FORMATO_FONTE):
+        return 0
+    return disjuntor_upstream.bloqueio_restante(host_upstream(url))
+
+def recusar_se_circuito_aberto(url):
+    """Resposta 503 para jobs novos enquanto o upstream nos recusa (None se o circuito está fechado)"""
+    espera = espera_circuito(url)
+    if not espera:
+        return None
+    resposta = jsonify({'erro': 'O YouTube está recusando downloads no momento, tente novamente mais tarde',
+                        'retry_after': espera})
+    resposta.headers['Retry-After'] = str(espera)
+    return resposta, 503
+
+# MÉTRICAS (Prometheus, expostas em /metrics)
+# estrategia: '1'..'6' (baixar_com_estrategia_extrema), 'trecho' (download parcial) ou 'cache'
+# caminho: 'hibrido' (miolo copiado) ou 'recodificacao' (cortar_audio_preciso), 'lote' (cortar_lote)
+BUCKETS_DURACAO = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+metrica_extracao = Histogram('ytcut_extracao_segundos', 'Extração das informações do vídeo (yt-dlp)',
+                             ['estrategia'], buckets=BUCKETS_DURACAO)
+metrica_download = Histogram('ytcut_download_segundos', 'Download da fonte, sem a extração',
+                             ['estrategia'], buckets=BUCKETS_DURACAO)
+metrica_corte = Histogram('ytcut_corte_segundos', 'Corte no ffmpeg', ['caminho'], buckets=BUCKETS_DURACAO)
+metrica_total = Histogram('ytcut_total_segundos', 'Ponta a ponta, da criação do job ao artefato pronto',
+                          ['estrategia', 'caminho'], buckets=BUCKETS_DURACAO)
+metrica_bytes_baixados = Counter('ytcut_bytes_baixados', 'Bytes de fontes baixadas', ['estrategia'])
+metrica_bytes_entregues = Counter('ytcut_bytes_entregues', 'Bytes entregues aos clientes', ['rota'])
+metrica_falhas = Counter('ytcut_falhas', 'Falhas por etapa e classe de erro', ['etapa', 'classe'])
+metrica_workers_ativos = Gauge('ytcut_workers_ativos', 'Workers ocupados por pool', ['pool'])
+metrica_fila = Gauge('ytcut_fila', 'Jobs aguardando na fila de cada pool', ['pool'])
+metrica_disco = Gauge('ytcut_disco_bytes', 'Espaço ocupado por diretório', ['diretorio'])
+metrica_download_partes = Histogram('ytcut_download_partes_segundos', 'Download da fonte em partes paralelas',
+                                    ['conexoes'], buckets=BUCKETS_DURACAO)
+metrica_picos = Histogram('ytcut_picos_segundos', 'Decodificação da fonte e cálculo dos picos da forma de onda',
+                          buckets=BUCKETS_DURACAO)
+metrica_bytes_recuperados = Counter('ytcut_bytes_recuperados', 'Bytes liberados pelo zelador de disco', ['diretorio'])
+
+# Trechos de mensagem -> classe do erro (nossos erros são quase todos Exception genérica)
+CLASSES_ERRO = [
+    ('BLOQUEIO', 'bloqueio'),
+    ("Sign in to confirm you're not a bot", 'bloqueio'),
+    ('HTTP Error 429', 'rate_limit'),
+    ('Timeout', 'timeout'),
+    ('FFmpeg', 'ffmpeg'),
+    ('Erro no corte', 'ffmpeg'),
+    ('Tempo final', 'validacao'),
+    ('Corte máximo', 'validacao'),
+]
+
+def classificar_erro(erro):
+    mensagem = str(erro)
+    for trecho, classe in CLASSES_ERRO:
+        if trecho in mensagem:
+            return classe
+    return type(erro).__name__ if type(erro) is not Exception else 'outro'
+
+def registrar_falha(etapa, erro):
+    metrica_falhas.labels(etapa, classificar_erro(erro)).inc()
+
+def tamanho_diretorio(diretorio):
+    total = 0
+    try:
+        for entrada in os.scandir(diretorio):
+            try:
+                if entrada.is_file():
+                    total += entrada.stat().st_size
+            except OSError:
+                pass  # Arquivo removido durante a varredura
+    except OSError:
+        pass
+    return total
+
+for pool in (pool_download, pool_corte):
+    metrica_workers_ativos.labels(pool.nome).set_function(lambda pool=pool: pool.ativos)
+    metrica_fila.labels(pool.nome).set_function(lambda pool=pool: len(pool.fila))
+metrica_fila.labels('retentativas').set_function(lambda: len(agendador_retentativas.agenda))
+
+for nome, diretorio in (('temp', TEMP_DIR), ('audio', AUDIO_FILES_DIR), ('cache', CACHE_DIR), ('previas', PREVIAS_DIR)):
+    metrica_disco.labels(nome).set_function(lambda diretorio=diretorio: tamanho_diretorio(diretorio))
+
+class ZeladorDisco:
+    """Mantém audio_files e temp_downloads dentro do orçamento (o cache de fontes tem o seu próprio).
+    Expira por TTL desde o último download e, acima do orçamento, remove os menos baixados recentemente.
+    Nunca remove arquivos de jobs em andamento nem com download aberto."""
+
+    def __init__(self, diretorios, intervalo):
+        self.diretorios = diretorios  # nome -> (caminho, max_bytes, ttl_segundos)
+        self.intervalo = intervalo
+        self.em_uso = {}  # caminho -> downloads/streams abertos
+        self.lock = threading.Lock()
+        self.recuperados = {nome: 0 for nome in diretorios}
+        self.ultima_passada = None
+        self.thread = None
+
+    def marcar_uso(self, caminho):
+        with self.lock:
+            self.em_uso[caminho] = self.em_uso.get(caminho, 0) + 1
+        try:
+            # atime = último download (o mtime continua valendo para o Last-Modified)
+            os.utime(caminho, (time.time(), os.path.getmtime(caminho)))
+        except OSError:
+            pass
+
+    def liberar_uso(self, caminho):
+        with self.lock:
+            restantes = self.em_uso.get(caminho, 0) - 1
+            if restantes > 0:
+                self.em_uso[caminho] = restantes
+            else:
+                self.em_uso.pop(caminho, None)
+
+    @staticmethod
+    def job_do_arquivo(nome_arquivo):
+        """id do job dono de um arquivo intermediário (temp_{id}_... ou {chave}.{id}.parcial.ext)"""
+        if nome_arquivo.startswith('temp_'):
+            return nome_arquivo[len('temp_'):].split('_')[0].split('.')[0]
+        partes = nome_arquivo.split('.')
+        if len(partes) >= 4 and partes[2] == 'parcial':
+            return partes[1]
+        return None
+
+    def limpar(self):
+        """Uma passada. Intermediários sem job em andamento são órfãos (worker morreu) quando passam de
+        PROTECAO_ACESSO_SEGUNDOS sem mexer, também na inicialização: streams, prévias e picos usam
+        temp_{id} fora do registro, e outro processo com o mesmo TEMP_DIR pode estar escrevendo neles."""
+        jobs_ativos = registro_jobs.ids_em_andamento()
+        agora = time.time()
+        relatorio = {}
+        for nome, (diretorio, max_bytes, ttl) in self.diretorios.items():
+            arquivos = []
+            try:
+                for entrada in os.scandir(diretorio):
+                    try:
+                        if entrada.is_file():
+                            estado = entrada.stat()
+                            arquivos.append((max(estado.st_atime, estado.st_mtime), estado.st_size, entrada.path))
+                    except OSError:
+                        pass
+            except OSError:
+                continue
+            arquivos.sort()  # Menos acessados recentemente primeiro
+            
+            ocupado = sum(tamanho for _, tamanho, _ in arquivos)
+            recuperado = 0
+            removidos = 0
+            for ultimo_acesso, tamanho, caminho in arquivos:
+                with self.lock:
+                    if self.em_uso.get(caminho):
+                        continue
+                dono = self.job_do_arquivo(os.path.basename(caminho))
+                if dono in jobs_ativos:
+                    continue
+                recente = agora - ultimo_acesso < PROTECAO_ACESSO_SEGUNDOS
+                if dono is not None:
+                    remover = not recente
+                else:
+                    remover = not recente and (agora - ultimo_acesso > ttl or ocupado > max_bytes)
+                if not remover:
+                    continue
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    continue
+                ocupado -= tamanho
+                recuperado += tamanho
+                removidos += 1
+            
+            if recuperado:
+                logger.info(f"🧹 Zelador ({nome}): {removidos} arquivos, {recuperado / (1024 * 1024):.1f} MB liberados")
+                metrica_bytes_recuperados.labels(nome).inc(recuperado)
+            with self.lock:
+                self.recuperados[nome] += recuperado
+            relatorio[nome] = {
+                'removidos': removidos,
+                'recuperado_bytes': recuperado,
+                'ocupado_bytes': ocupado,
+                'max_bytes': max_bytes,
+                'ttl_segundos': ttl
+            }
+        self.ultima_passada = agora
+        return relatorio
+
+    def _executar(self):
+        self._varredura_inicial()
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.limpar()
+            except Exception as e:
+                logger.error(f"💥 Erro no zelador de disco: {e}")
+
+    def _varredura_inicial(self):
+        """Órfãos deixados por um processo anterior (na thread do zelador: não atrasa a inicialização)"""
+        try:
+            relatorio = self.limpar()
+        except Exception as e:
+            logger.error(f"💥 Erro na varredura inicial do disco: {e}")
+            return
+        recuperado = sum(item['recuperado_bytes'] for item in relatorio.values())
+        logger.info(f"🧹 Varredura inicial do disco: {recuperado / (1024 * 1024):.1f} MB liberados")
+
+    def iniciar(self):
+        """Começa as passadas periódicas, a primeira delas varrendo os órfãos"""
+        self.thread = threading.Thread(target=self._executar, name='zelador-disco')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                'intervalo_s': self.intervalo,
+                'ultima_passada': self.ultima_passada,
+                'downloads_abertos': sum(self.em_uso.values()),
+                'recuperado_bytes': dict(self.recuperados)
+            }
+
+zelador_disco = ZeladorDisco({
+    'audio': (AUDIO_FILES_DIR, AUDIO_FILES_MAX_BYTES, AUDIO_FILES_TTL_SEGUNDOS),
+    'temp': (TEMP_DIR, TEMP_MAX_BYTES, TEMP_TTL_SEGUNDOS),
+    'previas': (PREVIAS_DIR, PREVIAS_MAX_BYTES, PREVIAS_TTL_SEGUNDOS),
+    'estado': (ESTADO_DIR, AUDIO_FILES_MAX_BYTES, AUDIO_FILES_TTL_SEGUNDOS),
+}, INTERVALO_ZELADOR_SEGUNDOS)
+zelador_disco.iniciar()
+marcar_inicializacao('metricas_zelador')
+
+_sessao_http = None
+_lock_sessao_http = threading.Lock()
+
+def sessao_http():
+    """requests.Session keep-alive compartilhada por todos os jobs: conexões TLS e DNS reaproveitados.
+    Até MAX_CONEXOES_HTTP conexões por host; acima disso a requisição espera uma conexão voltar ao pool.
+    Cabeçalhos vão por requisição (a sessão não guarda User-Agent)."""
+    global _sessao_http
+    if _sessao_http is None:
+        with _lock_sessao_http:
+            if _sessao_http is None:
+                requests = modulo('requests')
+                sessao = requests.Session()
+                adaptador = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=MAX_CONEXOES_HTTP,
+                                                          pool_block=True)
+                sessao.mount('http://', adaptador)
+                sessao.mount('https://', adaptador)
+                _sessao_http = sessao
+    return _sessao_http
+
+def perfil_youtubedl(tipo, tentativa=0):
+    """Chave do pool: as estratégias a partir da 5ª usam as mesmas opções"""
+    return ('trecho', 0) if tipo == 'trecho' else ('estrategia', min(tentativa, 4))
+
+def opcoes_perfil(perfil):
+    """Opções fixas de um perfil; outtmpl, ganchos e download_ranges são trocados a cada empréstimo"""
+    tipo, tentativa = perfil
+    opcoes = obter_configuracao_extrema(tentativa)
+    if tipo == 'estrategia' and tentativa >= 4:
+        # Estratégia especial para tentativas finais
+        opcoes['format'] = 'worstaudio/worst'
+        opcoes['no_check_certificate'] = True
+    # Erros do yt-dlp precisam subir: com ignoreerrors o 429 e o bloqueio viram um info None e
+    # não chegam a classificar_erro (disjuntor e Retry-After)
+    opcoes['ignoreerrors'] = False
+    opcoes['outtmpl'] = os.path.join(TEMP_DIR, 'temp_%(id)s.%(ext)s')
+    return opcoes
+
+def formato_baixado(perfil, info):
+    """Chave de cache do que o yt-dlp de fato baixou: FORMATO_FONTE só se o seletor pediu o melhor áudio e
+    veio só áudio; senão 'worstaudio' (estratégias mínimas) ou 'best' (veio com vídeo)"""
+    if info.get('vcodec') not in (None, 'none'):
+        return 'best'
+    if opcoes_perfil(perfil)['format'].startswith('worstaudio'):
+        return 'worstaudio'
+    return FORMATO_FONTE
+
+# Estado por job que o YoutubeDL guarda em atributos privados e que o pool zera a cada empréstimo (lista
+# conferida no yt-dlp fixado no requirements.txt). A primeira instância criada é verificada: se faltar algum
+# deles (ou _parse_outtmpl), o pool deixa de reaproveitar e cada job cria e fecha a sua instância
+ESTADO_JOB_YOUTUBEDL = {
+    '_progress_hooks': list,
+    '_download_retcode': int,
+    '_num_downloads': int,
+    '_num_videos': int,
+    '_playlist_level': int,
+    '_playlist_urls': set,
+    '_printed_messages': set,
+}
+
+class PoolYoutubeDL:
+    """Instâncias do YoutubeDL prontas (extratores carregados, seletor de formato compilado, conexões do
+    yt-dlp abertas), ociosas por perfil. Cada job toma uma emprestada com exclusividade e devolve no fim."""
+
+    def __init__(self, max_ociosos, usos_max):
+        self.max_ociosos = max_ociosos
+        self.usos_max = usos_max
+        self.ociosos = {}  # perfil -> [(ydl, usos)]
+        self.emprestados = {}  # id(ydl) -> (perfil, usos)
+        self.lock = threading.Lock()
+        self.reaproveitar = None  # Decidido na primeira instância criada (compativel)
+        self.criadas = 0
+        self.reaproveitadas = 0
+        self.descartadas = 0
+
+    def _criar(self, opcoes):
+        ydl = modulo('yt_dlp').YoutubeDL(opcoes)
+        if self.reaproveitar is None:
+            self.reaproveitar = self.compativel(ydl)
+        with self.lock:
+            self.criadas += 1
+        return ydl
+
+    @staticmethod
+    def compativel(ydl):
+        """O YoutubeDL instalado tem os atributos que emprestar() zera ao reaproveitar uma instância?"""
+        faltando = [nome for nome in ESTADO_JOB_YOUTUBEDL if not hasattr(ydl, nome)]
+        if not callable(getattr(ydl, '_parse_outtmpl', None)):
+            faltando.append('_parse_outtmpl')
+        if faltando:
+            versao = modulo('yt_dlp').version.__version__
+            logger.warning(f"⚠️  yt-dlp {versao} sem {', '.join(faltando)}: instâncias do YoutubeDL não serão "
+                           f"reaproveitadas entre jobs")
+            return False
+        return True
+
+    def emprestar(self, perfil, outtmpl, ganchos=(), download_ranges=None):
+        """Instância do perfil com o estado do job anterior zerado; devolver() obrigatório"""
+        ydl, usos = None, 0
+        if self.reaproveitar:
+            with self.lock:
+                ociosos = self.ociosos.get(perfil)
+                ydl, usos = ociosos.pop() if ociosos else (None, 0)
+                if ydl is not None:
+                    self.reaproveitadas += 1
+
+        if ydl is None:
+            # Instância nova: tudo pelas opções e pela API pública
+            opcoes = opcoes_perfil(perfil)
+            opcoes['outtmpl'] = outtmpl
+            if download_ranges:
+                opcoes['download_ranges'] = download_ranges
+            ydl = self._criar(opcoes)
+            for gancho in ganchos:
+                ydl.add_progress_hook(gancho)
+        else:
+            ydl.params['outtmpl'] = outtmpl
+            ydl._parse_outtmpl()
+            if download_ranges:
+                ydl.params['download_ranges'] = download_ranges
+            else:
+                ydl.params.pop('download_ranges', None)
+            for nome, inicial in ESTADO_JOB_YOUTUBEDL.items():
+                setattr(ydl, nome, inicial())
+            ydl._progress_hooks.extend(ganchos)
+        with self.lock:
+            self.emprestados[id(ydl)] = (perfil, usos + 1)
+        return ydl
+
+    def devolver(self, ydl, descartar=False):
+        """Volta ao pool; com descartar=True (erro no job), acima do limite de ociosos ou de usos, ou se o
+        yt-dlp instalado não permitir reaproveitar, é fechada"""
+        if self.reaproveitar:
+            ydl._progress_hooks = []
+        with self.lock:
+            perfil, usos = self.emprestados.pop(id(ydl))
+            ociosos = self.ociosos.setdefault(perfil, [])
+            if (self.reaproveitar and not descartar and usos < self.usos_max
+                    and len(ociosos) < self.max_ociosos):
+                ociosos.append((ydl, usos))
+                return
+            self.descartadas += 1
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.warning(f"⚠️  Falha ao fechar YoutubeDL: {e}")
+
+    def preparar(self, perfil):
+        """Deixa uma instância ociosa do perfil (aquecimento; a primeira também verifica o yt-dlp instalado)"""
+        with self.lock:
+            if self.ociosos.get(perfil) or self.reaproveitar is False:
+                return
+        ydl = self._criar(opcoes_perfil(perfil))
+        if not self.reaproveitar:
+            ydl.close()
+            return
+        with self.lock:
+            self.ociosos.setdefault(perfil, []).append((ydl, 0))
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                'criadas': self.criadas,
+                'reaproveitadas': self.reaproveitadas,
+                'descartadas': self.descartadas,
+                'reaproveitar': self.reaproveitar,
+                'emprestadas': len(self.emprestados),
+                'ociosas': {f'{tipo}_{tentativa}': len(ociosos) for (tipo, tentativa), ociosos in self.ociosos.items()},
+                'max_ociosas_por_perfil': self.max_ociosos,
+                'usos_max': self.usos_max
+            }
+
+pool_youtubedl = PoolYoutubeDL(MAX_YOUTUBEDL_OCIOSOS, USOS_MAX_YOUTUBEDL)
+
+class SemSuporteRange(Exception):
+    """O servidor ignora Range ou não informa o tamanho: o download em partes não se aplica"""
+
+def sondar_tamanho(sessao, url, cabecalhos):
+    """Tamanho total pela resposta a um Range de 1 byte"""
+    resposta = sessao.get(url, headers=dict(cabecalhos, Range='bytes=0-0'), timeout=30, stream=True)
+    with resposta:
+        intervalo = resposta.headers.get('Content-Range', '')
+        if resposta.status_code != 206 or '/' not in intervalo or intervalo.endswith('/*'):
+            raise SemSuporteRange(f'HTTP {resposta.status_code}, Content-Range {intervalo!r}')
+        return int(intervalo.rsplit('/', 1)[1])
+
+def baixar_em_partes(url, cabecalhos, destino, conexoes, ao_progredir=None):
+    """Baixa `url` em faixas de até TAMANHO_PARTE_DOWNLOAD por `conexoes` conexões simultâneas; cada faixa
+    é escrita na sua posição de `destino`, pré-alocado com o tamanho total. Faixa interrompida continua de
+    onde parou (até TENTATIVAS_PARTE vezes). Retorna o tamanho; SemSuporteRange se o servidor não aceitar Range.
+    ao_progredir recebe dicionários no formato dos progress_hooks do yt-dlp.
+    As conexões vêm de sessao_http() e continuam abertas para o próximo job no mesmo host."""
+    requests = modulo('requests')
+    sessao = sessao_http()
+    tamanho = sondar_tamanho(sessao, url, cabecalhos)
+    tamanho_parte = max(TAMANHO_MIN_PARTE, min(TAMANHO_PARTE_DOWNLOAD, math.ceil(tamanho / conexoes)))
+    partes = deque((inicio, min(inicio + tamanho_parte, tamanho) - 1) for inicio in range(0, tamanho, tamanho_parte))
+    with open(destino, 'wb') as f:
+        if hasattr(os, 'posix_fallocate') and tamanho:
+            os.posix_fallocate(f.fileno(), 0, tamanho)
+        else:
+            f.truncate(tamanho)
+    
+    lock = threading.Lock()
+    estado = {'baixado': 0, 'erro': None}
+    inicio_download = time.time()
+    
+    def baixar_parte(arquivo, inicio, fim):
+        posicao = inicio
+        for _ in range(TENTATIVAS_PARTE):
+            try:
+                resposta = sessao.get(url, headers=dict(cabecalhos, Range=f'bytes={posicao}-{fim}'),
+                                      timeout=45, stream=True)
+                with resposta:
+                    if resposta.status_code != 206:
+                        raise IOError(f'HTTP {resposta.status_code} na faixa {posicao}-{fim}')
+                    arquivo.seek(posicao)
+                    for bloco in resposta.iter_content(256 * 1024):
+                        bloco = bloco[:fim - posicao + 1]
+                        arquivo.write(bloco)
+                        posicao += len(bloco)
+                        with lock:
+                            estado['baixado'] += len(bloco)
+                            baixado = estado['baixado']
+                        if ao_progredir:
+                            decorrido = max(time.time() - inicio_download, 1e-6)
+                            ao_progredir({'status': 'downloading', 'downloaded_bytes': baixado,
+                                          'total_bytes': tamanho, 'speed': baixado / decorrido})
+                        if posicao > fim:
+                            return
+            except (requests.RequestException, OSError) as e:
+                logger.warning(f"⚠️  Faixa {inicio}-{fim} interrompida em {posicao}: {e}")
+        raise IOError(f'Faixa {inicio}-{fim} incompleta após {TENTATIVAS_PARTE} tentativas')
+    
+    def trabalhar():
+        with open(destino, 'r+b') as arquivo:
+            while True:
+                with lock:
+                    if estado['erro'] or not partes:
+                        return
+                    inicio, fim = partes.popleft()
+                try:
+                    baixar_parte(arquivo, inicio, fim)
+                except Exception as e:
+                    with lock:
+                        estado['erro'] = estado['erro'] or e
+                    return
+    
+    threads = [threading.Thread(target=trabalhar, name=f'parte-{indice + 1}', daemon=True)
+               for indice in range(min(conexoes, len(partes)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if estado['erro']:
+        raise estado['erro']
+    if ao_progredir:
+        ao_progredir({'status': 'finished', 'downloaded_bytes': tamanho, 'total_bytes': tamanho})
+    return tamanho
+
+def processar_download(ydl, info, id_processo):
+    """process_ie_result(download=True) do yt-dlp. Com CONEXOES_DOWNLOAD > 1 e formato progressivo o
+    arquivo vem de baixar_em_partes, no mesmo nome que o yt-dlp usaria; se as partes falharem (sem Range,
+    erro no meio), o próprio yt-dlp baixa por uma conexão."""
+    if CONEXOES_DOWNLOAD <= 1:
+        return ydl.process_ie_result(info, download=True)
+    
+    resolvido = ydl.process_ie_result(copy.deepcopy(info), download=False)  # Só escolhe o formato
+    if (not resolvido or resolvido.get('_type', 'video') != 'video' or resolvido.get('requested_formats')
+            or resolvido.get('protocol') not in ('http', 'https') or not resolvido.get('url')):
+        return ydl.process_ie_result(info, download=True)
+    
+    destino = ydl.prepare_filename(resolvido)
+    parcial = destino + '.part'
+    inicio = time.time()
+    try:
+        tamanho = baixar_em_partes(resolvido['url'], resolvido.get('http_headers') or {}, parcial,
+                                   CONEXOES_DOWNLOAD, gancho_progresso_download(id_processo))
+    except Exception as e:
+        logger.warning(f"📶 Download em partes indisponível ({e}), baixando por uma conexão")
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        return ydl.process_ie_result(info, download=True)
+    
+    os.replace(parcial, destino)
+    duracao = time.time() - inicio
+    metrica_download_partes.labels(str(CONEXOES_DOWNLOAD)).observe(duracao)
+    logger.info(f"📶 {tamanho / (1024 * 1024):.1f} MB em {duracao:.1f}s por {CONEXOES_DOWNLOAD} conexões "
+                f"({tamanho / (1024 * 1024) / max(duracao, 1e-6):.1f} MB/s)")
+    return resolvido
+
+def baixar_com_estrategia_extrema(url, id_processo, tentativas=6, tentativa_inicial=0, estacionar=False):
+    """Sistema extremo de download com múltiplas estratégias. Retorna (arquivo, titulo, estrategia, formato),
+    formato sendo o que foi de fato baixado (formato_baixado).
+    Com estacionar=True não dorme entre tentativas: levanta EstacionarJob e o job é retomado
+    depois em tentativa_inicial. Sem isso espera na própria thread (corte síncrono, benchmark)."""
     
+    host = host_upstream(url)  # Antes da troca pela URL alternativa: o mesmo host da admissão
     video_id = extrair_video_id(url)
     if video_id:
         # Tentar URL alternativa primeiro
@@ -185,29 +1888,39 @@ def baixar_com_estrategia_extrema(url, id_processo, tentativas=6):
             url = url_alternativa
             logger.info("🔄 Usando URL alternativa para contornar bloqueio")
     
-    for tentativa in range(tentativas):
+    tentativa = tentativa_inicial
+    while tentativa < tentativas:
+        estrategia = str(tentativa + 1)
+        
+        # Limite compartilhado por host (inclui o Retry-After de um 429 recebido por qualquer job)
+        aguardar_vez_upstream(host, tentativa, estacionar)
+        
+        classe_erro = None
         try:
             logger.info(f"🔄 TENTATIVA {tentativa + 1}/{tentativas} - Estratégia {tentativa + 1}")
             
-            # Delay estratégico progressivo
-            if tentativa > 0:
-                wait_time = tentativa * 5 + random.randint(2, 8)
-                logger.info(f"⏳ Delay estratégico de {wait_time}s...")
-                time.sleep(wait_time)
+            logger.info(f"🎯 Aplicando estratégia anti-bloqueio {tentativa + 1}...")
             
-            ydl_opts = obter_configuracao_extrema(tentativa)
-            ydl_opts['outtmpl'] = os.path.join(TEMP_DIR, f'temp_{id_processo}_v{tentativa}.%(ext)s')
-            
-            # Estratégia especial para tentativas finais
-            if tentativa >= 4:
-                ydl_opts['format'] = 'worstaudio/worst'
-                ydl_opts['ignoreerrors'] = True
-                ydl_opts['no_check_certificate'] = True
-            
-            logger.info(f"🎯 Aplicando estratégia anti-bloqueio {tentativa + 1}...")
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_completo = ydl.extract_info(url, download=True)
+            # Instância reaproveitada do perfil da estratégia (a partir da 5ª: formato mínimo)
+            perfil = perfil_youtubedl('estrategia', tentativa)
+            ydl = pool_youtubedl.emprestar(perfil,
+                                           os.path.join(TEMP_DIR, f'temp_{id_processo}_v{tentativa}.%(ext)s'),
+                                           [gancho_progresso_download(id_processo)])
+            descartar = True
+            try:
+                # Extração e download separados para medir cada etapa
+                inicio_etapa = time.time()
+                info_completo = ydl.extract_info(url, download=False, process=False)
+                if not info_completo:
+                    raise Exception("yt-dlp não retornou as informações do vídeo")
+                metrica_extracao.labels(estrategia).observe(time.time() - inicio_etapa)
+                inicio_etapa = time.time()
+                info_completo = processar_download(ydl, info_completo, id_processo)
+                metrica_download.labels(estrategia).observe(time.time() - inicio_etapa)
+                descartar = False
+            finally:
+                pool_youtubedl.devolver(ydl, descartar)
+            registrar_resultado_upstream(host)
             
             # Verificar resultado do download
             for arquivo in os.listdir(TEMP_DIR):
@@ -217,7 +1930,9 @@ def baixar_com_estrategia_extrema(url, id_processo, tentativas=6):
                         tamanho = os.path.getsize(arquivo_path) / (1024 * 1024)
                         logger.info(f"🎉 TENTATIVA {tentativa + 1} BEM-SUCEDIDA!")
                         logger.info(f"📦 Arquivo: {tamanho:.2f} MB")
-                        return arquivo_path, info_completo.get('title', 'Áudio')
+                        metrica_bytes_baixados.labels(estrategia).inc(os.path.getsize(arquivo_path))
+                        return (arquivo_path, info_completo.get('title', 'Áudio'), estrategia,
+                                formato_baixado(perfil, info_completo))
                     else:
                         logger.warning("📁 Arquivo muito pequeno, tentando próxima estratégia...")
                         try:
@@ -229,15 +1944,20 @@ def baixar_com_estrategia_extrema(url, id_processo, tentativas=6):
         except Exception as e:
             error_msg = str(e)
             logger.warning(f"⚠️  Tentativa {tentativa + 1} falhou: {error_msg[:100]}...")
-            
-            # Estratégias específicas para erros conhecidos
-            if "Sign in to confirm you're not a bot" in error_msg:
+            registrar_falha('tentativa', e)
+            classe_erro = registrar_resultado_upstream(host, e)
+        
+        tentativa += 1
+        if tentativa < tentativas:
+            # Delay estratégico progressivo (maior depois de bloqueio)
+            espera = tentativa * 5 + random.randint(2, 8)
+            if classe_erro == 'bloqueio':
                 logger.info("🎯 BLOQUEIO DETECTADO! Aplicando contramedidas...")
-                time.sleep(15)  # Delay maior para bloqueios
-            elif "HTTP Error 429" in error_msg:
-                logger.info("🔁 Rate limit detectado, aumentando delay...")
-                time.sleep(30)
-            continue
+                espera += 15
+            logger.info(f"⏳ Delay estratégico de {espera}s...")
+            if estacionar:
+                raise EstacionarJob(tentativa, espera)
+            time.sleep(espera)
     
     # SE CHEGOU AQUI, TODAS AS ESTRATÉGIAS FALHARAM
     raise Exception(
@@ -250,43 +1970,181 @@ def baixar_com_estrategia_extrema(url, id_processo, tentativas=6):
         "• Tente vídeos menos populares ou mais antigos"
     )
 
-def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos):
-    """Corte temporal preciso com FFmpeg"""
+def baixar_trecho(url, id_processo, inicio_segundos, fim_segundos, estacionar=False):
+    """Baixa apenas [inicio, fim] + margem via download_ranges do yt-dlp (busca no próprio ffmpeg).
+    Retorna (arquivo, titulo, deslocamento_segundos) ou None se a fonte não permitir busca.
+    Passa pelo mesmo limitador e disjuntor do download completo (estacionar: ver baixar_com_estrategia_extrema)."""
+    inicio_trecho = max(0, inicio_segundos - MARGEM_TRECHO_SEGUNDOS)
+    fim_trecho = fim_segundos + MARGEM_TRECHO_SEGUNDOS
+    prefixo = f'temp_{id_processo}_trecho'
+    host = host_upstream(url)
+    aguardar_vez_upstream(host, 0, estacionar)
+
+    try:
+        logger.info(f"✂️  Download parcial: {inicio_trecho}s → {fim_trecho}s")
+        intervalo = modulo('yt_dlp').utils.download_range_func(None, [(inicio_trecho, fim_trecho)])
+        ydl = pool_youtubedl.emprestar(perfil_youtubedl('trecho'), os.path.join(TEMP_DIR, f'{prefixo}.%(ext)s'),
+                                       [gancho_progresso_download(id_processo)], intervalo)
+        descartar = True
+        try:
+            inicio_etapa = time.time()
+            info = ydl.extract_info(url, download=False, process=False)
+            metrica_extracao.labels('trecho').observe(time.time() - inicio_etapa)
+            inicio_etapa = time.time()
+            info = ydl.process_ie_result(info, download=True)
+            metrica_download.labels('trecho').observe(time.time() - inicio_etapa)
+            descartar = False
+        except Exception as e:
+            registrar_resultado_upstream(host, e)
+            raise
+        finally:
+            pool_youtubedl.devolver(ydl, descartar)
+        registrar_resultado_upstream(host)
+
+        if info and info.get('is_live'):
+            raise Exception("Transmissão ao vivo não permite download parcial")
+
+        for arquivo in os.listdir(TEMP_DIR):
+            if arquivo.startswith(prefixo) and not arquivo.endswith('.part'):
+                arquivo_path = os.path.join(TEMP_DIR, arquivo)
+                if os.path.getsize(arquivo_path) > 0:
+                    tamanho = os.path.getsize(arquivo_path) / (1024 * 1024)
+                    logger.info(f"🎉 Trecho baixado: {tamanho:.2f} MB")
+                    metrica_bytes_baixados.labels('trecho').inc(os.path.getsize(arquivo_path))
+                    return arquivo_path, info.get('title', 'Áudio'), inicio_trecho
+
+        raise Exception("Arquivo do trecho não encontrado")
+
+    except Exception as e:
+        logger.warning(f"⚠️  Download parcial indisponível ({str(e)[:100]}), usando download completo")
+        registrar_falha('trecho', e)
+        for arquivo in os.listdir(TEMP_DIR):
+            if arquivo.startswith(prefixo):
+                try:
+                    os.remove(os.path.join(TEMP_DIR, arquivo))
+                except:
+                    pass
+        return None
+
+def obter_fonte_completa(url, id_processo, video_id, tentativa=0, estacionar=False):
+    """Retorna (arquivo, titulo, em_cache, estrategia, formato) com a faixa inteira, do cache ou baixando.
+    A consulta é sempre por FORMATO_FONTE; um download degradado (estratégia mínima) é guardado sob o formato
+    que de fato veio e não é servido como a melhor fonte. tentativa/estacionar: ver baixar_com_estrategia_extrema"""
+    if not video_id:
+        logger.info("📥 INICIANDO SISTEMA ANTI-BLOQUEIO...")
+        arquivo_temp, titulo, estrategia, formato = baixar_com_estrategia_extrema(url, id_processo, 6, tentativa,
+                                                                                  estacionar)
+        return arquivo_temp, titulo, False, estrategia, formato
+
+    estrategia = 'cache'
+    formato = FORMATO_FONTE
+    with cache_fontes.bloqueio_download(video_id, FORMATO_FONTE):
+        fonte = cache_fontes.adquirir(video_id, FORMATO_FONTE)
+        if fonte:
+            logger.info("⚡ Fonte encontrada no cache, pulando download")
+        else:
+            logger.info("📥 INICIANDO SISTEMA ANTI-BLOQUEIO...")
+            arquivo_temp, titulo, estrategia, formato = baixar_com_estrategia_extrema(url, id_processo, 6, tentativa,
+                                                                                      estacionar)
+            if formato != FORMATO_FONTE:
+                logger.info(f"📉 Fonte degradada ({formato}), guardada fora da chave {FORMATO_FONTE}")
+            fonte = cache_fontes.guardar(video_id, formato, arquivo_temp, titulo)
+    return fonte[0], fonte[1], True, estrategia, formato
+
+CODEC_POR_FORMATO = {'mp3': 'mp3', 'm4a': 'aac', 'opus': 'opus', 'ogg': 'vorbis'}
+MIMETYPE_POR_EXTENSAO = {'.mp3': 'audio/mpeg', '.m4a': 'audio/mp4', '.opus': 'audio/ogg', '.ogg': 'audio/ogg'}
+# Muxer para o stdout no streaming (MP4 só é transmissível fragmentado)
+MUXER_STREAM_POR_CODEC = {
+    'mp3': ['-f', 'mp3'],
+    'aac': ['-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4'],
+    'opus': ['-f', 'ogg'],
+    'vorbis': ['-f', 'ogg'],
+}
+
+def codec_saida(formato_saida, info):
+    """Codec do artefato: o da fonte para 'original' (MP3 se a fonte tiver um codec sem contêiner aqui)"""
+    if formato_saida == 'original':
+        codec = info['codec'] if info else None
+        return codec if codec in EXTENSAO_POR_CODEC else 'mp3'
+    return CODEC_POR_FORMATO[formato_saida]
+
+def mimetype_artefato(caminho):
+    return MIMETYPE_POR_EXTENSAO.get(os.path.splitext(caminho)[1].lower(), 'application/octet-stream')
+
+# FORMA DE ONDA: picos min/max da fonte em PCM mono, em níveis de zoom (cada um FATOR_ZOOM_PICOS vezes
+# mais grosso que o anterior), gravados como .npy ao lado da fonte em cache
+TAXA_PICOS = 8000  # Hz do PCM decodificado
+AMOSTRAS_POR_PICO = 256  # Nível 0: ~31 picos por segundo
+FATOR_ZOOM_PICOS = 4
+MIN_PICOS_NIVEL = 1000  # Não cria níveis mais grossos que isso
+MAX_PONTOS_PICOS = 10000
+MAX_PICOS_SIMULTANEOS = int(os.environ.get('MAX_PICOS_SIMULTANEOS', 2))
+semaforo_picos = threading.BoundedSemaphore(MAX_PICOS_SIMULTANEOS)
+
+# PRÉVIA: clipe curto, mono e de bitrate baixo para conferir os pontos de corte, fora dos pools de jobs
+MAX_DURACAO_PREVIA = int(os.environ.get('MAX_DURACAO_PREVIA', 120))
+MAX_PREVIAS_SIMULTANEAS = int(os.environ.get('MAX_PREVIAS_SIMULTANEAS', 8))
+ARGUMENTOS_PREVIA = ['-ac', '1', '-ar', '22050', '-c:a', 'libmp3lame', '-b:a', '48k']
+semaforo_previas = threading.BoundedSemaphore(MAX_PREVIAS_SIMULTANEAS)
+
+# LOTE: vários cortes de um mesmo vídeo com um download e uma única passada do ffmpeg
+MAX_SEGMENTOS_LOTE = int(os.environ.get('MAX_SEGMENTOS_LOTE', 50))
+
+# ENVIO DE ARQUIVOS: 'flask' (padrão), 'x-accel' (nginx) ou 'x-sendfile' (apache/lighttpd)
+MODO_ENVIO_ARQUIVOS = os.environ.get('MODO_ENVIO_ARQUIVOS', 'flask')
+PREFIXO_X_ACCEL = os.environ.get('PREFIXO_X_ACCEL', '/_audio_files/')  # location `internal` do nginx
+CACHE_ARTEFATOS_SEGUNDOS = 365 * 24 * 3600  # Artefatos endereçados por conteúdo nunca mudam
+app.config['USE_X_SENDFILE'] = MODO_ENVIO_ARQUIVOS == 'x-sendfile'
+
+# PROGRESSO (SSE): intervalo entre heartbeats e entre publicações de progresso por job
+INTERVALO_HEARTBEAT_SSE = 15
+INTERVALO_PROGRESSO_SEGUNDOS = 0.5
+
+# STREAMING: cortes curtos enviados direto do stdout do ffmpeg, sem passar pelo disco
+MAX_DURACAO_STREAM = int(os.environ.get('MAX_DURACAO_STREAM', 600))
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 4))
+TAMANHO_BLOCO_STREAM = 64 * 1024
+semaforo_streams = threading.BoundedSemaphore(MAX_STREAMS)
+
+def comando_recodificacao(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos):
+    codec = CODEC_POR_EXTENSAO.get(os.path.splitext(arquivo_saida)[1].lower(), 'mp3')
+    return [
+        'ffmpeg', '-ss', str(inicio_segundos), '-i', arquivo_entrada,
+        '-t', str(fim_segundos - inicio_segundos), '-vn',
+        *ARGUMENTOS_POR_CODEC[codec],
+        '-af', 'volume=1.0', '-y',
+        '-hide_banner', '-loglevel', 'error',
+        arquivo_saida
+    ]
+
+def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, ao_progredir=None,
+                         info=None):
+    """Corte temporal preciso com FFmpeg. Retorna o caminho usado: 'hibrido' ou 'recodificacao'.
+    O codec da saída vem da extensão de arquivo_saida; info é o analisar_audio da entrada, se já feito.
+    ao_progredir(segundos) recebe o tempo já codificado, lido do -progress do ffmpeg."""
     try:
         duracao = fim_segundos - inicio_segundos
         logger.info(f"✂️  Cortando áudio: {inicio_segundos}s → {fim_segundos}s ({duracao}s)")
         
-        # PRIMEIRA TENTATIVA: Corte rápido sem recompressão
-        comando = [
-            'ffmpeg', '-i', arquivo_entrada,
-            '-ss', str(inicio_segundos), '-to', str(fim_segundos),
-            '-c', 'copy', '-y', '-hide_banner', '-loglevel', 'error',
-            arquivo_saida
-        ]
-        
-        resultado = subprocess.run(comando, capture_output=True, text=True, timeout=120)
-        
-        if resultado.returncode == 0 and os.path.exists(arquivo_saida):
-            tamanho = os.path.getsize(arquivo_saida) / (1024 * 1024)
-            logger.info(f"✅ Corte rápido concluído: {tamanho:.2f} MB")
-            return True
+        info = info or analisar_audio(arquivo_entrada)
         
-        # SEGUNDA TENTATIVA: Com recompressão MP3
-        comando = [
-            'ffmpeg', '-i', arquivo_entrada,
-            '-ss', str(inicio_segundos), '-to', str(fim_segundos),
-            '-c:a', 'libmp3lame', '-b:a', '192k', 
-            '-af', 'volume=1.0', '-y',
-            '-hide_banner', '-loglevel', 'error',
-            arquivo_saida
-        ]
+        # PRIMEIRA TENTATIVA: Híbrido (bordas recodificadas + miolo copiado) quando o codec é o mesmo
+        if usar_corte_hibrido(info, arquivo_saida, inicio_segundos, fim_segundos):
+            if cortar_hibrido(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info, TEMP_DIR,
+                              ao_progredir):
+                tamanho = os.path.getsize(arquivo_saida) / (1024 * 1024)
+                logger.info(f"✅ Corte híbrido concluído: {tamanho:.2f} MB")
+                return 'hibrido'
+            logger.info("🔄 Corte híbrido indisponível, recodificando o trecho inteiro...")
         
-        resultado = subprocess.run(comando, capture_output=True, text=True, timeout=180)
+        # SEGUNDA TENTATIVA: Recodificando o trecho inteiro (busca na entrada, sem decodificar o início)
+        resultado = executar_ffmpeg(comando_recodificacao(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos),
+                                    180, ao_progredir)
         
         if resultado.returncode == 0 and os.path.exists(arquivo_saida):
             tamanho = os.path.getsize(arquivo_saida) / (1024 * 1024)
             logger.info(f"✅ Corte com recompressão concluído: {tamanho:.2f} MB")
-            return True
+            return 'recodificacao'
             
         raise Exception(f"FFmpeg falhou após 2 tentativas")
         
@@ -295,77 +2153,585 @@ def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_se
     except Exception as e:
         raise Exception(f"Erro no corte: {e}")
 
-def processar_audio_extremo(url, inicio_segundos, fim_segundos, id_processo, nome_arquivo=None):
-    """Processamento com todas as estratégias anti-bloqueio"""
-    arquivo_temp = None
+def comando_lote(arquivo_entrada, cortes):
+    """A entrada é decodificada uma vez, a partir do corte mais cedo; cada saída tem sua janela
+    (e o codec da sua extensão)"""
+    inicio_leitura = min(inicio for inicio, _, _ in cortes)
+    comando = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+               '-ss', str(inicio_leitura), '-i', arquivo_entrada]
+    for inicio, fim, arquivo_saida in cortes:
+        codec = CODEC_POR_EXTENSAO.get(os.path.splitext(arquivo_saida)[1].lower(), 'mp3')
+        comando += ['-map', '0:a', '-ss', str(inicio - inicio_leitura), '-t', str(fim - inicio),
+                    *ARGUMENTOS_POR_CODEC[codec], arquivo_saida]
+    return comando
+
+def cortar_lote(arquivo_entrada, cortes):
+    """Gera todos os cortes [(inicio, fim, arquivo_saida), ...] numa só invocação do ffmpeg"""
+    logger.info(f"✂️  Cortando lote de {len(cortes)} clipes numa única passada...")
+    inicio_etapa = time.time()
     try:
-        logger.info(f"🎬 INICIANDO PROCESSAMENTO ULTRA-RESISTENTE: {id_processo}")
-        logger.info(f"🔗 URL: {url}")
-        logger.info(f"⏰ Corte: {inicio_segundos}s a {fim_segundos}s")
-        
-        # Validações
-        if fim_segundos <= inicio_segundos:
-            raise Exception("Tempo final deve ser maior que o inicial")
-        
-        if fim_segundos - inicio_segundos > 3600:  # 1 hora máximo
-            raise Exception("Corte máximo de 1 hora")
-        
-        # 1. DOWNLOAD COM ESTRATÉGIAS EXTREMAS
-        logger.info("📥 INICIANDO SISTEMA ANTI-BLOQUEIO...")
-        arquivo_temp, titulo = baixar_com_estrategia_extrema(url, id_processo, tentativas=6)
-        
-        # 2. PREPARAR ARQUIVO FINAL
-        if nome_arquivo and nome_arquivo.strip():
-            nome_base = sanitizar_nome_arquivo(nome_arquivo)
-            nome_final = f"{nome_base}.mp3"
+        resultado = subprocess.run(comando_lote(arquivo_entrada, cortes), capture_output=True, text=True, timeout=600)
+    except subprocess.TimeoutExpired:
+        raise Exception("Timeout no corte do lote")
+    metrica_corte.labels('lote').observe(time.time() - inicio_etapa)
+    if resultado.returncode != 0:
+        logger.warning(f"⚠️  FFmpeg do lote falhou: {resultado.stderr[:200]}")
+    return clipes_gerados(cortes)
+
+def clipes_gerados(cortes):
+    return [os.path.exists(arquivo_saida) and os.path.getsize(arquivo_saida) > 0
+            for _, _, arquivo_saida in cortes]
+
+def comando_corte_stream(arquivo_entrada, inicio_segundos, fim_segundos, codec='mp3'):
+    """Mesmo corte com busca na entrada de cortar_audio_preciso, mas com a saída no stdout"""
+    return [
+        'ffmpeg', '-ss', str(inicio_segundos), '-i', arquivo_entrada,
+        '-t', str(fim_segundos - inicio_segundos), '-vn',
+        *ARGUMENTOS_POR_CODEC[codec],
+        '-hide_banner', '-loglevel', 'error',
+        *MUXER_STREAM_POR_CODEC[codec], 'pipe:1'
+    ]
+
+def iniciar_corte_stream(arquivo_entrada, inicio_segundos, fim_segundos, codec='mp3'):
+    return abrir_ffmpeg_stream(comando_corte_stream(arquivo_entrada, inicio_segundos, fim_segundos, codec))
+
+def abrir_ffmpeg_stream(comando, limite_stderr=4000):
+    """Sobe o ffmpeg de stream/prévia e lê o primeiro bloco antes de responder: se ele morre sem produzir
+    nada, a falha vira 500 com o stderr em vez de um 200 vazio.
+    Retorna (processo, erros, primeiro_bloco); erros() devolve o final do stderr depois que o processo acabou."""
+    processo = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    final = [b'']
+    
+    def drenar():
+        # Lê até o fim (o pipe nunca enche) e guarda só o final, que é onde o ffmpeg explica a falha
+        for linha in processo.stderr:
+            final[0] = (final[0] + linha)[-limite_stderr:]
+    
+    leitor = threading.Thread(target=drenar, daemon=True)
+    leitor.start()
+    
+    def erros():
+        leitor.join(timeout=5)
+        return final[0].decode(errors='replace')
+    
+    try:
+        primeiro = processo.stdout.read(TAMANHO_BLOCO_STREAM)
+        if not primeiro and processo.wait() != 0:
+            raise Exception(f"FFmpeg falhou (código {processo.returncode}): {erros()[-300:]}")
+    except BaseException:
+        encerrar_ffmpeg_stream(processo)
+        raise
+    return processo, erros, primeiro
+
+def encerrar_ffmpeg_stream(processo):
+    """True se o ffmpeg ainda rodava (cliente desconectou) e foi morto"""
+    ativo = processo.poll() is None
+    if ativo:
+        processo.kill()
+        processo.wait()
+    processo.stdout.close()
+    return ativo
+
+def recusa_estacionada(pendencia):
+    """Stream e prévia não seguram a thread da requisição dormindo entre tentativas: o cliente tenta de novo"""
+    espera = max(1, int(math.ceil(pendencia.espera)))
+    resposta = jsonify({'erro': 'Fonte temporariamente indisponível, tente novamente', 'retry_after': espera})
+    resposta.headers['Retry-After'] = str(espera)
+    return resposta, 503
+
+def chave_previa(url, inicio_segundos, fim_segundos):
+    descricao = json.dumps({
+        'video': extrair_video_id(url) or url,
+        'inicio': inicio_segundos,
+        'fim': fim_segundos,
+        'previa': ARGUMENTOS_PREVIA,
+        'fonte': FORMATO_FONTE,
+    }, sort_keys=True)
+    return hashlib.sha256(descricao.encode()).hexdigest()[:24]
+
+def comando_previa(arquivo_entrada, inicio_segundos, fim_segundos):
+    """Busca na entrada (só o trecho é decodificado) e MP3 mono de 48k no stdout"""
+    return [
+        'ffmpeg', '-ss', str(inicio_segundos), '-i', arquivo_entrada,
+        '-t', str(fim_segundos - inicio_segundos), '-vn',
+        *ARGUMENTOS_PREVIA,
+        '-hide_banner', '-loglevel', 'error',
+        '-f', 'mp3', 'pipe:1'
+    ]
+
+def calcular_picos(arquivo):
+    """Decodifica a fonte uma vez (PCM s16 mono no stdout do ffmpeg) e reduz em blocos.
+    Retorna a lista de níveis, cada um um array (n, 2) int16 de [min, max]."""
+    np = modulo('numpy')
+    comando = ['ffmpeg', '-v', 'error', '-i', arquivo, '-vn', '-ac', '1', '-ar', str(TAXA_PICOS),
+               '-f', 's16le', 'pipe:1']
+    processo = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    blocos = []
+    try:
+        while True:
+            # Múltiplo de AMOSTRAS_POR_PICO: cada bloco fecha picos inteiros (só o último fica parcial)
+            dados = processo.stdout.read(AMOSTRAS_POR_PICO * 4096 * 2)
+            if not dados:
+                break
+            amostras = np.frombuffer(dados[:len(dados) - len(dados) % 2], dtype=np.int16)
+            inicios = np.arange(0, len(amostras), AMOSTRAS_POR_PICO)
+            blocos.append(np.column_stack((np.minimum.reduceat(amostras, inicios),
+                                           np.maximum.reduceat(amostras, inicios))))
+        processo.wait()
+    finally:
+        if processo.poll() is None:
+            processo.kill()
+            processo.wait()
+    if processo.returncode != 0 or not blocos:
+        raise Exception("FFmpeg não conseguiu decodificar a fonte")
+    
+    niveis = [np.concatenate(blocos)]
+    while len(niveis[-1]) > MIN_PICOS_NIVEL * FATOR_ZOOM_PICOS:
+        anterior = niveis[-1]
+        inicios = np.arange(0, len(anterior), FATOR_ZOOM_PICOS)
+        niveis.append(np.column_stack((np.minimum.reduceat(anterior[:, 0], inicios),
+                                       np.maximum.reduceat(anterior[:, 1], inicios))))
+    return niveis
+
+def carregar_picos(video_id):
+    """Metadados dos picos já calculados (o .json é gravado por último), ou None"""
+    try:
+        with open(cache_fontes.caminho_anexo(video_id, FORMATO_FONTE, 'picos.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def salvar_picos(video_id, niveis):
+    np = modulo('numpy')
+    for nivel, picos in enumerate(niveis):
+        caminho = cache_fontes.caminho_anexo(video_id, FORMATO_FONTE, f'picos{nivel}.npy')
+        with open(caminho + '.tmp', 'wb') as f:
+            np.save(f, picos)
+        os.replace(caminho + '.tmp', caminho)
+    meta = {
+        'taxa': TAXA_PICOS,
+        'amostras_por_pico': [AMOSTRAS_POR_PICO * FATOR_ZOOM_PICOS ** nivel for nivel in range(len(niveis))],
+        'picos': [len(picos) for picos in niveis],
+        'duracao': round(len(niveis[0]) * AMOSTRAS_POR_PICO / TAXA_PICOS, 3)
+    }
+    caminho = cache_fontes.caminho_anexo(video_id, FORMATO_FONTE, 'picos.json')
+    with open(caminho + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(caminho + '.tmp', caminho)
+    return meta
+
+def obter_picos(url, video_id):
+    """Metadados dos picos do vídeo; calcula a partir da fonte completa (cache ou download) na 1ª vez"""
+    meta = carregar_picos(video_id)
+    if meta:
+        return meta
+    with cache_fontes.bloqueio_download(video_id, 'picos'):
+        meta = carregar_picos(video_id)
+        if meta:
+            return meta
+        id_processo = str(uuid.uuid4())[:8]
+        fonte = None
+        try:
+            arquivo_fonte, titulo, em_cache, estrategia, formato = obter_fonte_completa(url, id_processo, video_id)
+            fonte = {'arquivo': arquivo_fonte, 'video_id': video_id, 'em_cache': em_cache, 'formato': formato}
+            logger.info(f"〰️  Calculando picos da forma de onda: {video_id}")
+            inicio_etapa = time.time()
+            meta = salvar_picos(video_id, calcular_picos(arquivo_fonte))
+            metrica_picos.observe(time.time() - inicio_etapa)
+            return meta
+        finally:
+            liberar_fonte(fonte, id_processo)
+
+def janela_picos(video_id, meta, inicio_segundos, fim_segundos, pontos):
+    """Picos de [inicio, fim) com no máximo `pontos` pontos, lidos (mmap) do nível mais grosso que basta"""
+    np = modulo('numpy')
+    fim_segundos = min(fim_segundos, meta['duracao']) if fim_segundos else meta['duracao']
+    inicio_segundos = max(0.0, min(inicio_segundos, fim_segundos))
+    nivel = 0
+    for indice, amostras in enumerate(meta['amostras_por_pico']):
+        if (fim_segundos - inicio_segundos) * meta['taxa'] / amostras >= pontos:
+            nivel = indice
+    amostras = meta['amostras_por_pico'][nivel]
+    picos = np.load(cache_fontes.caminho_anexo(video_id, FORMATO_FONTE, f'picos{nivel}.npy'), mmap_mode='r')
+    
+    por_segundo = meta['taxa'] / amostras
+    janela = picos[int(inicio_segundos * por_segundo):math.ceil(fim_segundos * por_segundo)]
+    agrupamento = max(1, math.ceil(len(janela) / pontos))
+    if len(janela):
+        inicios = np.arange(0, len(janela), agrupamento)
+        minimos = np.minimum.reduceat(janela[:, 0], inicios)
+        maximos = np.maximum.reduceat(janela[:, 1], inicios)
+    else:
+        minimos = maximos = np.zeros(0, dtype=np.int16)
+    return {
+        'duracao': meta['duracao'],
+        'inicio': inicio_segundos,
+        'fim': fim_segundos,
+        'segundos_por_ponto': round(agrupamento / por_segundo, 4),
+        'min': np.round(minimos / 32768, 4).tolist(),
+        'max': np.round(maximos / 32768, 4).tolist()
+    }
+
+def etapa_download(url, inicio_segundos, fim_segundos, id_processo, modo_download=MODO_DOWNLOAD_PADRAO,
+                   tentativa=0, estacionar=False):
+    """Estágio 1 (rede): valida e obtém a fonte. Retorna o dict `fonte` usado pelo estágio de corte.
+    Na retomada de um job estacionado (tentativa > 0) vai direto ao download completo."""
+    video_id = extrair_video_id(url)
+    logger.info(f"🎬 INICIANDO PROCESSAMENTO ULTRA-RESISTENTE: {id_processo}")
+    logger.info(f"🔗 URL: {url}")
+    logger.info(f"⏰ Corte: {inicio_segundos}s a {fim_segundos}s")
+    
+    # Validações
+    if fim_segundos <= inicio_segundos:
+        raise Exception("Tempo final deve ser maior que o inicial")
+    
+    if fim_segundos - inicio_segundos > 3600:  # 1 hora máximo
+        raise Exception("Corte máximo de 1 hora")
+    
+    # 1. FONTE: CACHE, TRECHO DO CORTE OU DOWNLOAD COM ESTRATÉGIAS EXTREMAS
+    registro_jobs.atualizar(id_processo, etapa='download')
+    trecho = None
+    if modo_download == 'trecho' and tentativa == 0 and not (video_id and cache_fontes.contem(video_id, FORMATO_FONTE)):
+        trecho = baixar_trecho(url, id_processo, inicio_segundos, fim_segundos, estacionar)
+    
+    if trecho:
+        arquivo_fonte, titulo, deslocamento = trecho
+        return {'arquivo': arquivo_fonte, 'titulo': titulo, 'deslocamento': deslocamento,
+                'video_id': video_id, 'em_cache': False, 'estrategia': 'trecho', 'formato': None}
+    
+    arquivo_fonte, titulo, em_cache, estrategia, formato = obter_fonte_completa(url, id_processo, video_id,
+                                                                                tentativa, estacionar)
+    return {'arquivo': arquivo_fonte, 'titulo': titulo, 'deslocamento': 0,
+            'video_id': video_id, 'em_cache': em_cache, 'estrategia': estrategia, 'formato': formato}
+
+def arquivos_corte(fonte, id_processo, nome_arquivo, chave, extensao):
+    """(nome para o download, arquivo final endereçado pela chave, arquivo parcial deste job)"""
+    if nome_arquivo and nome_arquivo.strip():
+        nome_base = sanitizar_nome_arquivo(nome_arquivo)
+        nome_final = f"{nome_base}{extensao}"
+    else:
+        nome_base = sanitizar_nome_arquivo(fonte['titulo']) or f"audio_{id_processo}"
+        nome_final = f"{nome_base}{extensao}"
+    
+    arquivo_final = os.path.join(AUDIO_FILES_DIR, f"{chave}{extensao}")
+    arquivo_parcial = os.path.join(AUDIO_FILES_DIR, f"{chave}.{id_processo}.parcial{extensao}")
+    return nome_final, arquivo_final, arquivo_parcial
+
+def etapa_corte(fonte, inicio_segundos, fim_segundos, id_processo, nome_arquivo, chave,
+                formato_saida=FORMATO_SAIDA_PADRAO):
+    """Estágio 2 (CPU): corta a fonte e gera o arquivo final, endereçado pela chave do conteúdo"""
+    # 2. PREPARAR ARQUIVO FINAL (contêiner pelo codec de saída; nome amigável só para o download)
+    info = analisar_audio(fonte['arquivo'])
+    extensao = EXTENSAO_POR_CODEC[codec_saida(formato_saida, info)]
+    nome_final, arquivo_final, arquivo_parcial = arquivos_corte(fonte, id_processo, nome_arquivo, chave, extensao)
+    
+    # 3. CORTE PRECISO
+    logger.info("🔧 APLICANDO CORTE TEMPORAL...")
+    registro_jobs.atualizar(id_processo, etapa='corte')
+    deslocamento = fonte['deslocamento']
+    inicio_etapa = time.time()
+    try:
+        caminho_corte = cortar_audio_preciso(fonte['arquivo'], arquivo_parcial,
+                                             inicio_segundos - deslocamento, fim_segundos - deslocamento,
+                                             gancho_progresso_corte(id_processo, fim_segundos - inicio_segundos),
+                                             info)
+        metrica_corte.labels(caminho_corte).observe(time.time() - inicio_etapa)
+        os.replace(arquivo_parcial, arquivo_final)  # Nunca expor um arquivo pela metade
+    finally:
+        if os.path.exists(arquivo_parcial):
+            os.remove(arquivo_parcial)
+    
+    return resultado_corte(id_processo, nome_final, arquivo_final, inicio_segundos, fim_segundos, caminho_corte)
+
+def resultado_corte(id_processo, nome_final, arquivo_final, inicio_segundos, fim_segundos, caminho_corte):
+    # 4. VERIFICAÇÃO FINAL
+    if not os.path.exists(arquivo_final):
+        raise Exception("Arquivo final não foi criado")
+    
+    tamanho_final = os.path.getsize(arquivo_final) / (1024 * 1024)
+    duracao_corte = fim_segundos - inicio_segundos
+    
+    logger.info(f"🎉 SUCESSO TOTAL! Processamento {id_processo} concluído!")
+    logger.info(f"📁 Arquivo: {nome_final} ({caminho_corte})")
+    logger.info(f"📏 Tamanho: {tamanho_final:.2f} MB")
+    logger.info(f"⏱️  Duração: {duracao_corte}s")
+    
+    return {
+        'sucesso': True,
+        'arquivo': nome_final,
+        'caminho': arquivo_final,
+        'formato': os.path.splitext(arquivo_final)[1][1:],
+        'tamanho_mb': round(tamanho_final, 2),
+        'duracao_corte': duracao_corte,
+        'caminho_corte': caminho_corte
+    }
+
+def liberar_fonte(fonte, id_processo):
+    """LIMPEZA COMPLETA (a fonte em cache fica para os próximos cortes)"""
+    if fonte and fonte['em_cache']:
+        cache_fontes.liberar(fonte['video_id'], fonte['formato'])
+    elif fonte and os.path.exists(fonte['arquivo']):
+        try:
+            os.remove(fonte['arquivo'])
+            logger.info("🧹 Arquivo temporário removido")
+        except:
+            pass
+    
+    # Limpeza de todos os arquivos temporários
+    for arquivo in os.listdir(TEMP_DIR):
+        if f"temp_{id_processo}" in arquivo:
+            try:
+                os.remove(os.path.join(TEMP_DIR, arquivo))
+            except:
+                pass
+
+def etapa_corte_lote(fonte, url, clipes, id_processo, formato_saida=FORMATO_SAIDA_PADRAO):
+    """Estágio 2 do lote: corta só os clipes que ainda não existem em disco"""
+    pendentes, cortes = preparar_corte_lote(fonte, url, clipes, id_processo, formato_saida,
+                                            analisar_audio(fonte['arquivo']))
+    if pendentes:
+        try:
+            aplicar_corte_lote(pendentes, cortes, cortar_lote(fonte['arquivo'], cortes))
+        finally:
+            remover_parciais_lote(cortes)
+    return concluir_clipes(clipes)
+
+def preparar_corte_lote(fonte, url, clipes, id_processo, formato_saida, info):
+    """Marca os clipes já existentes e retorna (pendentes, cortes para o ffmpeg).
+    O contêiner dos clipes sai do codec de saída (info: analisar_audio da fonte)."""
+    registro_jobs.atualizar(id_processo, etapa='corte')
+    extensao = EXTENSAO_POR_CODEC[codec_saida(formato_saida, info)]
+    pendentes = []
+    cortes = []
+    for clipe in clipes:
+        chave = chave_corte(url, clipe['inicio'], clipe['fim'], formato_saida)
+        clipe['arquivo'] = f"{clipe['arquivo']}{extensao}"
+        clipe['caminho'] = os.path.join(AUDIO_FILES_DIR, f"{chave}{extensao}")
+        if os.path.exists(clipe['caminho']):
+            clipe['status'] = 'concluido'  # Mesmo conteúdo já gerado antes
         else:
-            nome_base = sanitizar_nome_arquivo(titulo) or f"audio_{id_processo}"
-            nome_final = f"{nome_base}.mp3"
-        
-        arquivo_final = os.path.join(AUDIO_FILES_DIR, nome_final)
-        
-        # 3. CORTE PRECISO
-        logger.info("🔧 APLICANDO CORTE TEMPORAL...")
-        cortar_audio_preciso(arquivo_temp, arquivo_final, inicio_segundos, fim_segundos)
-        
-        # 4. VERIFICAÇÃO FINAL
-        if not os.path.exists(arquivo_final):
-            raise Exception("Arquivo final não foi criado")
-        
-        tamanho_final = os.path.getsize(arquivo_final) / (1024 * 1024)
-        duracao_corte = fim_segundos - inicio_segundos
-        
-        logger.info(f"🎉 SUCESSO TOTAL! Processamento {id_processo} concluído!")
-        logger.info(f"📁 Arquivo: {nome_final}")
-        logger.info(f"📏 Tamanho: {tamanho_final:.2f} MB")
-        logger.info(f"⏱️  Duração: {duracao_corte}s")
-        
-        return {
-            'sucesso': True,
-            'arquivo': nome_final,
-            'tamanho_mb': round(tamanho_final, 2),
-            'duracao_corte': duracao_corte
-        }
-        
+            pendentes.append(clipe)
+            cortes.append((clipe['inicio'] - fonte['deslocamento'], clipe['fim'] - fonte['deslocamento'],
+                           os.path.join(AUDIO_FILES_DIR, f"{chave}.{id_processo}.parcial{extensao}")))
+    return pendentes, cortes
+
+def aplicar_corte_lote(pendentes, cortes, sucessos):
+    for clipe, sucesso, (_, _, parcial) in zip(pendentes, sucessos, cortes):
+        if sucesso:
+            os.replace(parcial, clipe['caminho'])
+            clipe['status'] = 'concluido'
+        else:
+            clipe['status'] = 'erro'
+            clipe['erro'] = 'FFmpeg não gerou o clipe'
+
+def remover_parciais_lote(cortes):
+    for _, _, parcial in cortes:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+
+def concluir_clipes(clipes):
+    for clipe in clipes:
+        if clipe['status'] == 'concluido':
+            clipe['tamanho_bytes'] = os.path.getsize(clipe['caminho'])
+    return clipes
+
+def publicar_clipes(clipes):
+    for clipe in clipes:
+        if clipe['status'] == 'concluido':
+            publicar_artefato(clipe['caminho'])
+
+def processar_audio_extremo(url, inicio_segundos, fim_segundos, id_processo, nome_arquivo=None,
+                            modo_download=MODO_DOWNLOAD_PADRAO, formato_saida=FORMATO_SAIDA_PADRAO):
+    """Processamento com todas as estratégias anti-bloqueio (os dois estágios em sequência)"""
+    fonte = None
+    chave = chave_corte(url, inicio_segundos, fim_segundos, formato_saida)
+    try:
+        fonte = etapa_download(url, inicio_segundos, fim_segundos, id_processo, modo_download)
+        return etapa_corte(fonte, inicio_segundos, fim_segundos, id_processo, nome_arquivo, chave, formato_saida)
     except Exception as e:
         logger.error(f"❌ FALHA NO PROCESSAMENTO {id_processo}: {e}")
         return {'sucesso': False, 'erro': str(e)}
     finally:
-        # LIMPEZA COMPLETA
-        if arquivo_temp and os.path.exists(arquivo_temp):
-            try:
-                os.remove(arquivo_temp)
-                logger.info("🧹 Arquivo temporário removido")
-            except:
-                pass
-        
-        # Limpeza de todos os arquivos temporários
-        for arquivo in os.listdir(TEMP_DIR):
-            if f"temp_{id_processo}" in arquivo:
+        liberar_fonte(fonte, id_processo)
+
+def ler_formato_saida(dados):
+    formato_saida = (dados.get('formato_saida') or FORMATO_SAIDA_PADRAO).strip().lower()
+    if formato_saida != 'original' and formato_saida not in CODEC_POR_FORMATO:
+        raise ValueError(f"formato_saida deve ser 'original' ou um de: {', '.join(CODEC_POR_FORMATO)}")
+    return formato_saida
+
+def ler_pedido_corte(dados):
+    """Campos de um pedido de corte; ValueError com a mensagem para o 400"""
+    dados = dados or {}
+    pedido = {
+        'url': dados.get('url', '').strip(),
+        'inicio': int(dados.get('inicio', 0)),
+        'fim': int(dados.get('fim', 30)),
+        'nome_arquivo': dados.get('nome_arquivo', '').strip(),
+        'modo_download': dados.get('modo_download', MODO_DOWNLOAD_PADRAO),
+        'formato_saida': ler_formato_saida(dados)
+    }
+    
+    if not pedido['url']:
+        raise ValueError('URL do YouTube é obrigatória')
+    
+    if pedido['modo_download'] not in ('trecho', 'completo'):
+        raise ValueError("modo_download deve ser 'trecho' ou 'completo'")
+    
+    if 'youtube.com' not in pedido['url'] and 'youtu.be' not in pedido['url']:
+        raise ValueError('URL do YouTube inválida')
+    
+    if pedido['fim'] <= pedido['inicio']:
+        raise ValueError('Tempo final deve ser maior que o inicial')
+    
+    return pedido
+
+def ler_pedido_lote(dados):
+    """(url, clipes, formato_saida) de um pedido de lote; ValueError com a mensagem para o 400"""
+    dados = dados or {}
+    url = dados.get('url', '').strip()
+    segmentos = dados.get('segmentos') or []
+    formato_saida = ler_formato_saida(dados)
+    
+    if not url:
+        raise ValueError('URL do YouTube é obrigatória')
+    
+    if 'youtube.com' not in url and 'youtu.be' not in url:
+        raise ValueError('URL do YouTube inválida')
+    
+    if not isinstance(segmentos, list) or not segmentos:
+        raise ValueError('Informe ao menos um segmento')
+    
+    if len(segmentos) > MAX_SEGMENTOS_LOTE:
+        raise ValueError(f'Máximo de {MAX_SEGMENTOS_LOTE} segmentos por lote')
+    
+    clipes = []
+    for indice, segmento in enumerate(segmentos):
+        inicio = int(segmento.get('inicio', 0))
+        fim = int(segmento.get('fim', 30))
+        if fim <= inicio:
+            raise ValueError(f'Segmento {indice}: tempo final deve ser maior que o inicial')
+        if fim - inicio > 3600:
+            raise ValueError(f'Segmento {indice}: corte máximo de 1 hora')
+        nome = sanitizar_nome_arquivo((segmento.get('nome_arquivo') or '').strip()) or f'clipe_{indice + 1}'
+        # A extensão entra no corte, quando o codec de saída é conhecido
+        clipes.append({'indice': indice, 'inicio': inicio, 'fim': fim,
+                       'arquivo': nome, 'status': 'pendente'})
+    return url, clipes, formato_saida
+
+def argumentos_corte(pedido, chave):
+    """Argumentos de um corte na fila durável (JSON, lidos pelo worker.py)"""
+    argumentos = {campo: pedido[campo] for campo in
+                  ('url', 'inicio', 'fim', 'nome_arquivo', 'modo_download', 'formato_saida')}
+    argumentos['chave'] = chave
+    return argumentos
+
+def argumentos_lote(url, clipes, formato_saida):
+    return {'url': url, 'clipes': clipes, 'formato_saida': formato_saida}
+
+def corte_em_andamento(chave, nome_arquivo):
+    """Chamar com lock_jobs_em_andamento. Resposta para um corte idêntico em andamento; None se não houver"""
+    id_existente = jobs_em_andamento.get(chave) or (fila_jobs.id_por_chave(chave) if MODO_EXECUCAO == 'fila' else None)
+    if id_existente:
+        # Id próprio para o pedido: conclui junto com o original, mas com o nome que este pedido escolheu
+        id_processo = str(uuid.uuid4())[:8]
+        registro_jobs.anexar(id_processo, id_existente, chave, nome_arquivo)
+        logger.info(f"🔗 Corte idêntico em andamento, {id_processo} anexado a {id_existente}")
+        return {
+            'sucesso': True,
+            'id_processo': id_processo,
+            'anexado_a': id_existente,
+            'mensagem': 'Corte idêntico já em processamento',
+            'reaproveitado': True
+        }
+    return None
+
+def corte_pronto(chave, nome_arquivo):
+    """Resposta para um corte idêntico já concluído (artefato devolvido na hora); None se não houver.
+    Consulta o armazém (rede, no S3): chamar fora do lock_jobs_em_andamento."""
+    anterior = registro_jobs.obter_por_chave(chave)
+    if anterior and artefato_disponivel(anterior['caminho']):
+        id_processo = str(uuid.uuid4())[:8]
+        local = caminho_local(anterior['caminho'])
+        if os.path.exists(local):
+            os.utime(local, (time.time(), os.path.getmtime(local)))  # Conta como acesso
+        extensao = os.path.splitext(anterior['caminho'])[1]
+        nome_final = f"{sanitizar_nome_arquivo(nome_arquivo)}{extensao}" if nome_arquivo else anterior['arquivo']
+        registro_jobs.criar(id_processo, etapa='finalizado', chave=chave)
+        registro_jobs.concluir(id_processo, nome_final, local, anterior['caminho_corte'],
+                               tamanho_bytes=anterior['tamanho_bytes'])
+        logger.info(f"⚡ Corte idêntico já existe, reaproveitando {anterior['id_processo']}")
+        return {
+            'sucesso': True,
+            'id_processo': id_processo,
+            'status': 'concluido',
+            'mensagem': 'Corte idêntico já processado',
+            'reaproveitado': True,
+            'download_url': f'/api/download/{id_processo}'
+        }
+    return None
+
+class Aquecimento:
+    """Importa os módulos pesados e carrega os extratores do yt-dlp numa thread, para o primeiro job
+    não pagar por isso. Disparado depois que o servidor já atende (primeira requisição ou before_serving)."""
+
+    def __init__(self):
+        self.thread = None
+        self.lock = threading.Lock()
+        self.concluido_em = None
+        self.erro = None
+
+    def iniciar(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, name='aquecimento', daemon=True)
+                self.thread.start()
+
+    def _executar(self):
+        inicio = time.perf_counter()
+        try:
+            for nome in MODULOS_SOB_DEMANDA:
                 try:
-                    os.remove(os.path.join(TEMP_DIR, arquivo))
-                except:
-                    pass
+                    modulo(nome)
+                except DependenciaAusente as e:
+                    logger.info(f"ℹ️  {e}")
+            # Registra os extratores e deixa prontas as instâncias dos perfis usados primeiro
+            pool_youtubedl.preparar(perfil_youtubedl('trecho'))
+            pool_youtubedl.preparar(perfil_youtubedl('estrategia', 0))
+            sessao_http()
+        except Exception as e:
+            self.erro = str(e)
+            logger.warning(f"⚠️  Aquecimento incompleto: {e}")
+        duracao = round((time.perf_counter() - inicio) * 1000, 1)
+        with lock_inicializacao:
+            tempos_inicializacao['aquecimento'] = duracao
+        self.concluido_em = time.time()
+        logger.info(f"🔥 Aquecimento concluído em {duracao:.0f}ms")
+
+    def estado(self):
+        if self.thread is None:
+            return 'desligado' if not AQUECIMENTO else 'pendente'
+        return 'concluido' if self.concluido_em else 'em_andamento'
+
+aquecimento = Aquecimento()
+
+@app.before_request
+def aquecer_apos_primeira_requisicao():
+    if AQUECIMENTO:
+        aquecimento.iniciar()
+
+def relatorio_inicializacao():
+    with lock_inicializacao:
+        tempos = dict(tempos_inicializacao)
+    return {
+        'python': sys.version.split()[0],
+        'etapas_ms': tempos,
+        'pronto_ms': tempos.get('pronto'),
+        'aquecimento': aquecimento.estado(),
+        'modulos_carregados': {nome: nome in sys.modules for nome in MODULOS_SOB_DEMANDA}
+    }
 
 # ROTAS DA API
 @app.route('/')
@@ -385,38 +2751,57 @@ def home():
 @app.route('/api/processar', methods=['POST'])
 def processar_audio():
     try:
-        dados = request.get_json()
-        url = dados.get('url', '').strip()
-        inicio = int(dados.get('inicio', 0))
-        fim = int(dados.get('fim', 30))
-        nome_arquivo = dados.get('nome_arquivo', '').strip()
-        
-        if not url:
-            return jsonify({'erro': 'URL do YouTube é obrigatória'}), 400
-        
-        if 'youtube.com' not in url and 'youtu.be' not in url:
-            return jsonify({'erro': 'URL do YouTube inválida'}), 400
-        
-        if fim <= inicio:
-            return jsonify({'erro': 'Tempo final deve ser maior que o inicial'}), 400
-        
-        id_processo = str(uuid.uuid4())[:8]
+        try:
+            pedido = ler_pedido_corte(request.get_json())
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
+        url, inicio, fim = pedido['url'], pedido['inicio'], pedido['fim']
+        nome_arquivo, modo_download = pedido['nome_arquivo'], pedido['modo_download']
+        formato_saida = pedido['formato_saida']
         
-        logger.info(f"📋 NOVO PROCESSO ULTRA-RESISTENTE: {id_processo}")
+        chave = chave_corte(url, inicio, fim, formato_saida)
+        reaproveitado = corte_pronto(chave, nome_arquivo)
+        if reaproveitado:
+            return jsonify(reaproveitado)
+        with lock_jobs_em_andamento:
+            reaproveitado = corte_em_andamento(chave, nome_arquivo)
+            if reaproveitado:
+                return jsonify(reaproveitado)
+            
+            recusa = recusar_se_circuito_aberto(url)
+            if recusa:
+                return recusa
+            
+            id_processo = str(uuid.uuid4())[:8]
+            registro_jobs.criar(id_processo, etapa='na_fila', chave=chave)
+            try:
+                if MODO_EXECUCAO == 'fila':
+                    posicao = fila_jobs.enfileirar(id_processo, 'corte', argumentos_corte(pedido, chave), chave)
+                else:
+                    posicao = pool_download.submeter(
+                        id_processo, executar_processamento_extremo,
+                        url, inicio, fim, id_processo, nome_arquivo, modo_download, formato_saida, chave
+                    )
+            except FilaCheia as e:
+                registro_jobs.remover(id_processo)
+                logger.warning(f"🚦 Fila cheia, recusando processo (retry em {e.retry_after}s)")
+                resposta = jsonify({'erro': 'Servidor ocupado, tente novamente mais tarde', 'retry_after': e.retry_after})
+                resposta.headers['Retry-After'] = str(e.retry_after)
+                return resposta, 429
+            if MODO_EXECUCAO != 'fila':
+                jobs_em_andamento[chave] = id_processo  # Na fila durável a duplicata é achada pela chave
         
-        thread = threading.Thread(
-            target=executar_processamento_extremo,
-            args=(url, inicio, fim, id_processo, nome_arquivo)
-        )
-        thread.daemon = True
-        thread.start()
+        logger.info(f"📋 NOVO PROCESSO ULTRA-RESISTENTE: {id_processo} (posição {posicao} na fila)")
         
         return jsonify({
             'sucesso': True,
             'id_processo': id_processo,
-            'mensagem': 'Processamento iniciado com sistema anti-bloqueio',
+            'mensagem': 'Processamento enfileirado com sistema anti-bloqueio',
+            'posicao_fila': posicao,
             'detalhes': {
                 'estrategias': 6,
+                'modo_download': modo_download,
+                'formato_saida': formato_saida,
                 'inicio_segundos': inicio,
                 'fim_segundos': fim,
                 'duracao_corte': fim - inicio
@@ -427,64 +2812,618 @@ def processar_audio():
         logger.error(f"💥 Erro em /api/processar: {e}")
         return jsonify({'erro': str(e)}), 500
 
-def executar_processamento_extremo(url, inicio, fim, id_processo, nome_arquivo):
-    """Wrapper para execução em thread"""
+def executar_processamento_extremo(url, inicio, fim, id_processo, nome_arquivo, modo_download, formato_saida,
+                                   chave, tentativa=0):
+    """Estágio 1 no pool de download; ao terminar, entrega a fonte ao pool de corte.
+    Entre tentativas o job fica estacionado no agendador, sem ocupar o worker."""
+    fonte = None
     try:
-        resultado = processar_audio_extremo(url, inicio, fim, id_processo, nome_arquivo)
-        if resultado['sucesso']:
-            logger.info(f"🎉 {id_processo} - SUCESSO COMPLETO!")
-        else:
-            logger.error(f"❌ {id_processo} - FALHA: {resultado['erro']}")
+        registro_jobs.atualizar(id_processo, etapa='iniciando')
+        fonte = etapa_download(url, inicio, fim, id_processo, modo_download, tentativa, estacionar=True)
+        registro_jobs.atualizar(id_processo, etapa='aguardando_corte')
+        # Bloqueia se a fila de corte estiver cheia: segura novos downloads sem recusar o job
+        pool_corte.submeter(id_processo, executar_corte_extremo,
+                            fonte, inicio, fim, id_processo, nome_arquivo, chave, formato_saida, bloquear=True)
+    except EstacionarJob as e:
+        liberar_fonte(fonte, id_processo)
+        estacionar_job(id_processo, e, executar_processamento_extremo,
+                       url, inicio, fim, id_processo, nome_arquivo, modo_download, formato_saida, chave, e.tentativa)
     except Exception as e:
-        logger.error(f"💥 {id_processo} - ERRO CRÍTICO: {e}")
+        liberar_fonte(fonte, id_processo)
+        registro_jobs.falhar(id_processo, str(e))
+        finalizar_job_em_andamento(chave)
+        registrar_falha('download', e)
+        logger.error(f"❌ {id_processo} - FALHA: {e}")
 
-@app.route('/api/status/<id_processo>')
-def verificar_status(id_processo):
+def observar_total(id_processo, fonte, caminho_corte):
+    """Tempo ponta a ponta do job (desde a criação no registro, incluindo a fila)"""
+    job = registro_jobs.obter(id_processo)
+    if job:
+        metrica_total.labels(fonte['estrategia'], caminho_corte).observe(time.time() - job['criado_em'])
+
+def executar_corte_extremo(fonte, inicio, fim, id_processo, nome_arquivo, chave, formato_saida):
+    """Estágio 2 no pool de corte (um ffmpeg por núcleo)"""
+    try:
+        resultado = etapa_corte(fonte, inicio, fim, id_processo, nome_arquivo, chave, formato_saida)
+        publicar_artefato(resultado['caminho'])
+        registro_jobs.concluir(id_processo, resultado['arquivo'], resultado['caminho'], resultado['caminho_corte'])
+        observar_total(id_processo, fonte, resultado['caminho_corte'])
+        logger.info(f"🎉 {id_processo} - SUCESSO COMPLETO!")
+    except Exception as e:
+        registro_jobs.falhar(id_processo, str(e))
+        registrar_falha('corte', e)
+        logger.error(f"💥 {id_processo} - FALHA NO CORTE: {e}")
+    finally:
+        finalizar_job_em_andamento(chave)
+        liberar_fonte(fonte, id_processo)
+
+@app.route('/api/processar/lote', methods=['POST'])
+def processar_lote():
+    """Vários cortes de um vídeo: um download, uma passada do ffmpeg, um job com status por clipe"""
     try:
-        for arquivo in os.listdir(AUDIO_FILES_DIR):
-            if id_processo in arquivo and arquivo.endswith('.mp3'):
-                caminho = os.path.join(AUDIO_FILES_DIR, arquivo)
-                tamanho = os.path.getsize(caminho) / (1024 * 1024)
-                return jsonify({
-                    'sucesso': True,
-                    'status': 'concluido',
-                    'arquivo': arquivo,
-                    'tamanho_mb': round(tamanho, 2),
-                    'download_url': f'/api/download/{id_processo}'
-                })
+        try:
+            url, clipes, formato_saida = ler_pedido_lote(request.get_json())
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
         
-        for arquivo in os.listdir(TEMP_DIR):
-            if f"temp_{id_processo}" in arquivo:
-                return jsonify({
-                    'sucesso': True,
-                    'status': 'processando',
-                    'mensagem': 'Sistema anti-bloqueio em ação...'
-                })
+        recusa = recusar_se_circuito_aberto(url)
+        if recusa:
+            return recusa
+        
+        id_processo = str(uuid.uuid4())[:8]
+        registro_jobs.criar(id_processo, etapa='na_fila')
+        registro_jobs.atualizar(id_processo, clipes=json.dumps(clipes))
+        
+        try:
+            if MODO_EXECUCAO == 'fila':
+                posicao = fila_jobs.enfileirar(id_processo, 'lote', argumentos_lote(url, clipes, formato_saida))
+            else:
+                posicao = pool_download.submeter(id_processo, executar_lote, url, clipes, id_processo, formato_saida)
+        except FilaCheia as e:
+            registro_jobs.remover(id_processo)
+            resposta = jsonify({'erro': 'Servidor ocupado, tente novamente mais tarde', 'retry_after': e.retry_after})
+            resposta.headers['Retry-After'] = str(e.retry_after)
+            return resposta, 429
+        
+        logger.info(f"📋 NOVO LOTE: {id_processo} ({len(clipes)} clipes, posição {posicao} na fila)")
         
         return jsonify({
             'sucesso': True,
-            'status': 'processando', 
-            'mensagem': 'Iniciando processamento ultra-resistente...'
+            'id_processo': id_processo,
+            'mensagem': 'Lote enfileirado',
+            'posicao_fila': posicao,
+            'clipes': len(clipes)
         })
         
+    except Exception as e:
+        logger.error(f"💥 Erro em /api/processar/lote: {e}")
+        return jsonify({'erro': str(e)}), 500
+
+def executar_lote(url, clipes, id_processo, formato_saida, tentativa=0):
+    """Estágio 1 do lote: baixa a faixa inteira uma vez (via cache de fontes) e passa ao pool de corte"""
+    fonte = None
+    try:
+        registro_jobs.atualizar(id_processo, etapa='download')
+        fonte = etapa_download_lote(url, id_processo, tentativa)
+        registro_jobs.atualizar(id_processo, etapa='aguardando_corte')
+        pool_corte.submeter(id_processo, executar_corte_lote, fonte, url, clipes, id_processo, formato_saida,
+                            bloquear=True)
+    except EstacionarJob as e:
+        liberar_fonte(fonte, id_processo)
+        estacionar_job(id_processo, e, executar_lote, url, clipes, id_processo, formato_saida, e.tentativa)
+    except Exception as e:
+        liberar_fonte(fonte, id_processo)
+        registro_jobs.falhar(id_processo, str(e))
+        registrar_falha('download', e)
+        logger.error(f"❌ {id_processo} - FALHA NO LOTE: {e}")
+
+def etapa_download_lote(url, id_processo, tentativa=0):
+    """Estágio 1 do lote: a faixa inteira (via cache de fontes); EstacionarJob entre tentativas"""
+    video_id = extrair_video_id(url)
+    arquivo_fonte, titulo, em_cache, estrategia, formato = obter_fonte_completa(url, id_processo, video_id,
+                                                                                tentativa, estacionar=True)
+    return {'arquivo': arquivo_fonte, 'titulo': titulo, 'deslocamento': 0,
+            'video_id': video_id, 'em_cache': em_cache, 'estrategia': estrategia, 'formato': formato}
+
+def executar_corte_lote(fonte, url, clipes, id_processo, formato_saida):
+    try:
+        clipes = etapa_corte_lote(fonte, url, clipes, id_processo, formato_saida)
+        if any(clipe['status'] == 'concluido' for clipe in clipes):
+            publicar_clipes(clipes)
+            registro_jobs.concluir_lote(id_processo, clipes)
+            observar_total(id_processo, fonte, 'lote')
+            logger.info(f"🎉 {id_processo} - LOTE CONCLUÍDO!")
+        else:
+            registro_jobs.atualizar(id_processo, clipes=json.dumps(clipes))
+            registro_jobs.falhar(id_processo, 'Nenhum clipe do lote foi gerado')
+    except Exception as e:
+        registro_jobs.falhar(id_processo, str(e))
+        registrar_falha('corte', e)
+        logger.error(f"💥 {id_processo} - FALHA NO CORTE DO LOTE: {e}")
+    finally:
+        liberar_fonte(fonte, id_processo)
+
+@app.route('/api/processar/stream', methods=['POST'])
+def processar_stream():
+    """Corte síncrono: o áudio sai do ffmpeg direto para o cliente enquanto é codificado"""
+    try:
+        pedido = ler_pedido_corte(request.get_json())
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    url, inicio, fim = pedido['url'], pedido['inicio'], pedido['fim']
+    nome_arquivo, modo_download = pedido['nome_arquivo'], pedido['modo_download']
+    
+    if fim - inicio > MAX_DURACAO_STREAM:
+        return jsonify({'erro': f'Streaming limitado a cortes de {MAX_DURACAO_STREAM}s; use /api/processar'}), 400
+    
+    recusa = recusar_se_circuito_aberto(url)
+    if recusa:
+        return recusa
+    
+    if not semaforo_streams.acquire(blocking=False):
+        resposta = jsonify({'erro': 'Muitos streams simultâneos, tente novamente'})
+        resposta.headers['Retry-After'] = '5'
+        return resposta, 429
+    
+    id_processo = str(uuid.uuid4())[:8]
+    fonte = None
+    try:
+        logger.info(f"📡 NOVO STREAM: {id_processo}")
+        fonte = etapa_download(url, inicio, fim, id_processo, modo_download, estacionar=True)
+        codec = codec_saida(pedido['formato_saida'],
+                            analisar_audio(fonte['arquivo']) if pedido['formato_saida'] == 'original' else None)
+        processo, erros, primeiro = iniciar_corte_stream(fonte['arquivo'], inicio - fonte['deslocamento'],
+                                                         fim - fonte['deslocamento'], codec)
+    except CircuitoAberto as e:
+        semaforo_streams.release()
+        resposta = jsonify({'erro': str(e), 'retry_after': e.retry_after})
+        resposta.headers['Retry-After'] = str(e.retry_after)
+        return resposta, 503
+    except EstacionarJob as e:
+        liberar_fonte(None, id_processo)
+        semaforo_streams.release()
+        logger.info(f"🅿️  {id_processo} - stream recusado, fonte de novo em {e.espera:.0f}s")
+        return recusa_estacionada(e)
+    except Exception as e:
+        liberar_fonte(fonte, id_processo)
+        semaforo_streams.release()
+        registrar_falha('stream', e)
+        logger.error(f"❌ {id_processo} - FALHA NO STREAM: {e}")
+        return jsonify({'erro': str(e)}), 500
+    zelador_disco.marcar_uso(fonte['arquivo'])
+    
+    def gerar():
+        bloco = primeiro
+        while bloco:
+            metrica_bytes_entregues.labels('stream').inc(len(bloco))
+            yield bloco
+            bloco = processo.stdout.read(TAMANHO_BLOCO_STREAM)
+        if processo.wait() == 0:
+            logger.info(f"🎉 {id_processo} - STREAM CONCLUÍDO")
+        else:
+            # Os cabeçalhos já saíram com 200: o cliente recebe um arquivo truncado, o log diz por quê
+            erro = erros()
+            registrar_falha('stream', Exception(erro))
+            logger.error(f"❌ {id_processo} - ffmpeg terminou com código {processo.returncode} "
+                         f"no meio do stream: {erro[-300:]}")
+    
+    def liberar():
+        # Roda no fechamento da resposta, mesmo se o cliente cair antes do primeiro bloco (o gerador nem começa)
+        if encerrar_ffmpeg_stream(processo):
+            logger.info(f"🔌 {id_processo} - Cliente desconectou, ffmpeg encerrado")
+        zelador_disco.liberar_uso(fonte['arquivo'])
+        liberar_fonte(fonte, id_processo)
+        semaforo_streams.release()
+    
+    nome_base = sanitizar_nome_arquivo(nome_arquivo) or sanitizar_nome_arquivo(fonte['titulo']) or f"audio_{id_processo}"
+    extensao = EXTENSAO_POR_CODEC[codec]
+    resposta = Response(gerar(), mimetype=MIMETYPE_POR_EXTENSAO[extensao], headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(nome_base)}{extensao}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    resposta.call_on_close(liberar)
+    return resposta
+
+@app.route('/api/previa')
+def previa_corte():
+    """Prévia rápida do intervalo (GET, para usar direto como src de um <audio>), em cache por vídeo + intervalo.
+    Roda na própria requisição com o seu limite, sem ocupar os pools de download e corte."""
+    try:
+        pedido = ler_pedido_corte(request.args)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    url, inicio, fim = pedido['url'], pedido['inicio'], pedido['fim']
+    
+    if fim - inicio > MAX_DURACAO_PREVIA:
+        return jsonify({'erro': f'Prévia limitada a {MAX_DURACAO_PREVIA}s'}), 400
+    
+    chave = chave_previa(url, inicio, fim)
+    caminho = os.path.join(PREVIAS_DIR, f"{chave}.mp3")
+    nome = f"previa_{extrair_video_id(url) or chave}_{inicio}_{fim}.mp3"
+    if os.path.exists(caminho):
+        return enviar_artefato(caminho, nome, anexo=False, rota='previa')
+    
+    recusa = recusar_se_circuito_aberto(url)
+    if recusa:
+        return recusa
+    
+    if not semaforo_previas.acquire(blocking=False):
+        resposta = jsonify({'erro': 'Muitas prévias simultâneas, tente novamente'})
+        resposta.headers['Retry-After'] = '2'
+        return resposta, 429
+    
+    id_processo = str(uuid.uuid4())[:8]
+    fonte = None
+    try:
+        # Fonte em cache, ou só o trecho (download parcial)
+        fonte = etapa_download(url, inicio, fim, id_processo, 'trecho', estacionar=True)
+        processo, erros, primeiro = abrir_ffmpeg_stream(
+            comando_previa(fonte['arquivo'], inicio - fonte['deslocamento'], fim - fonte['deslocamento'])
+        )
+    except CircuitoAberto as e:
+        semaforo_previas.release()
+        resposta = jsonify({'erro': str(e), 'retry_after': e.retry_after})
+        resposta.headers['Retry-After'] = str(e.retry_after)
+        return resposta, 503
+    except EstacionarJob as e:
+        liberar_fonte(None, id_processo)
+        semaforo_previas.release()
+        return recusa_estacionada(e)
+    except Exception as e:
+        liberar_fonte(fonte, id_processo)
+        semaforo_previas.release()
+        registrar_falha('previa', e)
+        logger.error(f"❌ {id_processo} - FALHA NA PRÉVIA: {e}")
+        return jsonify({'erro': str(e)}), 500
+    
+    def gerar():
+        # Enquanto envia, grava a prévia; só vira cache se o ffmpeg terminou bem
+        parcial = os.path.join(PREVIAS_DIR, f"{chave}.{id_processo}.parcial.mp3")
+        try:
+            with open(parcial, 'wb') as arquivo:
+                bloco = primeiro
+                while bloco:
+                    arquivo.write(bloco)
+                    metrica_bytes_entregues.labels('previa').inc(len(bloco))
+                    yield bloco
+                    bloco = processo.stdout.read(TAMANHO_BLOCO_STREAM)
+            if processo.wait() == 0:
+                os.replace(parcial, caminho)
+            else:
+                erro = erros()
+                registrar_falha('previa', Exception(erro))
+                logger.error(f"❌ {id_processo} - ffmpeg da prévia terminou com código {processo.returncode}: "
+                             f"{erro[-300:]}")
+        finally:
+            if os.path.exists(parcial):
+                os.remove(parcial)
+    
+    def liberar():
+        encerrar_ffmpeg_stream(processo)
+        liberar_fonte(fonte, id_processo)
+        semaforo_previas.release()
+    
+    resposta = Response(gerar(), mimetype='audio/mpeg', headers={
+        'Content-Disposition': f"inline; filename*=UTF-8''{quote(nome)}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+    resposta.call_on_close(liberar)
+    return resposta
+
+def ler_pedido_picos(parametros):
+    """(url, video_id, inicio, fim, pontos) de um pedido de forma de onda; ValueError para o 400"""
+    url = (parametros.get('url') or '').strip()
+    video_id = extrair_video_id(url)
+    if not url or not video_id:
+        raise ValueError('URL do YouTube inválida')
+    inicio = float(parametros.get('inicio') or 0)
+    fim = float(parametros.get('fim') or 0)
+    pontos = int(parametros.get('pontos') or 1000)
+    if fim and fim <= inicio:
+        raise ValueError('Tempo final deve ser maior que o inicial')
+    if not 1 <= pontos <= MAX_PONTOS_PICOS:
+        raise ValueError(f'pontos deve estar entre 1 e {MAX_PONTOS_PICOS}')
+    return url, video_id, inicio, fim, pontos
+
+@app.route('/api/picos')
+def forma_de_onda():
+    """Picos min/max (-1..1) da forma de onda para escolher inicio/fim. fim=0: até o final"""
+    try:
+        url, video_id, inicio, fim, pontos = ler_pedido_picos(request.args)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    
+    try:
+        meta = carregar_picos(video_id)
+        if not meta:
+            recusa = recusar_se_circuito_aberto(url)
+            if recusa:
+                return recusa
+            if not semaforo_picos.acquire(blocking=False):
+                resposta = jsonify({'erro': 'Muitas formas de onda em cálculo, tente novamente'})
+                resposta.headers['Retry-After'] = '5'
+                return resposta, 429
+            try:
+                meta = obter_picos(url, video_id)
+            finally:
+                semaforo_picos.release()
+        return jsonify(dict(janela_picos(video_id, meta, inicio, fim, pontos), sucesso=True, video_id=video_id))
+    except CircuitoAberto as e:
+        resposta = jsonify({'erro': str(e), 'retry_after': e.retry_after})
+        resposta.headers['Retry-After'] = str(e.retry_after)
+        return resposta, 503
+    except DependenciaAusente as e:
+        return jsonify({'erro': str(e)}), 501
+    except Exception as e:
+        registrar_falha('picos', e)
+        logger.error(f"❌ Falha na forma de onda de {video_id}: {e}")
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/api/fila')
+def estatisticas_fila():
+    estatisticas = {
+        'sucesso': True,
+        'modo_execucao': MODO_EXECUCAO,
+        'fila': pool_download.estatisticas(),
+        'corte': pool_corte.estatisticas(),
+        'retentativas': agendador_retentativas.estatisticas(),
+        'limitador': limitador_hosts.estatisticas(),
+        'disjuntor': disjuntor_upstream.estatisticas(),
+        'zelador': zelador_disco.estatisticas(),
+        'youtubedl': pool_youtubedl.estatisticas()
+    }
+    if MODO_EXECUCAO == 'fila':
+        estatisticas['fila_duravel'] = fila_jobs.estatisticas()
+    return jsonify(estatisticas)
+
+@app.route('/api/limpar', methods=['POST'])
+def limpar_arquivos():
+    """Passada imediata do zelador (respeita jobs ativos e downloads abertos)"""
+    try:
+        relatorio = zelador_disco.limpar()
+        return jsonify({
+            'sucesso': True,
+            'recuperado_bytes': sum(item['recuperado_bytes'] for item in relatorio.values()),
+            'diretorios': relatorio
+        })
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/metrics')
+def metricas():
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/api/inicializacao')
+def inicializacao():
+    return jsonify(dict(relatorio_inicializacao(), sucesso=True))
+
+@app.route('/api/cache')
+def estatisticas_cache():
+    return jsonify({'sucesso': True, 'cache_fontes': cache_fontes.estatisticas(),
+                    'armazem': espelho_estado.estatisticas()})
+
+MENSAGENS_ETAPA = {
+    'na_fila': 'Aguardando worker livre...',
+    'iniciando': 'Iniciando processamento ultra-resistente...',
+    'download': 'Sistema anti-bloqueio em ação...',
+    'aguardando_corte': 'Download concluído, aguardando corte...',
+    'aguardando_retentativa': 'Upstream recusou, nova tentativa agendada...',
+    'anexado': 'Corte idêntico em processamento, aguardando...',
+    'corte': 'Aplicando corte temporal...',
+}
+
+def descrever_lote(job):
+    """Status de um job de lote, com a situação de cada clipe"""
+    clipes = []
+    for clipe in json.loads(job['clipes']):
+        descricao = {'indice': clipe['indice'], 'inicio': clipe['inicio'], 'fim': clipe['fim'],
+                     'arquivo': clipe['arquivo'], 'status': clipe['status']}
+        if clipe['status'] == 'concluido':
+            descricao['tamanho_mb'] = round(clipe['tamanho_bytes'] / (1024 * 1024), 2)
+            descricao['download_url'] = f"/api/download/{job['id_processo']}/{clipe['indice']}"
+        elif clipe.get('erro'):
+            descricao['erro'] = clipe['erro']
+        clipes.append(descricao)
+    
+    if job['estado'] == 'processando':
+        status = 'na_fila' if job['etapa'] == 'na_fila' else 'processando'
+    else:
+        status = job['estado']
+    
+    descricao = {'sucesso': job['estado'] != 'erro', 'status': status, 'etapa': job['etapa'], 'clipes': clipes}
+    if job['erro']:
+        descricao['erro'] = job['erro']
+    return descricao
+
+def descrever_job(job):
+    """Resposta de status de um job (usada por /api/status e pelo evento final do SSE)"""
+    id_processo = job['id_processo']
+    
+    if job['clipes']:
+        return descrever_lote(job)
+    
+    if job['estado'] == 'concluido':
+        if not artefato_disponivel(job['caminho']):
+            return {'sucesso': False, 'status': 'removido', 'erro': 'Arquivo não está mais disponível'}
+        return {
+            'sucesso': True,
+            'status': 'concluido',
+            'arquivo': job['arquivo'],
+            'formato': os.path.splitext(job['caminho'])[1][1:],
+            'caminho_corte': job['caminho_corte'],
+            'tamanho_mb': round(job['tamanho_bytes'] / (1024 * 1024), 2),
+            'download_url': f'/api/download/{id_processo}'
+        }
+    
+    if job['estado'] == 'erro':
+        return {'sucesso': False, 'status': 'erro', 'erro': job['erro']}
+    
+    if job['etapa'] == 'na_fila':
+        return {
+            'sucesso': True,
+            'status': 'na_fila',
+            'posicao_fila': posicao_na_fila(id_processo),
+            'mensagem': MENSAGENS_ETAPA['na_fila']
+        }
+    
+    return {
+        'sucesso': True,
+        'status': 'processando',
+        'etapa': job['etapa'],
+        'mensagem': MENSAGENS_ETAPA.get(job['etapa'], 'Processando...')
+    }
+
+@app.route('/api/status/<id_processo>')
+def verificar_status(id_processo):
+    try:
+        job = registro_jobs.obter(id_processo)
+        if not job:
+            return jsonify({'erro': 'Processo não encontrado'}), 404
+        return jsonify(descrever_job(job))
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
+def evento_sse(nome, dados):
+    return f"event: {nome}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+def evento_final_sse(id_processo, estado):
+    """Evento concluido/erro quando o job terminou, senão None.
+    O resultado final vem sempre do registro (vale também para jobs de antes de um reinício)."""
+    if estado and estado.get('estado') not in ('concluido', 'erro'):
+        return None
+    job = registro_jobs.obter(id_processo)
+    if not job:
+        # Job expirado/removido do registro no meio do acompanhamento
+        return evento_sse('erro', {'sucesso': False, 'status': 'erro', 'erro': 'Processo não encontrado'})
+    if job['estado'] not in ('concluido', 'erro'):
+        return None
+    return evento_sse('concluido' if job['estado'] == 'concluido' else 'erro', descrever_job(job))
+
+@app.route('/api/progresso/<id_processo>')
+def progresso_sse(id_processo):
+    """Server-Sent Events: etapa, bytes/velocidade do download e tempo codificado do corte, até o resultado"""
+    job = registro_jobs.obter(id_processo)
+    if not job:
+        return jsonify({'erro': 'Processo não encontrado'}), 404
+    if MODO_EXECUCAO == 'fila':
+        acompanhamento_registro.iniciar()
+    
+    def gerar():
+        versao = 0
+        ultimo_envio = time.time()
+        while True:
+            estado = progresso_jobs.aguardar(id_processo, versao, timeout=INTERVALO_HEARTBEAT_SSE)
+            if estado and estado['versao'] > versao:
+                versao = estado['versao']
+                yield evento_sse('progresso', {k: v for k, v in estado.items() if k != 'versao'})
+                ultimo_envio = time.time()
+            
+            final = evento_final_sse(id_processo, estado)
+            if final:
+                yield final
+                return
+            
+            if time.time() - ultimo_envio >= INTERVALO_HEARTBEAT_SSE:
+                yield ": heartbeat\n\n"
+                ultimo_envio = time.time()
+    
+    return Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def enviar_artefato(caminho, nome_download, anexo=True, rota='download'):
+    """Envia um artefato imutável com ETag forte, Last-Modified, Range/206 e cache longo.
+    Nos modos x-accel/x-sendfile os bytes são servidos pelo servidor web na frente do Flask.
+    O arquivo fica protegido do zelador de disco até a resposta terminar.
+    anexo=False serve inline (prévias tocadas direto num <audio>)."""
+    etag = os.path.splitext(os.path.basename(caminho))[0]  # Nome do arquivo = chave do conteúdo
+    zelador_disco.marcar_uso(caminho)
+    
+    if MODO_ENVIO_ARQUIVOS == 'x-accel':
+        relativo = os.path.relpath(caminho, AUDIO_FILES_DIR).replace(os.sep, '/')
+        resposta = Response(status=200, mimetype=mimetype_artefato(caminho))
+        resposta.headers['X-Accel-Redirect'] = PREFIXO_X_ACCEL + quote(relativo)
+        disposicao = 'attachment' if anexo else 'inline'
+        resposta.headers['Content-Disposition'] = f"{disposicao}; filename*=UTF-8''{quote(nome_download)}"
+        resposta.set_etag(etag)
+        resposta.last_modified = os.path.getmtime(caminho)
+    else:
+        resposta = send_file(
+            caminho,
+            mimetype=mimetype_artefato(caminho),
+            as_attachment=anexo,
+            download_name=nome_download,
+            conditional=True,
+            etag=etag,
+            max_age=CACHE_ARTEFATOS_SEGUNDOS
+        )
+    
+    if resposta.status_code in (200, 206):
+        # No x-accel o corpo sai do nginx; contamos o arquivo inteiro (Range não é visível aqui)
+        enviados = os.path.getsize(caminho) if MODO_ENVIO_ARQUIVOS == 'x-accel' else resposta.content_length
+        metrica_bytes_entregues.labels(rota).inc(enviados or 0)
+    
+    resposta.headers['Accept-Ranges'] = 'bytes'
+    resposta.cache_control.public = True
+    resposta.cache_control.max_age = CACHE_ARTEFATOS_SEGUNDOS
+    resposta.cache_control.immutable = True
+    ao_fechar(resposta, lambda: zelador_disco.liberar_uso(caminho))
+    return resposta
+
+def resposta_artefato(caminho, nome_download):
+    """Do disco local quando o artefato está nesta instância; senão redireciona para o armazém.
+    None se não estiver em lugar nenhum."""
+    local = caminho_local(caminho)
+    if os.path.exists(local):
+        return enviar_artefato(local, nome_download)
+    nome = os.path.basename(caminho)
+    if armazem.existe(nome):
+        url = armazem.url_download(nome, nome_download)
+        if url:
+            return redirect(url, code=302)
+    return None
+
 @app.route('/api/download/<id_processo>')
 def download_audio(id_processo):
     try:
-        for arquivo in os.listdir(AUDIO_FILES_DIR):
-            if id_processo in arquivo and arquivo.endswith('.mp3'):
-                caminho_arquivo = os.path.join(AUDIO_FILES_DIR, arquivo)
-                return send_file(
-                    caminho_arquivo,
-                    as_attachment=True,
-                    download_name=arquivo
-                )
-        return jsonify({'erro': 'Arquivo não encontrado'}), 404
+        job = registro_jobs.obter(id_processo)
+        resposta = None
+        if job and job['estado'] == 'concluido' and job['caminho']:
+            resposta = resposta_artefato(job['caminho'], job['arquivo'])
+        if resposta is None:
+            return jsonify({'erro': 'Arquivo não encontrado'}), 404
+        return resposta
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
+@app.route('/api/download/<id_processo>/<int:indice>')
+def download_clipe(id_processo, indice):
+    try:
+        job = registro_jobs.obter(id_processo)
+        clipes = json.loads(job['clipes']) if job and job['clipes'] else []
+        clipe = next((c for c in clipes if c['indice'] == indice), None)
+        resposta = None
+        if clipe and clipe['status'] == 'concluido':
+            resposta = resposta_artefato(clipe['caminho'], clipe['arquivo'])
+        if resposta is None:
+            return jsonify({'erro': 'Arquivo não encontrado'}), 404
+        return resposta
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+def concluir_inicializacao(etapa):
+    """Fecha a última etapa e registra o tempo total até o processo estar pronto para atender"""
+    marcar_inicializacao(etapa)
+    with lock_inicializacao:
+        tempos_inicializacao['pronto'] = round((time.perf_counter() - INICIO_IMPORTACAO) * 1000, 1)
+        etapas = ', '.join(f"{nome} {ms:.0f}ms" for nome, ms in tempos_inicializacao.items() if nome != 'pronto')
+    logger.info(f"⏱️  Inicialização em {tempos_inicializacao['pronto']:.0f}ms: {etapas}")
+
+concluir_inicializacao('rotas')
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     
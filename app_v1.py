@@ -2,11 +2,19 @@ import os
 import logging
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
-import yt_dlp
+import importlib
 import uuid
 import threading
 import subprocess
 import re
+import copy
+import sqlite3
+import socket
+import time
+from comum import (
+    CacheFontes, CODEC_POR_EXTENSAO, EXTENSAO_POR_CODEC, ARGUMENTOS_POR_CODEC, analisar_audio, cortar_hibrido,
+    usar_corte_hibrido, ao_fechar
+)
 
 print("🚀 INICIANDO YOUTUBE AUDIO API - CORTE PRECISO")
 
@@ -14,21 +22,49 @@ print("🚀 INICIANDO YOUTUBE AUDIO API - CORTE PRECISO")
 app = Flask(__name__)
 CORS(app)
 
+def modulo(nome):
+    """Import pesado (yt-dlp) adiado até o primeiro uso: o processo sobe e responde antes"""
+    return importlib.import_module(nome)
+
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Diretórios
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-AUDIO_FILES_DIR = os.path.join(BASE_DIR, 'audio_files')
-TEMP_DIR = os.path.join(BASE_DIR, 'temp_downloads')
-
-# Criar diretórios se não existirem
+DADOS_DIR = os.environ.get('DADOS_DIR', BASE_DIR)  # audio_files, temp_downloads, cache_fontes_v1 e jobs_v1.db
+AUDIO_FILES_DIR = os.path.join(DADOS_DIR, 'audio_files')
+TEMP_DIR = os.path.join(DADOS_DIR, 'temp_downloads')
+# Cache e registro próprios: o app_rapido usa outro formato de fonte e outro esquema de jobs, e cada
+# processo reescreve o indice.json inteiro a partir da sua memória
+CACHE_DIR = os.path.join(DADOS_DIR, 'cache_fontes_v1')
+
+# Criar diretórios se não existirem. Como no app_rapido (ver EFEITOS DA IMPORTAÇÃO lá), a importação é o
+# início do processo: diretórios, os prints abaixo, o índice do cache de fontes e o registro de jobs (com a
+# thread de batimento, que tem de rodar antes do primeiro job) ficam aqui; o yt-dlp só no primeiro uso
 os.makedirs(AUDIO_FILES_DIR, exist_ok=True)
 os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Cache de fontes: limite em bytes e formato pedido ao yt-dlp
+CACHE_FONTES_MAX_BYTES = int(os.environ.get('CACHE_FONTES_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GB
+FORMATO_FONTE = 'bestaudio/best'
+
+# Cache de metadados: uma extração por vídeo, compartilhada por /api/info, validação e download
+CACHE_INFO_TTL_SEGUNDOS = int(os.environ.get('CACHE_INFO_TTL_SEGUNDOS', 1800))  # URLs de mídia expiram em poucas horas
+
+# Registro de jobs (SQLite): consultas por chave primária, sobrevive a reinícios
+REGISTRO_DB = os.environ.get('REGISTRO_DB_V1', os.path.join(DADOS_DIR, 'jobs_v1.db'))
+# Processos que dividem o registro renovam o batimento dos próprios jobs; sem batimento há mais que isso, o dono morreu
+VALIDADE_BATIMENTO_SEGUNDOS = int(os.environ.get('VALIDADE_BATIMENTO_SEGUNDOS', 60))
+
+# /api/limpar não remove arquivo mexido há menos que isso (corte ou download do yt-dlp escrevendo nele)
+PROTECAO_ACESSO_SEGUNDOS = 600
 
 print(f"📁 Diretório de áudios: {AUDIO_FILES_DIR}")
 print(f"📁 Diretório temporário: {TEMP_DIR}")
+print(f"📁 Cache de fontes: {CACHE_DIR}")
 
 
 def sanitizar_nome_arquivo(nome):
@@ -40,19 +76,215 @@ def sanitizar_nome_arquivo(nome):
     return nome[:50]
 
 
+def extrair_video_id(url):
+    """Extrai o ID do vídeo da URL"""
+    patterns = [
+        r'(?:v=|\/)([0-9A-Za-z_-]{11}).*',
+        r'(?:embed\/)([0-9A-Za-z_-]{11})',
+        r'(?:youtu\.be\/)([0-9A-Za-z_-]{11})'
+    ]
+
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+
+cache_fontes = CacheFontes(CACHE_DIR, CACHE_FONTES_MAX_BYTES)
+
+
+class RegistroJobs:
+    """Tabela durável de jobs: estado, etapa, arquivo de saída, erro e horários"""
+
+    # Colunas adicionadas depois da criação da tabela (migradas com ALTER TABLE)
+    COLUNAS_EXTRAS = {'dono': 'TEXT', 'batimento_em': 'REAL'}
+
+    def __init__(self, caminho_db, validade_batimento=VALIDADE_BATIMENTO_SEGUNDOS):
+        self.caminho_db = caminho_db
+        self.local = threading.local()
+        # O pid sozinho se repete entre reinícios de um contêiner
+        self.dono = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.validade_batimento = validade_batimento
+        with self._conexao() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id_processo TEXT PRIMARY KEY,
+                    estado TEXT NOT NULL,
+                    etapa TEXT,
+                    arquivo TEXT,
+                    caminho TEXT,
+                    tamanho_bytes INTEGER,
+                    erro TEXT,
+                    criado_em REAL NOT NULL,
+                    atualizado_em REAL NOT NULL,
+                    concluido_em REAL
+                )
+            """)
+            existentes = {linha['name'] for linha in conn.execute("PRAGMA table_info(jobs)")}
+            for coluna, tipo in self.COLUNAS_EXTRAS.items():
+                if coluna not in existentes:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {coluna} {tipo}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dono ON jobs (dono, estado)")
+        # Jobs em andamento cujo processo morreu não vão mais terminar
+        self.interromper_orfaos()
+        self.thread = threading.Thread(target=self._executar, name='batimento-registro', daemon=True)
+        self.thread.start()
+
+    def _conexao(self):
+        """Uma conexão por thread (sqlite3 não compartilha conexões entre threads)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho_db, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def _executar(self):
+        while True:
+            time.sleep(self.validade_batimento / 3)
+            try:
+                with self._conexao() as conn:
+                    conn.execute("UPDATE jobs SET batimento_em = ? WHERE dono = ? AND estado = 'processando'",
+                                 (time.time(), self.dono))
+                self.interromper_orfaos()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️  Batimento do registro falhou: {e}")
+
+    def interromper_orfaos(self):
+        """Falha os jobs 'processando' cujo dono parou de renovar o batimento; os de processos vivos ficam"""
+        agora = time.time()
+        with self._conexao() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET estado = 'erro', erro = ?, atualizado_em = ?, concluido_em = ? "
+                "WHERE estado = 'processando' AND (dono IS NULL OR dono != ?) "
+                "AND COALESCE(batimento_em, atualizado_em) < ?",
+                ('Processamento interrompido por reinício do servidor', agora, agora, self.dono,
+                 agora - self.validade_batimento)
+            )
+        if cursor.rowcount:
+            logger.warning(f"💀 {cursor.rowcount} job(s) de processos que pararam marcados como erro")
+
+    def criar(self, id_processo, etapa='iniciando'):
+        agora = time.time()
+        with self._conexao() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id_processo, estado, etapa, dono, batimento_em, criado_em, atualizado_em) "
+                "VALUES (?, 'processando', ?, ?, ?, ?, ?)",
+                (id_processo, etapa, self.dono, agora, agora, agora)
+            )
+
+    def atualizar(self, id_processo, **campos):
+        campos['atualizado_em'] = time.time()
+        atribuicoes = ', '.join(f'{campo} = ?' for campo in campos)
+        with self._conexao() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {atribuicoes} WHERE id_processo = ?",
+                list(campos.values()) + [id_processo]
+            )
+
+    def concluir(self, id_processo, arquivo, caminho):
+        self.atualizar(id_processo, estado='concluido', etapa='finalizado', arquivo=arquivo, caminho=caminho,
+                       tamanho_bytes=os.path.getsize(caminho), concluido_em=time.time())
+
+    def falhar(self, id_processo, erro):
+        self.atualizar(id_processo, estado='erro', erro=erro, concluido_em=time.time())
+
+    def obter(self, id_processo):
+        linha = self._conexao().execute(
+            "SELECT * FROM jobs WHERE id_processo = ?", (id_processo,)
+        ).fetchone()
+        return dict(linha) if linha else None
+
+    def ids_em_andamento(self):
+        linhas = self._conexao().execute("SELECT id_processo FROM jobs WHERE estado = 'processando'")
+        return {linha['id_processo'] for linha in linhas}
+
+
+registro_jobs = RegistroJobs(REGISTRO_DB)
+
+
+class CacheInfoVideo:
+    """Cache com TTL dos dicts retornados por extract_info, chaveado pelo ID do vídeo"""
+
+    def __init__(self, ttl_segundos):
+        self.ttl_segundos = ttl_segundos
+        self.entradas = {}  # chave -> (expira_em, info)
+        self.bloqueios = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _consultar(self, chave):
+        with self.lock:
+            entrada = self.entradas.get(chave)
+            if entrada and entrada[0] > time.time():
+                self.hits += 1
+                return entrada[1]
+            return None
+
+    def obter(self, url):
+        """Retorna o info dict do vídeo (não modificar: use copy.deepcopy antes de alterar)"""
+        chave = extrair_video_id(url) or url
+        info = self._consultar(chave)
+        if info:
+            return info
+
+        # Requisições simultâneas do mesmo vídeo compartilham uma única extração
+        with self.lock:
+            bloqueio = self.bloqueios.setdefault(chave, threading.Lock())
+        with bloqueio:
+            info = self._consultar(chave)
+            if info:
+                return info
+
+            # Mesmo formato do download: o info já sai com o stream de áudio selecionado
+            ydl_opts = {'format': FORMATO_FONTE, 'quiet': True}
+            with modulo('yt_dlp').YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+
+            agora = time.time()
+            with self.lock:
+                self.misses += 1
+                self.entradas[chave] = (agora + self.ttl_segundos, info)
+                # Descartar entradas expiradas
+                for outra, (expira_em, _) in list(self.entradas.items()):
+                    if expira_em <= agora:
+                        del self.entradas[outra]
+                        self.bloqueios.pop(outra, None)
+            return info
+
+    def invalidar(self, url):
+        chave = extrair_video_id(url) or url
+        with self.lock:
+            self.entradas.pop(chave, None)
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entradas': len(self.entradas),
+                'ttl_segundos': self.ttl_segundos
+            }
+
+
+cache_info = CacheInfoVideo(CACHE_INFO_TTL_SEGUNDOS)
+
+
 def obter_info_video(url):
     """Obtém informações detalhadas do vídeo"""
     try:
-        ydl_opts = {'quiet': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            return {
-                'titulo': info.get('title', 'Título não disponível'),
-                'duracao': info.get('duration', 0),
-                'autor': info.get('uploader', 'Autor não disponível'),
-                'thumbnail': info.get('thumbnail', ''),
-                'visualizacoes': info.get('view_count', 0)
-            }
+        info = cache_info.obter(url)
+        return {
+            'titulo': info.get('title', 'Título não disponível'),
+            'duracao': info.get('duration', 0),
+            'autor': info.get('uploader', 'Autor não disponível'),
+            'thumbnail': info.get('thumbnail', ''),
+            'visualizacoes': info.get('view_count', 0)
+        }
     except Exception as e:
         logger.error(f"Erro ao obter info do vídeo: {e}")
         return None
@@ -62,7 +294,7 @@ def baixar_audio_completo(url, id_processo):
     """Baixa o áudio completo em alta qualidade"""
     try:
         ydl_opts = {
-            'format': 'bestaudio/best',
+            'format': FORMATO_FONTE,
             'outtmpl': os.path.join(TEMP_DIR, f'temp_{id_processo}.%(ext)s'),
             'extractaudio': True,
             'audioformat': 'best',
@@ -71,8 +303,16 @@ def baixar_audio_completo(url, id_processo):
         }
 
         logger.info(f"📥 Iniciando download do áudio completo...")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        with modulo('yt_dlp').YoutubeDL(ydl_opts) as ydl:
+            try:
+                # Reaproveita a extração em cache: só baixa o formato já selecionado
+                info = copy.deepcopy(cache_info.obter(url))
+                ydl.process_info(info)
+            except Exception as e:
+                # URL de mídia expirada ou info inválido: extrair novamente
+                logger.warning(f"⚠️  Info em cache não serviu para o download ({e}), extraindo novamente...")
+                cache_info.invalidar(url)
+                info = ydl.extract_info(url, download=True)
 
         # Encontrar arquivo baixado
         for arquivo in os.listdir(TEMP_DIR):
@@ -88,8 +328,18 @@ def baixar_audio_completo(url, id_processo):
         raise Exception(f"Erro no download: {str(e)}")
 
 
-def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos):
-    """Corta o áudio com precisão usando FFmpeg"""
+# Corte híbrido (comum.py): só as bordas são recodificadas, com fade, e o miolo é copiado sem recompressão
+DURACAO_FADE_SEGUNDOS = 0.5
+
+
+def codec_saida_fonte(info):
+    """Codec do artefato: o da fonte, ou MP3 se a fonte tiver um codec sem contêiner aqui"""
+    codec = info['codec'] if info else None
+    return codec if codec in EXTENSAO_POR_CODEC else 'mp3'
+
+
+def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info=None):
+    """Corta o áudio com precisão usando FFmpeg. Retorna 'hibrido' ou 'recodificacao'"""
     try:
         duracao = fim_segundos - inicio_segundos
 
@@ -99,37 +349,27 @@ def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_se
 
         logger.info(f"✂️  Cortando áudio: {inicio_segundos}s → {fim_segundos}s (duração: {duracao}s)")
 
-        # PRIMEIRA TENTATIVA: Corte rápido sem recompressão
-        comando = [
-            'ffmpeg',
-            '-i', arquivo_entrada,
-            '-ss', str(inicio_segundos),  # Ponto de início
-            '-t', str(duracao),  # Duração do corte
-            '-c', 'copy',  # Copiar stream sem recompressão (rápido)
-            '-y',  # Sobrescrever arquivo de saída
-            '-avoid_negative_ts', 'make_zero',  # Corrigir timestamps negativos
-            '-hide_banner',  # Ocultar banner do FFmpeg
-            '-loglevel', 'warning',  # Apenas logs importantes
-            arquivo_saida
-        ]
-
-        logger.info(f"🔧 Executando FFmpeg (corte rápido)...")
-        resultado = subprocess.run(comando, capture_output=True, text=True, timeout=120)
+        codec_saida = CODEC_POR_EXTENSAO.get(os.path.splitext(arquivo_saida)[1].lower(), 'mp3')
+        info = info or analisar_audio(arquivo_entrada)
 
-        if resultado.returncode == 0 and os.path.exists(arquivo_saida):
-            tamanho = os.path.getsize(arquivo_saida) / (1024 * 1024)
-            logger.info(f"✅ Corte rápido concluído: {tamanho:.2f} MB")
-            return True
+        # PRIMEIRA TENTATIVA: Corte híbrido (só com o codec da fonte na saída, e AAC-LC em MP4)
+        if usar_corte_hibrido(info, arquivo_saida, inicio_segundos, fim_segundos):
+            logger.info(f"🔧 Executando FFmpeg (corte híbrido)...")
+            if cortar_hibrido(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info, TEMP_DIR,
+                              fade=DURACAO_FADE_SEGUNDOS):
+                tamanho = os.path.getsize(arquivo_saida) / (1024 * 1024)
+                logger.info(f"✅ Corte híbrido concluído: {tamanho:.2f} MB")
+                return 'hibrido'
 
         # SEGUNDA TENTATIVA: Corte com recompressão e fade
         logger.info("🔄 Tentando corte com recompressão...")
         comando = [
             'ffmpeg',
+            '-ss', str(inicio_segundos),  # Busca na entrada: não decodifica o trecho anterior
             '-i', arquivo_entrada,
-            '-ss', str(inicio_segundos),
             '-t', str(duracao),
-            '-c:a', 'libmp3lame',  # Codec MP3
-            '-b:a', '192k',  # Bitrate 192kbps
+            '-vn',
+        ] + ARGUMENTOS_POR_CODEC[codec_saida] + [
             '-af', f'afade=t=in:st=0:d=0.5,afade=t=out:st={duracao - 0.5}:d=0.5',  # Fade in/out
             '-y',
             '-hide_banner',
@@ -145,7 +385,7 @@ def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_se
         if os.path.exists(arquivo_saida):
             tamanho = os.path.getsize(arquivo_saida) / (1024 * 1024)
             logger.info(f"✅ Corte com recompressão concluído: {tamanho:.2f} MB")
-            return True
+            return 'recodificacao'
         else:
             raise Exception("Arquivo de saída não foi criado")
 
@@ -158,6 +398,8 @@ def cortar_audio_preciso(arquivo_entrada, arquivo_saida, inicio_segundos, fim_se
 def processar_audio_completo(url, inicio_segundos, fim_segundos, id_processo, nome_arquivo=None):
     """Processamento completo com corte preciso"""
     arquivo_temp = None
+    video_id = extrair_video_id(url)
+    fonte_reservada = False
     try:
         # 1. VALIDAR PARÂMETROS
         if fim_segundos <= inicio_segundos:
@@ -167,6 +409,7 @@ def processar_audio_completo(url, inicio_segundos, fim_segundos, id_processo, no
             raise Exception("O corte não pode ter mais de 2 horas")
 
         # 2. OBTER INFORMAÇÕES DO VÍDEO
+        registro_jobs.atualizar(id_processo, etapa='informacoes')
         info_video = obter_info_video(url)
         if not info_video:
             raise Exception("Não foi possível obter informações do vídeo")
@@ -179,22 +422,40 @@ def processar_audio_completo(url, inicio_segundos, fim_segundos, id_processo, no
             logger.warning(f"⚠️  Ajustando tempo final de {fim_segundos}s para {duracao_video}s")
             fim_segundos = duracao_video
 
-        # 3. BAIXAR ÁUDIO COMPLETO
-        arquivo_temp, titulo_video = baixar_audio_completo(url, id_processo)
+        # 3. OBTER ÁUDIO COMPLETO (cache de fontes ou download)
+        registro_jobs.atualizar(id_processo, etapa='download')
+        if video_id:
+            # Cortes simultâneos do mesmo vídeo aguardam um único download
+            with cache_fontes.bloqueio_download(video_id, FORMATO_FONTE):
+                fonte = cache_fontes.adquirir(video_id, FORMATO_FONTE)
+                if fonte:
+                    logger.info("⚡ Áudio encontrado no cache de fontes, pulando download")
+                else:
+                    arquivo_temp, titulo_video = baixar_audio_completo(url, id_processo)
+                    fonte = cache_fontes.guardar(video_id, FORMATO_FONTE, arquivo_temp, titulo_video)
+                    arquivo_temp = None
+            fonte_reservada = True
+            arquivo_fonte, titulo_video = fonte
+        else:
+            arquivo_temp, titulo_video = baixar_audio_completo(url, id_processo)
+            arquivo_fonte = arquivo_temp
 
-        # 4. PREPARAR NOME DO ARQUIVO FINAL
+        # 4. PREPARAR NOME DO ARQUIVO FINAL (contêiner pelo codec da fonte)
+        info_audio = analisar_audio(arquivo_fonte)
+        extensao = EXTENSAO_POR_CODEC[codec_saida_fonte(info_audio)]
         if nome_arquivo and nome_arquivo.strip():
             nome_base = sanitizar_nome_arquivo(nome_arquivo)
-            nome_final = f"{nome_base}.mp3"
+            nome_final = f"{nome_base}{extensao}"
         else:
             # Usar título do vídeo se não houver nome personalizado
             nome_base = sanitizar_nome_arquivo(titulo_video) or f"audio_{id_processo}"
-            nome_final = f"{nome_base}.mp3"
+            nome_final = f"{nome_base}{extensao}"
 
         arquivo_final = os.path.join(AUDIO_FILES_DIR, nome_final)
 
         # 5. EXECUTAR CORTE PRECISO
-        cortar_audio_preciso(arquivo_temp, arquivo_final, inicio_segundos, fim_segundos)
+        registro_jobs.atualizar(id_processo, etapa='corte')
+        cortar_audio_preciso(arquivo_fonte, arquivo_final, inicio_segundos, fim_segundos, info_audio)
 
         # 6. VERIFICAR RESULTADO
         if not os.path.exists(arquivo_final):
@@ -217,7 +478,10 @@ def processar_audio_completo(url, inicio_segundos, fim_segundos, id_processo, no
             'erro': str(e)
         }
     finally:
-        # LIMPEZA: Remover arquivo temporário
+        # LIMPEZA: Liberar a fonte em cache e remover arquivo temporário
+        if fonte_reservada:
+            cache_fontes.liberar(video_id, FORMATO_FONTE)
+
         if arquivo_temp and os.path.exists(arquivo_temp):
             try:
                 os.remove(arquivo_temp)
@@ -298,6 +562,7 @@ def processar_audio():
 
         # Gerar ID do processo
         id_processo = str(uuid.uuid4())[:8]
+        registro_jobs.criar(id_processo)
         logger.info(f"📋 Novo processo: {id_processo} - {inicio}s a {fim}s")
 
         # Executar em thread
@@ -329,44 +594,72 @@ def executar_processamento(url, inicio, fim, id_processo, nome_arquivo):
     try:
         resultado = processar_audio_completo(url, inicio, fim, id_processo, nome_arquivo)
         if resultado['sucesso']:
+            registro_jobs.concluir(id_processo, resultado['arquivo'],
+                                   os.path.join(AUDIO_FILES_DIR, resultado['arquivo']))
             logger.info(f"🎉 Processo {id_processo} concluído com sucesso")
         else:
+            registro_jobs.falhar(id_processo, resultado['erro'])
             logger.error(f"❌ Processo {id_processo} falhou: {resultado['erro']}")
     except Exception as e:
+        registro_jobs.falhar(id_processo, str(e))
         logger.error(f"💥 Erro crítico no processo {id_processo}: {str(e)}")
 
 
+@app.route('/api/cache')
+def estatisticas_cache():
+    """Estatísticas dos caches de fontes e de metadados"""
+    return jsonify({
+        'sucesso': True,
+        'cache_fontes': cache_fontes.estatisticas(),
+        'cache_info': cache_info.estatisticas()
+    })
+
+
+MENSAGENS_ETAPA = {
+    'iniciando': 'Processamento iniciado...',
+    'informacoes': 'Obtendo informações do vídeo...',
+    'download': 'Download em andamento...',
+    'corte': 'Corte em andamento...',
+}
+
+
 @app.route('/api/status/<id_processo>')
 def verificar_status(id_processo):
     """Verifica o status do processamento"""
     try:
-        # Procurar arquivo pelo ID do processo
-        for arquivo in os.listdir(AUDIO_FILES_DIR):
-            if f"_{id_processo}.mp3" in arquivo or arquivo.endswith(f"{id_processo}.mp3"):
-                caminho_arquivo = os.path.join(AUDIO_FILES_DIR, arquivo)
-                tamanho = os.path.getsize(caminho_arquivo) / (1024 * 1024)
+        # Consulta direta pela chave primária (sem varrer diretórios)
+        job = registro_jobs.obter(id_processo)
+        if not job:
+            return jsonify({'erro': 'Processo não encontrado'}), 404
 
+        if job['estado'] == 'concluido':
+            if not os.path.exists(job['caminho']):
                 return jsonify({
-                    'sucesso': True,
-                    'status': 'concluido',
-                    'arquivo': arquivo,
-                    'tamanho_mb': round(tamanho, 2),
-                    'download_url': f'/api/download/{id_processo}'
+                    'sucesso': False,
+                    'status': 'removido',
+                    'erro': 'Arquivo não está mais disponível'
                 })
 
-        # Se não encontrou, verificar se há arquivo temporário (ainda processando)
-        for arquivo in os.listdir(TEMP_DIR):
-            if f"temp_{id_processo}" in arquivo:
-                return jsonify({
-                    'sucesso': True,
-                    'status': 'processando',
-                    'mensagem': 'Download e corte em andamento...'
-                })
+            return jsonify({
+                'sucesso': True,
+                'status': 'concluido',
+                'arquivo': job['arquivo'],
+                'tamanho_mb': round(job['tamanho_bytes'] / (1024 * 1024), 2),
+                'download_url': f'/api/download/{id_processo}'
+            })
+
+        if job['estado'] == 'erro':
+            return jsonify({
+                'sucesso': False,
+                'status': 'erro',
+                'erro': job['erro']
+            })
 
         return jsonify({
             'sucesso': True,
             'status': 'processando',
-            'mensagem': 'Processamento iniciado...'
+            'etapa': job['etapa'],
+            'mensagem': MENSAGENS_ETAPA.get(job['etapa'], 'Processando...')
         })
 
     except Exception as e:
@@ -374,46 +667,78 @@ def verificar_status(id_processo):
         return jsonify({'erro': str(e)}), 500
 
 
+downloads_abertos = {}  # caminho -> respostas de /api/download ainda enviando o arquivo
+lock_downloads = threading.Lock()
+
+
+def liberar_download(caminho):
+    with lock_downloads:
+        restantes = downloads_abertos.get(caminho, 0) - 1
+        if restantes > 0:
+            downloads_abertos[caminho] = restantes
+        else:
+            downloads_abertos.pop(caminho, None)
+
+
 @app.route('/api/download/<id_processo>')
 def download_audio(id_processo):
     """Faz download do áudio processado"""
     try:
-        # Procurar arquivo pelo ID
-        arquivo_encontrado = None
-        for arquivo in os.listdir(AUDIO_FILES_DIR):
-            if f"_{id_processo}.mp3" in arquivo or arquivo.endswith(f"{id_processo}.mp3"):
-                arquivo_encontrado = arquivo
-                break
-
-        if not arquivo_encontrado:
+        job = registro_jobs.obter(id_processo)
+        if not job or job['estado'] != 'concluido' or not os.path.exists(job['caminho']):
             return jsonify({'erro': 'Arquivo não encontrado'}), 404
 
-        caminho_arquivo = os.path.join(AUDIO_FILES_DIR, arquivo_encontrado)
-
-        return send_file(
-            caminho_arquivo,
+        caminho = job['caminho']
+        resposta = send_file(
+            caminho,
             as_attachment=True,
-            download_name=arquivo_encontrado
+            download_name=job['arquivo']
         )
+        # /api/limpar pula o arquivo até a resposta terminar
+        with lock_downloads:
+            downloads_abertos[caminho] = downloads_abertos.get(caminho, 0) + 1
+        ao_fechar(resposta, lambda: liberar_download(caminho))
+        return resposta
 
     except Exception as e:
         logger.error(f"Erro em /api/download: {str(e)}")
         return jsonify({'erro': str(e)}), 500
 
 
+def arquivo_em_uso(caminho, jobs_ativos, agora):
+    """Download aberto, intermediário de job em andamento (temp_{id}.ext) ou mexido há pouco"""
+    with lock_downloads:
+        if downloads_abertos.get(caminho):
+            return True
+    nome = os.path.basename(caminho)
+    if nome.startswith('temp_') and nome[len('temp_'):].split('.')[0] in jobs_ativos:
+        return True
+    try:
+        estado = os.stat(caminho)
+    except OSError:
+        return True  # Já removido por outro caminho
+    return max(estado.st_atime, estado.st_mtime) > agora - PROTECAO_ACESSO_SEGUNDOS
+
+
 @app.route('/api/limpar', methods=['POST'])
 def limpar_arquivos():
-    """Limpa arquivos temporários (para administração)"""
+    """Limpa arquivos temporários (para administração), pulando os que estão em uso"""
     try:
-        import shutil
+        jobs_ativos = registro_jobs.ids_em_andamento()
+        agora = time.time()
+        removidos, em_uso = 0, 0
         for pasta in [TEMP_DIR, AUDIO_FILES_DIR]:
             for arquivo in os.listdir(pasta):
                 caminho_arquivo = os.path.join(pasta, arquivo)
+                if arquivo_em_uso(caminho_arquivo, jobs_ativos, agora):
+                    em_uso += 1
+                    continue
                 try:
                     os.remove(caminho_arquivo)
-                except:
+                    removidos += 1
+                except OSError:
                     pass
-        return jsonify({'sucesso': True, 'mensagem': 'Arquivos limpos'})
+        return jsonify({'sucesso': True, 'mensagem': 'Arquivos limpos', 'removidos': removidos, 'em_uso': em_uso})
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
@@ -432,6 +757,7 @@ if __name__ == '__main__':
     print("   POST /api/processar    - Processar áudio com corte preciso")
     print("   GET  /api/status/:id   - Verificar status")
     print("   GET  /api/download/:id - Download do áudio")
+    print("   GET  /api/cache        - Estatísticas dos caches")
     print("   POST /api/limpar       - Limpar arquivos (admin)")
     print("=" * 60)
     print("🚀 Servidor iniciando na porta 5000...")
@@ -0,0 +1,324 @@
+"""Benchmark offline do pipeline (download + corte), sem acesso à rede.
+
+Gera fontes sintéticas com o ffmpeg (m4a/AAC e webm/Opus), serve por um servidor HTTP local
+com suporte a Range (o extrator genérico do yt-dlp baixa o link direto) e mede:
+  - download: baixar_com_estrategia_extrema e baixar_trecho (app_rapido), baixar_audio_completo (app_v1)
+    e baixar_em_partes com 1, 4 e 8 conexões
+  - corte: cortar_audio_preciso (app_rapido e app_v1) por duração, posição e formato de saída
+
+Uso:
+    python benchmark.py                          # 1, 10, 60 e 180 min
+    python benchmark.py --duracoes 1,10 --repeticoes 5 --saida resultado.json
+
+O JSON inclui o commit atual, para comparar execuções entre commits.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Codec de cada contêiner sintético e a extensão "nativa" (mesmo codec, permite o corte híbrido)
+FONTES = {
+    'm4a': {'codec': 'aac', 'argumentos': ['-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart'],
+            'mimetype': 'audio/mp4', 'saida_nativa': 'm4a'},
+    'webm': {'codec': 'opus', 'argumentos': ['-c:a', 'libopus', '-b:a', '128k'],
+             'mimetype': 'audio/webm', 'saida_nativa': 'opus'},
+}
+
+DURACOES_CORTE = [10, 60, 600, 3600]
+CONEXOES_DOWNLOAD = [1, 4, 8]
+POSICOES_CORTE = ['inicio', 'meio', 'fim']
+
+
+class ServidorMidia(SimpleHTTPRequestHandler):
+    """Arquivos estáticos com Range/206 (o SimpleHTTPRequestHandler não suporta Range)"""
+
+    def log_message(self, *args):
+        pass
+
+    def guess_type(self, caminho):
+        extensao = os.path.splitext(caminho)[1].lstrip('.')
+        return FONTES[extensao]['mimetype'] if extensao in FONTES else super().guess_type(caminho)
+
+    def send_head(self):
+        caminho = self.translate_path(self.path)
+        if not os.path.isfile(caminho):
+            self.send_error(404)
+            return None
+        tamanho = os.path.getsize(caminho)
+        inicio, fim = 0, tamanho - 1
+        intervalo = self.headers.get('Range', '')
+        if intervalo.startswith('bytes='):
+            primeiro, _, ultimo = intervalo[6:].split(',')[0].partition('-')
+            if primeiro:
+                inicio = int(primeiro)
+                fim = min(int(ultimo), tamanho - 1) if ultimo else tamanho - 1
+            else:
+                inicio = max(0, tamanho - int(ultimo))
+            if inicio >= tamanho:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{tamanho}')
+                self.end_headers()
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {inicio}-{fim}/{tamanho}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(caminho))
+        self.send_header('Content-Length', str(fim - inicio + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.intervalo = (inicio, fim)
+        arquivo = open(caminho, 'rb')
+        arquivo.seek(inicio)
+        return arquivo
+
+    def copyfile(self, origem, destino):
+        restante = self.intervalo[1] - self.intervalo[0] + 1
+        while restante > 0:
+            bloco = origem.read(min(64 * 1024, restante))
+            if not bloco:
+                break
+            destino.write(bloco)
+            restante -= len(bloco)
+
+
+def iniciar_servidor(diretorio):
+    """Sobe o servidor local numa porta livre; retorna (servidor, url_base)"""
+    def handler(*args, **kwargs):
+        return ServidorMidia(*args, directory=diretorio, **kwargs)
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    return servidor, f'http://127.0.0.1:{servidor.server_address[1]}'
+
+
+def gerar_fonte(diretorio, formato, duracao_minutos):
+    """Ruído rosa estéreo (bitrate realista, ao contrário de um seno puro); reaproveita se já existir"""
+    # Pontos no nome: nada de 11 caracteres seguidos que extrair_video_id confunda com um ID do YouTube
+    arquivo = os.path.join(diretorio, f'fonte.{duracao_minutos}min.{formato}')
+    if os.path.exists(arquivo):
+        return arquivo
+    print(f"🎛️  Gerando fonte sintética {formato} de {duracao_minutos} min...")
+    comando = [
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'anoisesrc=color=pink:amplitude=0.3:sample_rate=48000:duration={duracao_minutos * 60}',
+        '-ac', '2', *FONTES[formato]['argumentos'], arquivo + '.parcial.' + formato
+    ]
+    subprocess.run(comando, check=True)
+    os.replace(arquivo + '.parcial.' + formato, arquivo)
+    return arquivo
+
+
+def cronometrar(funcao, repeticoes, limpar=None):
+    """Executa `funcao` N vezes; retorna (tempos, último resultado, erro)"""
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        try:
+            resultado = funcao()
+        except Exception as e:
+            return tempos, None, str(e)[:300]
+        tempos.append(time.perf_counter() - inicio)
+        if limpar:
+            limpar(resultado)
+    return tempos, resultado, None
+
+
+def resumo(tempos):
+    if not tempos:
+        return {}
+    return {
+        'tempos_s': [round(t, 4) for t in tempos],
+        'min_s': round(min(tempos), 4),
+        'mediana_s': round(statistics.median(tempos), 4),
+        'media_s': round(statistics.mean(tempos), 4),
+    }
+
+
+def remover_arquivo(caminho):
+    if caminho and os.path.exists(caminho):
+        os.remove(caminho)
+
+
+def medir_downloads(app_rapido, app_v1, url, duracao_segundos, repeticoes):
+    """Download completo pelas duas implementações e parcial (download_ranges) no meio da fonte"""
+    resultados = []
+    contador = [0]
+
+    def novo_id():
+        contador[0] += 1
+        return f'bench{contador[0]}'
+
+    casos = [
+        ('baixar_com_estrategia_extrema', lambda: app_rapido.baixar_com_estrategia_extrema(url, novo_id(), tentativas=1)),
+        ('baixar_audio_completo', lambda: app_v1.baixar_audio_completo(url, novo_id())),
+    ]
+    for conexoes in CONEXOES_DOWNLOAD:
+        casos.append((f'baixar_em_partes_{conexoes}',
+                      lambda conexoes=conexoes: baixar_partes(app_rapido, url, novo_id(), conexoes)))
+    meio = duracao_segundos / 2
+    for duracao_corte in DURACOES_CORTE:
+        if duracao_corte < duracao_segundos:
+            inicio = max(0, int(meio - duracao_corte / 2))
+            casos.append((f'baixar_trecho_{duracao_corte}s',
+                          lambda inicio=inicio, fim=inicio + duracao_corte:
+                          app_rapido.baixar_trecho(url, novo_id(), inicio, fim)))
+
+    def exigir_arquivo(funcao):
+        # baixar_trecho devolve None quando o download parcial não é possível
+        resultado = funcao()
+        if not resultado:
+            raise Exception('download não retornou arquivo')
+        return resultado
+
+    for nome, funcao in casos:
+        tamanhos = []
+
+        def limpar(resultado):
+            tamanhos.append(os.path.getsize(resultado[0]))
+            remover_arquivo(resultado[0])
+
+        tempos, _, erro = cronometrar(lambda: exigir_arquivo(funcao), repeticoes, limpar)
+        resultados.append({'funcao': nome, 'bytes': tamanhos[-1] if tamanhos else None,
+                           'erro': erro, **resumo(tempos)})
+        print(f"   📥 {nome}: {resultados[-1].get('mediana_s', erro)}")
+    return resultados
+
+
+def baixar_partes(app_rapido, url, id_processo, conexoes):
+    destino = os.path.join(app_rapido.TEMP_DIR, f'temp_{id_processo}_partes')
+    app_rapido.baixar_em_partes(url, {}, destino, conexoes)
+    return (destino,)
+
+
+def medir_cortes(implementacoes, fonte, formato, duracao_segundos, diretorio_saida, repeticoes):
+    """cortar_audio_preciso por duração × posição × formato de saída (mp3 e o codec da própria fonte)"""
+    resultados = []
+    for duracao_corte in DURACOES_CORTE:
+        if duracao_corte >= duracao_segundos:
+            continue
+        for posicao in POSICOES_CORTE:
+            inicio = {'inicio': 0,
+                      'meio': int((duracao_segundos - duracao_corte) / 2),
+                      'fim': duracao_segundos - duracao_corte}[posicao]
+            for extensao in ('mp3', FONTES[formato]['saida_nativa']):
+                saida = os.path.join(diretorio_saida, f'corte.{extensao}')
+                for nome, modulo in implementacoes:
+                    tempos, caminho, erro = cronometrar(
+                        lambda: modulo.cortar_audio_preciso(fonte, saida, inicio, inicio + duracao_corte),
+                        repeticoes
+                    )
+                    resultados.append({
+                        'implementacao': nome,
+                        'duracao_corte_s': duracao_corte,
+                        'posicao': posicao,
+                        'inicio_s': inicio,
+                        'formato_saida': extensao,
+                        'caminho': caminho,
+                        'bytes': os.path.getsize(saida) if os.path.exists(saida) else None,
+                        'erro': erro,
+                        **resumo(tempos)
+                    })
+                    remover_arquivo(saida)
+                    print(f"   ✂️  {nome} {duracao_corte}s/{posicao} → {extensao}: "
+                          f"{resultados[-1].get('mediana_s', erro)} ({caminho})")
+    return resultados
+
+
+def versao_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def versao_ffmpeg():
+    resultado = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
+    return resultado.stdout.splitlines()[0] if resultado.stdout else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline do download e do corte')
+    parser.add_argument('--duracoes', default='1,10,60,180', help='Durações das fontes em minutos')
+    parser.add_argument('--formatos', default='m4a,webm', help='Contêineres das fontes (m4a, webm)')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--sem-download', action='store_true', help='Mede só o corte')
+    parser.add_argument('--dir-fontes', default=os.path.join(tempfile.gettempdir(), 'ytcut_benchmark'),
+                        help='Onde guardar as fontes geradas (reaproveitadas entre execuções)')
+    parser.add_argument('--saida', default='benchmark.json')
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        sys.exit('❌ ffmpeg não encontrado no PATH')
+
+    formatos = [f for f in args.formatos.split(',') if f]
+    for formato in formatos:
+        if formato not in FONTES:
+            sys.exit(f"❌ Formato desconhecido: {formato} (use {', '.join(FONTES)})")
+    duracoes = [int(d) for d in args.duracoes.split(',') if d]
+
+    # Estado dos apps (registro, caches, downloads e artefatos) fora do repositório: os diretórios são
+    # criados e o zelador começa a varrê-los já no import
+    trabalho = tempfile.mkdtemp(prefix='ytcut_bench_')
+    os.environ['DADOS_DIR'] = trabalho
+    os.environ['REGISTRO_DB'] = os.path.join(trabalho, 'jobs.db')
+    os.environ['ARMAZEM_ARTEFATOS'] = 'local'
+    import app_rapido
+    import app_v1
+
+    os.makedirs(args.dir_fontes, exist_ok=True)
+    servidor, url_base = iniciar_servidor(args.dir_fontes)
+    implementacoes = [('app_rapido', app_rapido), ('app_v1', app_v1)]
+
+    relatorio = {
+        'commit': versao_commit(),
+        'executado_em': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'ffmpeg': versao_ffmpeg(),
+        'repeticoes': args.repeticoes,
+        'fontes': []
+    }
+    try:
+        for formato in formatos:
+            for duracao_minutos in duracoes:
+                fonte = gerar_fonte(args.dir_fontes, formato, duracao_minutos)
+                duracao_segundos = duracao_minutos * 60
+                print(f"📊 {os.path.basename(fonte)} ({os.path.getsize(fonte) / (1024 * 1024):.1f} MB)")
+                entrada = {
+                    'formato': formato,
+                    'codec': FONTES[formato]['codec'],
+                    'duracao_s': duracao_segundos,
+                    'bytes': os.path.getsize(fonte),
+                    'cortes': medir_cortes(implementacoes, fonte, formato, duracao_segundos,
+                                           trabalho, args.repeticoes)
+                }
+                if not args.sem_download:
+                    url = f'{url_base}/{os.path.basename(fonte)}'
+                    if app_rapido.extrair_video_id(url):  # Levaria às sondas de URL alternativa (rede)
+                        sys.exit(f'❌ {url} parece um link do YouTube')
+                    entrada['downloads'] = medir_downloads(app_rapido, app_v1, url, duracao_segundos,
+                                                           args.repeticoes)
+                relatorio['fontes'].append(entrada)
+    finally:
+        servidor.shutdown()
+        shutil.rmtree(trabalho, ignore_errors=True)
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
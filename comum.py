@@ -0,0 +1,434 @@
+"""Código compartilhado por app_rapido (e app_async) e app_v1: cache de fontes em disco, análise do
+áudio, corte híbrido e envio de arquivos pelo Flask.
+
+Cada app cria as próprias instâncias (diretórios e registros diferentes); aqui só ficam classes,
+funções e constantes, sem nada criado na importação.
+"""
+import os
+import re
+import json
+import math
+import uuid
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from werkzeug.wsgi import ClosingIterator
+
+logger = logging.getLogger(__name__)
+
+class CacheFontes:
+    """Cache LRU em disco dos áudios de origem, chaveado por vídeo + formato.
+    Anexos derivados da fonte ({chave}.{sufixo}, ex. picos da forma de onda) saem junto com ela
+    e não entram no orçamento (são uma fração do tamanho da fonte)."""
+
+    def __init__(self, diretorio, max_bytes):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self.indice_path = os.path.join(diretorio, 'indice.json')
+        self.entradas = OrderedDict()  # chave -> {'arquivo', 'tamanho', 'titulo'} (mais antiga primeiro)
+        self.em_uso = {}  # chave -> nº de cortes usando o arquivo
+        self.bloqueios_download = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.removidos = 0
+        self.lock = threading.RLock()
+        self._carregar_indice()
+
+    @staticmethod
+    def chave(video_id, formato):
+        formato_seguro = re.sub(r'[^\w\-]', '_', formato)
+        return f"{video_id}_{formato_seguro}"
+
+    def _carregar_indice(self):
+        """Reconstrói o índice a partir do disco (o cache sobrevive a reinícios)"""
+        try:
+            with open(self.indice_path) as f:
+                registros = json.load(f)
+        except (OSError, ValueError):
+            registros = []
+
+        for registro in registros:
+            caminho = os.path.join(self.diretorio, registro['arquivo'])
+            if os.path.exists(caminho):
+                registro['tamanho'] = os.path.getsize(caminho)
+                self.entradas[registro['chave']] = registro
+                self.total_bytes += registro['tamanho']
+
+        # Arquivos fora do índice são restos de execuções interrompidas
+        conhecidos = {r['arquivo'] for r in self.entradas.values()}
+        for arquivo in os.listdir(self.diretorio):
+            if arquivo != 'indice.json' and arquivo not in conhecidos and arquivo.split('.')[0] not in self.entradas:
+                try:
+                    os.remove(os.path.join(self.diretorio, arquivo))
+                except:
+                    pass
+
+        self._liberar_espaco()
+        self._salvar_indice()
+
+    def _salvar_indice(self):
+        temp_path = self.indice_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump([dict(r, chave=k) for k, r in self.entradas.items()], f)
+        os.replace(temp_path, self.indice_path)
+
+    def _liberar_espaco(self):
+        """Remove as fontes menos usadas recentemente até caber no orçamento"""
+        for chave in list(self.entradas):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self.em_uso.get(chave):
+                continue
+            registro = self.entradas.pop(chave)
+            self.total_bytes -= registro['tamanho']
+            self.removidos += 1
+            try:
+                os.remove(os.path.join(self.diretorio, registro['arquivo']))
+            except:
+                pass
+            self._remover_anexos(chave)
+            logger.info(f"🗑️  Fonte removida do cache: {chave} ({registro['tamanho'] / (1024 * 1024):.2f} MB)")
+
+    def _remover_anexos(self, chave):
+        for arquivo in os.listdir(self.diretorio):
+            if arquivo.startswith(chave + '.') and not arquivo.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.diretorio, arquivo))
+                except:
+                    pass
+
+    def caminho_anexo(self, video_id, formato, sufixo):
+        return os.path.join(self.diretorio, f"{self.chave(video_id, formato)}.{sufixo}")
+
+    def contem(self, video_id, formato):
+        """Consulta sem reservar nem contar hit/miss"""
+        with self.lock:
+            return self.chave(video_id, formato) in self.entradas
+
+    def bloqueio_download(self, video_id, formato):
+        """Lock por chave: cortes simultâneos do mesmo vídeo esperam um único download"""
+        with self.lock:
+            return self.bloqueios_download.setdefault(self.chave(video_id, formato), threading.Lock())
+
+    def adquirir(self, video_id, formato):
+        """Retorna (caminho, titulo) e reserva a fonte, ou None se não estiver em cache"""
+        chave = self.chave(video_id, formato)
+        with self.lock:
+            registro = self.entradas.get(chave)
+            if registro:
+                caminho = os.path.join(self.diretorio, registro['arquivo'])
+                if os.path.exists(caminho):
+                    self.entradas.move_to_end(chave)
+                    self.em_uso[chave] = self.em_uso.get(chave, 0) + 1
+                    self.hits += 1
+                    return caminho, registro['titulo']
+                self.entradas.pop(chave)
+                self.total_bytes -= registro['tamanho']
+            self.misses += 1
+            return None
+
+    def guardar(self, video_id, formato, arquivo_temp, titulo):
+        """Move o download para o cache e já o reserva para o corte atual"""
+        chave = self.chave(video_id, formato)
+        nome = chave + os.path.splitext(arquivo_temp)[1]
+        caminho = os.path.join(self.diretorio, nome)
+        os.replace(arquivo_temp, caminho)
+        tamanho = os.path.getsize(caminho)
+
+        with self.lock:
+            anterior = self.entradas.pop(chave, None)
+            if anterior:
+                self.total_bytes -= anterior['tamanho']
+                if anterior['arquivo'] != nome:
+                    try:
+                        os.remove(os.path.join(self.diretorio, anterior['arquivo']))
+                    except:
+                        pass
+            self.entradas[chave] = {'arquivo': nome, 'tamanho': tamanho, 'titulo': titulo}
+            self.total_bytes += tamanho
+            self.em_uso[chave] = self.em_uso.get(chave, 0) + 1
+            self._liberar_espaco()
+            self._salvar_indice()
+        return caminho, titulo
+
+    def liberar(self, video_id, formato):
+        chave = self.chave(video_id, formato)
+        with self.lock:
+            restantes = self.em_uso.get(chave, 0) - 1
+            if restantes > 0:
+                self.em_uso[chave] = restantes
+            else:
+                self.em_uso.pop(chave, None)
+            self._liberar_espaco()
+            self._salvar_indice()
+
+    def estatisticas(self):
+        with self.lock:
+            consultas = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'taxa_acerto': round(self.hits / consultas, 3) if consultas else 0.0,
+                'entradas': len(self.entradas),
+                'em_uso': len(self.em_uso),
+                'removidos': self.removidos,
+                'tamanho_mb': round(self.total_bytes / (1024 * 1024), 2),
+                'limite_mb': round(self.max_bytes / (1024 * 1024), 2)
+            }
+
+# CORTE HÍBRIDO: só as bordas são recodificadas, o miolo é copiado sem recompressão
+BORDA_CORTE_SEGUNDOS = float(os.environ.get('BORDA_CORTE_SEGUNDOS', 1.0))  # >= fade das bordas (app_v1)
+# Só AAC-LC em MP4. As bordas saem do encoder aac com o perfil, o sample rate e os canais da fonte (a mesma
+# AudioSpecificConfig que o concat copia da primeira parte); o priming de 1024 amostras fica em pacotes que
+# são descartados, e o resto antes do início do corte vira edit list. Opus no Ogg não tem como descartar
+# menos que um pacote no início (o pre-skip vem fixo do encoder) e o miolo copiado entraria sem pre-roll;
+# MP3 (atraso do LAME) e Vorbis também não: esses recodificam o trecho inteiro
+AMOSTRAS_POR_PACOTE_HIBRIDO = {'aac': 1024}
+PERFIS_HIBRIDO = {'aac': ('LC',)}
+PACOTES_PRE_ROLL = 8  # Pacotes codificados antes de cada emenda e descartados: com menos, o encoder
+# ainda não estabilizou e os primeiros pacotes depois da emenda da cauda saem com ~10 dB de SNR
+
+CODEC_POR_EXTENSAO = {'.mp3': 'mp3', '.m4a': 'aac', '.aac': 'aac', '.opus': 'opus', '.ogg': 'vorbis'}
+ENCODER_POR_CODEC = {'mp3': 'libmp3lame', 'aac': 'aac', 'opus': 'libopus', 'vorbis': 'libvorbis'}
+EXTENSAO_POR_CODEC = {'mp3': '.mp3', 'aac': '.m4a', 'opus': '.opus', 'vorbis': '.ogg'}
+# Recodificação completa (fallback, lote e stream), por codec de saída
+ARGUMENTOS_POR_CODEC = {
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '192k'],
+    'aac': ['-c:a', 'aac', '-b:a', '192k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '160k'],
+    'vorbis': ['-c:a', 'libvorbis', '-q:a', '6'],
+}
+
+def executar_ffmpeg(comando, timeout, ao_progredir=None, deslocamento=0.0):
+    """subprocess.run do ffmpeg; com ao_progredir, acompanha o -progress e informa os segundos gerados"""
+    if not ao_progredir:
+        return subprocess.run(comando, capture_output=True, text=True, timeout=timeout)
+
+    comando = [comando[0], '-progress', 'pipe:1', '-nostats'] + comando[1:]
+    with tempfile.TemporaryFile(mode='w+') as erros:
+        processo = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=erros, text=True)
+        # O timeout não pode depender de chegar uma linha de progresso: um ffmpeg travado não escreve nada
+        estourou = threading.Event()
+
+        def encerrar():
+            estourou.set()
+            processo.kill()
+
+        vigia = threading.Timer(timeout, encerrar)
+        vigia.daemon = True
+        vigia.start()
+        try:
+            for linha in processo.stdout:
+                chave, _, valor = linha.strip().partition('=')
+                if chave == 'out_time_us' and valor.isdigit():
+                    ao_progredir(deslocamento + int(valor) / 1_000_000)
+            processo.wait()
+            if estourou.is_set():
+                raise subprocess.TimeoutExpired(comando, timeout)
+        except BaseException:
+            processo.kill()
+            processo.wait()
+            raise
+        finally:
+            vigia.cancel()
+        erros.seek(0)
+        return subprocess.CompletedProcess(comando, processo.returncode, '', erros.read())
+
+# Comandos e interpretação das saídas ficam separados da execução: o app_async roda os mesmos
+# comandos com asyncio.create_subprocess_exec
+def comando_analise(arquivo):
+    return [
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,profile,sample_rate,channels,bit_rate:format=format_name,start_time,bit_rate',
+        '-of', 'json', arquivo
+    ]
+
+def analisar_audio(arquivo):
+    """Codec, perfil, sample rate, canais, bitrate e contêiner do primeiro stream de áudio (ffprobe)"""
+    resultado = subprocess.run(comando_analise(arquivo), capture_output=True, text=True, timeout=30)
+    if resultado.returncode != 0:
+        return None
+    return interpretar_analise(resultado.stdout)
+
+def interpretar_analise(saida):
+    dados = json.loads(saida or '{}')
+    streams = dados.get('streams') or []
+    if not streams:
+        return None
+    stream, formato = streams[0], dados.get('format', {})
+    return {
+        'codec': stream.get('codec_name'),
+        'perfil': stream.get('profile'),
+        'sample_rate': stream.get('sample_rate'),
+        'canais': stream.get('channels'),
+        'bit_rate': stream.get('bit_rate') or formato.get('bit_rate'),
+        'conteiner': formato.get('format_name') or '',
+        'inicio': float(formato.get('start_time') or 0)
+    }
+
+def comando_pacotes(arquivo, instante, inicio_arquivo=0):
+    absoluto = instante + inicio_arquivo  # -read_intervals usa timestamps absolutos, como o pts_time
+    return [
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-read_intervals', f'{max(0, absoluto - 1)}%{absoluto + 1}',
+        '-show_entries', 'packet=pts_time', '-of', 'csv=p=0', arquivo
+    ]
+
+def localizar_pacote(arquivo, instante, inicio_arquivo, depois=True):
+    """Instante exato do primeiro pacote em/após `instante` (ou do último em/antes)"""
+    resultado = subprocess.run(comando_pacotes(arquivo, instante, inicio_arquivo), capture_output=True, text=True, timeout=30)
+    if resultado.returncode != 0:
+        return None
+    return escolher_pacote(resultado.stdout, instante, inicio_arquivo, depois)
+
+def escolher_pacote(saida, instante, inicio_arquivo, depois=True):
+    instantes = []
+    for linha in saida.split():
+        try:
+            instantes.append(float(linha.strip(',')) - inicio_arquivo)
+        except ValueError:
+            continue
+    if depois:
+        candidatos = [t for t in instantes if t >= instante]
+        return min(candidatos) if candidatos else None
+    candidatos = [t for t in instantes if t <= instante]
+    return max(candidatos) if candidatos else None
+
+def argumentos_encoder(codec, info):
+    """Parâmetros de codificação compatíveis com o stream original (exigido pelo concat)"""
+    argumentos = ['-c:a', ENCODER_POR_CODEC[codec]]
+    if info.get('sample_rate'):
+        argumentos += ['-ar', str(info['sample_rate'])]
+    if info.get('canais'):
+        argumentos += ['-ac', str(info['canais'])]
+    if info.get('bit_rate'):
+        argumentos += ['-b:a', str(info['bit_rate'])]
+    return argumentos
+
+def planejar_corte_hibrido(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info,
+                           inicio_miolo, fim_miolo, diretorio_temp, fade=None):
+    """Comandos das bordas (com a posição de cada uma no corte), lista e comando do concat. O miolo é lido
+    direto do arquivo original pelo concat (inpoint/outpoint). None se a cabeça não couber numa grade de
+    pacotes alinhada ao miolo (corte colado no início do arquivo). fade: segundos de fade in/out nas bordas."""
+    extensao = os.path.splitext(arquivo_saida)[1]
+    prefixo = os.path.join(diretorio_temp, f'corte_{uuid.uuid4().hex[:8]}')
+    cabeca_bruta, cabeca, cauda = (f'{prefixo}_{parte}{extensao}' for parte in ('cabeca_bruta', 'cabeca', 'cauda'))
+    lista = f'{prefixo}_lista.txt'
+    encoder = argumentos_encoder(info['codec'], info)
+    base = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error']
+    pacote = AMOSTRAS_POR_PACOTE_HIBRIDO[info['codec']] / int(info['sample_rate'])
+
+    # Cabeça: pacotes do encoder numa grade que termina exatamente em inicio_miolo (sem enchimento na
+    # emenda), começando PACOTES_PRE_ROLL antes do corte e com um pacote a mais depois, descartado
+    pacotes = min(math.ceil((inicio_miolo - inicio_segundos) / pacote) + PACOTES_PRE_ROLL,
+                  math.floor(inicio_miolo / pacote + 1e-6))
+    inicio_cabeca = inicio_miolo - pacotes * pacote
+    pre_roll_cauda = PACOTES_PRE_ROLL * pacote
+    if inicio_cabeca > inicio_segundos or fim_miolo < pre_roll_cauda:
+        return None
+    duracao_cauda = fim_segundos - fim_miolo + pre_roll_cauda
+    filtros_cabeca, filtros_cauda = [], []
+    if fade:
+        filtros_cabeca = ['-af', f'afade=t=in:st={inicio_segundos - inicio_cabeca:.6f}:d={fade}']
+        filtros_cauda = ['-af', f'afade=t=out:st={duracao_cauda - fade:.6f}:d={fade}']
+
+    comandos = [
+        base + ['-ss', f'{inicio_cabeca:.6f}', '-i', arquivo_entrada,
+                '-t', f'{inicio_miolo - inicio_cabeca + pacote:.6f}', '-vn'] + filtros_cabeca + encoder + [cabeca_bruta],
+        # Cópia sem priming e pre-roll: o pacote que contém o início do corte fica, com o excesso em edit list
+        base + ['-ss', f'{inicio_segundos - inicio_cabeca:.6f}', '-i', cabeca_bruta,
+                '-t', f'{inicio_miolo - inicio_segundos:.6f}', '-c', 'copy', cabeca],
+        # Cauda: mesma grade do miolo a partir de PACOTES_PRE_ROLL antes de fim_miolo
+        base + ['-ss', f'{fim_miolo - pre_roll_cauda:.6f}', '-i', arquivo_entrada,
+                '-t', f'{duracao_cauda:.6f}', '-vn'] + filtros_cauda + encoder + [cauda],
+    ]
+
+    # Posição de cada parte dentro do corte, para o progresso acumulado
+    deslocamentos = [0.0, 0.0, max(0.0, fim_miolo - pre_roll_cauda - inicio_segundos)]
+
+    # inpoint arredondado para cima e outpoint para baixo (microssegundos): o concat busca o pacote em/antes
+    # do inpoint e para no primeiro em/depois do outpoint. O inpoint da cauda pula priming e pre-roll.
+    # Timestamps do arquivo original são absolutos
+    entradas = [
+        (cabeca, None, None),
+        (arquivo_entrada, math.ceil((inicio_miolo + info['inicio']) * 1e6) / 1e6,
+         math.floor((fim_miolo + info['inicio']) * 1e6) / 1e6),
+        (cauda, math.ceil(pre_roll_cauda * 1e6) / 1e6, None),
+    ]
+
+    return {
+        'partes': list(zip(comandos, deslocamentos)),
+        'arquivos': (cabeca_bruta, cabeca, cauda),
+        'entradas': entradas,
+        'lista': lista,
+        # -copyts: o primeiro pacote da cabeça tem timestamp negativo, e é ele que vira o edit list da saída
+        'concat': base + ['-copyts', '-f', 'concat', '-safe', '0', '-i', lista, '-c', 'copy', arquivo_saida]
+    }
+
+def escrever_lista_concat(plano):
+    with open(plano['lista'], 'w') as f:
+        for arquivo, inpoint, outpoint in plano['entradas']:
+            f.write(f"file '{arquivo}'\n")
+            if inpoint is not None:
+                f.write(f"inpoint {inpoint:.6f}\n")
+            if outpoint is not None:
+                f.write(f"outpoint {outpoint:.6f}\n")
+
+def remover_temporarios_corte(plano):
+    for arquivo in plano['arquivos'] + (plano['lista'],):
+        if os.path.exists(arquivo):
+            try:
+                os.remove(arquivo)
+            except:
+                pass
+
+def cortar_hibrido(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info, diretorio_temp,
+                   ao_progredir=None, fade=None):
+    """Recodifica só [inicio, miolo) e [fim_miolo, fim), copia o miolo e concatena as partes"""
+    inicio_miolo = localizar_pacote(arquivo_entrada, inicio_segundos + BORDA_CORTE_SEGUNDOS, info['inicio'])
+    fim_miolo = localizar_pacote(arquivo_entrada, fim_segundos - BORDA_CORTE_SEGUNDOS, info['inicio'], depois=False)
+    if inicio_miolo is None or fim_miolo is None or fim_miolo <= inicio_miolo:
+        return False
+
+    plano = planejar_corte_hibrido(arquivo_entrada, arquivo_saida, inicio_segundos, fim_segundos, info,
+                                   inicio_miolo, fim_miolo, diretorio_temp, fade)
+    if plano is None:
+        return False
+    try:
+        for comando, deslocamento in plano['partes']:
+            resultado = executar_ffmpeg(comando, 180, ao_progredir, deslocamento)
+            if resultado.returncode != 0:
+                logger.warning(f"⚠️  Parte do corte híbrido falhou: {resultado.stderr[:200]}")
+                return False
+
+        escrever_lista_concat(plano)
+        resultado = subprocess.run(plano['concat'], capture_output=True, text=True, timeout=180)
+        return resultado.returncode == 0 and os.path.exists(arquivo_saida)
+    finally:
+        remover_temporarios_corte(plano)
+
+def usar_corte_hibrido(info, arquivo_saida, inicio_segundos, fim_segundos):
+    """Híbrido só quando a saída tem o codec da fonte, a fonte tem perfil e contêiner cujas emendas saem
+    exatas (AAC-LC em MP4) e o corte é maior que as duas bordas"""
+    codec_saida = CODEC_POR_EXTENSAO.get(os.path.splitext(arquivo_saida)[1].lower())
+    return bool(info and codec_saida and info['codec'] == codec_saida
+                and info.get('perfil') in PERFIS_HIBRIDO.get(codec_saida, ())
+                and 'mp4' in info.get('conteiner', '')
+                and fim_segundos - inicio_segundos > 2 * BORDA_CORTE_SEGUNDOS + 1)
+
+def ao_fechar(resposta, funcao):
+    """call_on_close que também vale para o send_file: com direct_passthrough o Werkzeug entrega o arquivo
+    direto ao servidor e response.close() nunca é chamado. Roda uma vez, por onde a resposta fechar."""
+    executada = []
+
+    def uma_vez():
+        if not executada:
+            executada.append(True)
+            funcao()
+
+    resposta.call_on_close(uma_vez)
+    if resposta.direct_passthrough:
+        resposta.response = ClosingIterator(resposta.response, uma_vez)
@@ -0,0 +1,141 @@
+"""Verificação do armazém S3 contra um servidor local compatível, sem AWS.
+
+Sobe o moto em processo (pip install 'moto[server]') ou usa um servidor já no ar (MinIO etc.) via
+S3_ENDPOINT_URL, e exercita o ArmazemS3 do app_rapido como duas instâncias atrás de um balanceador:
+  - enviar/existe/url_download (a URL assinada é baixada de volta e comparada), gravar_json/ler_json/remover
+  - a instância A conclui um job; a instância B (outro jobs.db) lê o status e acha o corte pela chave
+  - o EspelhoEstado reenvia o estado depois de uma falha do armazém
+
+Uso:
+    python verificar_armazem.py
+    S3_ENDPOINT_URL=http://127.0.0.1:9000 S3_BUCKET=ytcut python verificar_armazem.py
+"""
+import os
+import sys
+import time
+import socket
+import hashlib
+import tempfile
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_moto():
+    """Servidor S3 do moto numa porta livre; retorna (servidor, endpoint)"""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit("❌ moto não instalado (pip install 'moto[server]') e S3_ENDPOINT_URL não definido")
+    porta = porta_livre()
+    servidor = ThreadedMotoServer(ip_address='127.0.0.1', port=porta)
+    servidor.start()
+    return servidor, f'http://127.0.0.1:{porta}'
+
+
+def aguardar(condicao, limite=10):
+    fim = time.time() + limite
+    while time.time() < fim:
+        if condicao():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def verificar(descricao, condicao):
+    print(f"{'✅' if condicao else '❌'} {descricao}")
+    if not condicao:
+        sys.exit(1)
+
+
+def main():
+    servidor = None
+    if not os.environ.get('S3_ENDPOINT_URL'):
+        servidor, endpoint = iniciar_moto()
+        os.environ['S3_ENDPOINT_URL'] = endpoint
+        for variavel, valor in (('AWS_ACCESS_KEY_ID', 'teste'), ('AWS_SECRET_ACCESS_KEY', 'teste')):
+            os.environ.setdefault(variavel, valor)
+    os.environ.setdefault('S3_BUCKET', 'ytcut-verificacao')
+    os.environ.setdefault('S3_REGIAO', 'us-east-1')
+    os.environ.setdefault('AWS_DEFAULT_REGION', os.environ['S3_REGIAO'])
+
+    # Estado da instância A fora do repositório; o armazém é o S3 local
+    trabalho = tempfile.mkdtemp(prefix='ytcut_armazem_')
+    os.environ['DADOS_DIR'] = trabalho
+    os.environ['REGISTRO_DB'] = os.path.join(trabalho, 'jobs.db')
+    os.environ['ARMAZEM_ARTEFATOS'] = 's3'
+    os.environ['AQUECIMENTO'] = '0'
+    import app_rapido
+
+    armazem = app_rapido.armazem
+    try:
+        armazem.cliente.create_bucket(Bucket=armazem.bucket)
+    except Exception as e:
+        if 'BucketAlreadyOwnedByYou' not in str(e) and 'BucketAlreadyExists' not in str(e):
+            raise
+    print(f"🪣 {armazem.endpoint_url} / {armazem.bucket}")
+
+    try:
+        # Artefato: envio, existência e URL assinada
+        chave = hashlib.sha256(str(time.time()).encode()).hexdigest()[:24]
+        nome = f'{chave}.m4a'
+        caminho = os.path.join(app_rapido.AUDIO_FILES_DIR, nome)
+        conteudo = os.urandom(256 * 1024)
+        with open(caminho, 'wb') as f:
+            f.write(conteudo)
+        verificar('objeto ausente antes do envio', not armazem.existe(nome))
+        app_rapido.publicar_artefato(caminho)
+        verificar('objeto presente depois do envio', armazem.existe(nome))
+        url = armazem.url_download(nome, 'Meu corte.m4a')
+        resposta = app_rapido.sessao_http().get(url, timeout=10)
+        verificar('URL assinada devolve o mesmo conteúdo', resposta.status_code == 200 and resposta.content == conteudo)
+        # O moto ignora o override na resposta; S3 e MinIO o aplicam
+        verificar('URL assinada pede Content-Disposition de anexo', 'response-content-disposition=attachment' in url)
+
+        # JSON de estado
+        armazem.gravar_json('estado/verificacao.json', {'ok': True})
+        verificar('gravar_json/ler_json', armazem.ler_json('estado/verificacao.json') == {'ok': True})
+        armazem.remover('estado/verificacao.json')
+        verificar('remover', armazem.ler_json('estado/verificacao.json') is None)
+
+        # Duas instâncias: A conclui o job, B (outro registro local) o enxerga pelo armazém
+        id_processo = chave[:8]
+        app_rapido.registro_jobs.criar(id_processo, etapa='corte', chave=chave)
+        app_rapido.registro_jobs.concluir(id_processo, 'Meu corte.m4a', caminho)
+        instancia_b = app_rapido.RegistroJobs(os.path.join(trabalho, 'jobs_b.db'))
+        verificar('B lê o job concluído por A',
+                  aguardar(lambda: (instancia_b.obter(id_processo) or {}).get('estado') == 'concluido'))
+        verificar('B acha o corte pela chave', aguardar(lambda: instancia_b.obter_por_chave(chave) is not None))
+        anterior = instancia_b.obter_por_chave(chave)
+        os.remove(caminho)  # Só no armazém: B serviria por redirect para a URL assinada
+        verificar('artefato disponível sem a cópia local', app_rapido.artefato_disponivel(anterior['caminho']))
+
+        # Falha do armazém: o estado é reenviado com espera e chega
+        gravar_json = armazem.gravar_json
+        falhas = [2]
+
+        def gravar_instavel(nome_json, dados):
+            if falhas[0]:
+                falhas[0] -= 1
+                raise IOError('armazém indisponível')
+            gravar_json(nome_json, dados)
+
+        armazem.gravar_json = gravar_instavel
+        try:
+            app_rapido.espelho_estado.publicar('estado/reenvio.json', {'estado': 'concluido'})
+            verificar('estado publicado depois de falhas do armazém',
+                      aguardar(lambda: armazem.ler_json('estado/reenvio.json') == {'estado': 'concluido'}))
+        finally:
+            armazem.gravar_json = gravar_json
+        armazem.remover('estado/reenvio.json')
+        print("✅ Armazém S3 verificado")
+    finally:
+        if servidor:
+            servidor.stop()
+
+
+if __name__ == '__main__':
+    main()
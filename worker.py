@@ -0,0 +1,142 @@
+"""Worker da fila durável: roda download e corte fora do processo web.
+
+Uso: MODO_EXECUCAO=fila python worker.py (o web com o mesmo MODO_EXECUCAO só enfileira).
+Vários workers no mesmo host dividem a fila (REGISTRO_DB). SIGTERM para de reservar jobs e espera os
+que estão em andamento; se o processo morrer antes, o lease vence e outro worker retoma o job.
+"""
+import os
+import signal
+import socket
+import threading
+from prometheus_client import start_http_server
+from app_rapido import (
+    logger, registro_jobs, fila_jobs, EstacionarJob, MODO_EXECUCAO, MAX_WORKERS_DOWNLOAD, MAX_WORKERS_CORTE,
+    LEASE_FILA_SEGUNDOS, INTERVALO_POLL_FILA, AQUECIMENTO, aquecimento, etapa_download, etapa_download_lote,
+    executar_corte_extremo, executar_corte_lote, liberar_fonte, anunciar_retentativa, registrar_falha
+)
+
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', MAX_WORKERS_DOWNLOAD))
+PORTA_METRICAS_WORKER = os.environ.get('PORTA_METRICAS_WORKER')  # /metrics do worker (o web não vê estes jobs)
+
+class WorkerFila:
+    """Threads que reservam jobs da fila; uma delas renova os leases de todos os jobs em andamento"""
+
+    def __init__(self, threads):
+        self.nome = f"{socket.gethostname()}-{os.getpid()}"
+        self.threads = threads
+        self.semaforo_corte = threading.BoundedSemaphore(MAX_WORKERS_CORTE)  # Um ffmpeg por núcleo
+        self.reservas = set()
+        self.lock = threading.Lock()
+        self.parar = threading.Event()
+        self.encerrado = threading.Event()
+        self.consumidores = []
+        self.atendidos = 0
+
+    def iniciar(self):
+        for indice in range(self.threads):
+            thread = threading.Thread(target=self._consumir, name=f'worker-{indice + 1}')
+            thread.start()
+            self.consumidores.append(thread)
+        batimento = threading.Thread(target=self._batimento, name='worker-lease')
+        batimento.daemon = True
+        batimento.start()
+        logger.info(f"👷 Worker {self.nome}: {self.threads} jobs, {MAX_WORKERS_CORTE} cortes, "
+                    f"lease de {LEASE_FILA_SEGUNDOS}s")
+
+    def aguardar(self):
+        """Bloqueia até todas as threads terminarem (após parar)"""
+        for thread in self.consumidores:
+            while thread.is_alive():
+                thread.join(1)
+        self.encerrado.set()
+        logger.info(f"👋 Worker {self.nome} encerrado ({self.atendidos} jobs)")
+
+    def _batimento(self):
+        # Continua depois de parar: os jobs em andamento terminam com o lease em dia
+        while not self.encerrado.wait(LEASE_FILA_SEGUNDOS / 3):
+            with self.lock:
+                reservas = list(self.reservas)
+            try:
+                fila_jobs.renovar(reservas)
+            except Exception as e:
+                logger.warning(f"⚠️  Falha ao renovar leases: {e}")
+
+    def _consumir(self):
+        while not self.parar.is_set():
+            try:
+                job = fila_jobs.reservar(self.nome)
+            except Exception as e:
+                logger.error(f"💥 Falha ao ler a fila: {e}")
+                job = None
+            if not job:
+                self.parar.wait(INTERVALO_POLL_FILA)
+                continue
+            with self.lock:
+                self.reservas.add(job['reserva'])
+            try:
+                self.executar(job)
+            except Exception as e:
+                logger.error(f"💥 {job['id_processo']} - ERRO NO WORKER: {e}")
+            finally:
+                with self.lock:
+                    self.reservas.discard(job['reserva'])
+                    self.atendidos += 1
+
+    def executar(self, job):
+        """Os dois estágios do job; EstacionarJob devolve o job à fila com a próxima tentativa agendada"""
+        id_processo, reserva, argumentos = job['id_processo'], job['reserva'], job['argumentos']
+        if job['entregas'] > 1:
+            logger.warning(f"♻️  {id_processo} - retomado após lease vencido (entrega {job['entregas']})")
+        fonte = None
+        try:
+            if job['tipo'] == 'lote':
+                registro_jobs.atualizar(id_processo, etapa='download')
+                fonte = etapa_download_lote(argumentos['url'], id_processo, job['tentativa'])
+            else:
+                registro_jobs.atualizar(id_processo, etapa='iniciando')
+                fonte = etapa_download(argumentos['url'], argumentos['inicio'], argumentos['fim'], id_processo,
+                                       argumentos['modo_download'], job['tentativa'], estacionar=True)
+            registro_jobs.atualizar(id_processo, etapa='aguardando_corte')
+        except EstacionarJob as e:
+            liberar_fonte(fonte, id_processo)
+            anunciar_retentativa(id_processo, e)
+            fila_jobs.adiar(reserva, e.espera, e.tentativa)
+            return
+        except Exception as e:
+            liberar_fonte(fonte, id_processo)
+            registro_jobs.falhar(id_processo, str(e))
+            registrar_falha('download', e)
+            logger.error(f"❌ {id_processo} - FALHA: {e}")
+            fila_jobs.concluir(reserva)
+            return
+
+        # Os executores de corte registram sucesso/falha e liberam a fonte
+        with self.semaforo_corte:
+            if job['tipo'] == 'lote':
+                executar_corte_lote(fonte, argumentos['url'], argumentos['clipes'], id_processo,
+                                    argumentos['formato_saida'])
+            else:
+                executar_corte_extremo(fonte, argumentos['inicio'], argumentos['fim'], id_processo,
+                                       argumentos['nome_arquivo'], argumentos['chave'], argumentos['formato_saida'])
+        fila_jobs.concluir(reserva)
+
+def main():
+    if MODO_EXECUCAO != 'fila':
+        logger.warning("⚠️  MODO_EXECUCAO não é 'fila': o web continua rodando os jobs nas próprias threads")
+    if PORTA_METRICAS_WORKER:
+        start_http_server(int(PORTA_METRICAS_WORKER))
+    worker = WorkerFila(WORKER_THREADS)
+
+    def encerrar(sinal, quadro):
+        logger.info(f"🛑 Sinal {sinal}: parando de reservar jobs, aguardando os em andamento")
+        worker.parar.set()
+
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+    if AQUECIMENTO:
+        aquecimento.iniciar()
+    worker.iniciar()
+    worker.aguardar()
+
+if __name__ == '__main__':
+    main()